@@ -17,6 +17,9 @@ parser.add_argument('-p', "--prefix", type=str, default=VACA_PREFIX,
                     help="prefix to be used")
 parser.add_argument('-l', "--lab", type=str, default=LAB_PREFIX,
                     help="laboratory name of accelerators")
+parser.add_argument('-s', '--snapshots', action='store_true',
+                    default=False,
+                    help="If present restore models from local cache")
 parser.add_argument('-u', "--update", type=str, default=VACA_UPDATE,
                     help="update frequency of fluctuating PV values [Hz]")
 args = parser.parse_args()
@@ -27,4 +30,5 @@ _os.environ['VACA_UPDATE'] = args.update
 import va.server
 
 # --- run VA
-va.server.run(args.lab, args.prefix, only_orbit=args.orbit, print_pvs=args.pvs)
+va.server.run(args.lab, args.prefix, only_orbit=args.orbit, print_pvs=args.pvs,
+              use_snapshots=args.snapshots)
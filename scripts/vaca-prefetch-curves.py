@@ -0,0 +1,50 @@
+#!/usr/local/bin/python-sirius -u
+
+import os as _os
+import argparse as _argparse
+from concurrent import futures as _futures
+LAB_PREFIX = _os.environ.get('LAB_PREFIX', 'sirius')
+
+
+# --- process arguments
+parser = _argparse.ArgumentParser(
+    description="Fill local cache of VACA excitation and pulse curves.")
+parser.add_argument('-r', '--refresh', action='store_true', default=False,
+                    help="If present read curves again from web server")
+parser.add_argument('-l', "--lab", type=str, default=LAB_PREFIX,
+                    help="laboratory name of accelerators")
+parser.add_argument('-j', "--jobs", type=int, default=8,
+                    help="number of curves read in parallel")
+args = parser.parse_args()
+
+# --- set environment LAB_PREFIX so that pvs subpackge can load correct models
+_os.environ['LAB_PREFIX'] = args.lab
+_os.environ['VACA_OFFLINE'] = '0'
+from va import curves_cache
+from va import utils
+from va.excitation_curve import ExcitationCurve
+from va.pulse_curve import PulseCurve
+from va.pvs import li, tb, bo, ts, si
+
+curves_cache.REFRESH = args.refresh
+
+# --- collect curve file names of all sections
+excitation_curves, pulse_curves = set(), set()
+for module in (li, tb, bo, ts, si):
+    mapping = module.device_names.get_excitation_curve_mapping(
+        module.accelerator)
+    excitation_curves.update(fname for fname, _ in mapping.values())
+    mapping = module.device_names.get_pulse_curve_mapping(module.accelerator)
+    pulse_curves.update(mapping.values())
+
+# --- read and cache curves
+with _futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+    jobs = [executor.submit(ExcitationCurve, fname)
+            for fname in sorted(excitation_curves)]
+    jobs += [executor.submit(PulseCurve, fname)
+             for fname in sorted(pulse_curves)]
+    nr_failed = sum(1 for job in jobs if job.exception() is not None)
+
+print('{} curves cached in {} ({} failed)'.format(
+    len(jobs) - nr_failed, utils.get_cache_dir(curves_cache.CURVES_DIR),
+    nr_failed))
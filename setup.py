@@ -20,6 +20,7 @@ setup(
     ],
     packages=['va'],
     package_data={'va': ['VERSION', 'pvs/*.py']},
-    scripts=['scripts/vaca-ioc.py', 'scripts/vaca-state-save.py', 'scripts/vaca-state-load.py'],
+    scripts=['scripts/vaca-ioc.py', 'scripts/vaca-state-save.py', 'scripts/vaca-state-load.py',
+             'scripts/vaca-prefetch-curves.py'],
     zip_safe=False
 )
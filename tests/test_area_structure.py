@@ -0,0 +1,193 @@
+"""Tests of PV publication from area structures to the driver."""
+
+import os
+import queue
+import tempfile
+import unittest
+
+import numpy as np
+
+from va import utils
+from va.area_structure import AreaStructure
+from va.shared_arrays import SharedPVArrays
+
+
+CURRENT_PV = 'SI-Glob:AP-CurrInfo:Current-Mon'
+LIFETIME_PV = 'SI-Glob:AP-CurrInfo:Lifetime-Mon'
+BPM_PV = 'SI-01M1:DI-BPM:PosX-Mon'
+TIMESTAMP_PV = 'SI-Glob:VA-Control:OrbitTimestamp-Mon'
+
+
+class _PVModule:
+
+    @staticmethod
+    def get_dynamical_pvs():
+        return [CURRENT_PV, BPM_PV]
+
+    @staticmethod
+    def get_read_only_pvs():
+        return [LIFETIME_PV]
+
+
+class _Section(AreaStructure):
+
+    prefix = 'SI'
+    pv_module = _PVModule
+    database = {
+        CURRENT_PV: {'type': 'float', 'count': 1},
+        LIFETIME_PV: {'type': 'float', 'count': 1},
+        BPM_PV: {'type': 'float', 'count': 2},
+    }
+
+    def __init__(self, **kwargs):
+        self.values = {CURRENT_PV: 100.0, LIFETIME_PV: 10.0,
+                       BPM_PV: np.zeros(2)}
+        super().__init__(**kwargs)
+
+    def _get_pv(self, pv_name):
+        return self.values[pv_name]
+
+    def _set_pv(self, pv_name, value):
+        self.values[pv_name] = value
+
+
+class TestPVPublication(unittest.TestCase):
+
+    def setUp(self):
+        self.driver_queue = queue.Queue()
+        self.pv_names = utils.get_pv_names_table(_Section.database)
+
+    def _create_section(self, shared_arrays=None):
+        return _Section(
+            others_queue={'driver': self.driver_queue},
+            my_queue=queue.Queue(), shared_arrays=shared_arrays,
+            log_func=lambda *args, **kwargs: None)
+
+    def _get_messages(self, cmd):
+        messages = []
+        while not self.driver_queue.empty():
+            message = self.driver_queue.get()
+            if message[0] == cmd:
+                messages.append(message[1])
+        return messages
+
+    def _get_published_values(self):
+        values = dict()
+        for prefix, indices, pvs_values in self._get_messages('b'):
+            self.assertEqual(prefix, 'SI')
+            for idx, value in zip(indices, pvs_values):
+                values[self.pv_names[idx]] = value
+        return values
+
+    def test_values_are_sent_in_one_bulk_message(self):
+        section = self._create_section()
+        section.process()
+        messages = self._get_messages('b')
+        self.assertEqual(len(messages), 1)
+        _, indices, values = messages[0]
+        self.assertEqual(
+            {self.pv_names[idx] for idx in indices}, {CURRENT_PV, BPM_PV})
+
+    def test_only_changed_values_are_sent(self):
+        section = self._create_section()
+        section.process()
+        self._get_messages('b')
+        section.process()
+        self.assertEqual(self._get_published_values(), dict())
+        section.values[CURRENT_PV] = 99.0
+        section.process()
+        self.assertEqual(self._get_published_values(), {CURRENT_PV: 99.0})
+
+    def test_read_only_values_are_sent_on_state_change(self):
+        section = self._create_section()
+        section.process()
+        self.assertNotIn(LIFETIME_PV, self._get_published_values())
+        section._state_changed = True
+        section.process()
+        self.assertEqual(self._get_published_values(), {LIFETIME_PV: 10.0})
+
+    def test_values_not_in_database_are_sent_by_name(self):
+        section = self._create_section()
+        section._send_pv_to_driver(TIMESTAMP_PV, 1.0)
+        section._flush_pvs_to_driver()
+        self.assertEqual(self._get_messages('s'), [(TIMESTAMP_PV, 1.0)])
+
+    def test_values_are_kept_while_driver_queue_is_full(self):
+        self.driver_queue = queue.Queue(maxsize=1)
+        self.driver_queue.put(('t', None))
+        section = self._create_section()
+        section.process()
+        self.driver_queue.get()
+        section.values[CURRENT_PV] = 99.0
+        section.process()
+        values = self._get_published_values()
+        self.assertEqual(values[CURRENT_PV], 99.0)
+        self.assertIn(BPM_PV, values)
+
+    def test_arrays_are_published_in_shared_memory(self):
+        arrays = SharedPVArrays.from_database(_Section.database)
+        try:
+            section = self._create_section(shared_arrays=arrays)
+            section.values[BPM_PV] = np.array([1.0, 2.0])
+            section.process()
+            self.assertNotIn(BPM_PV, self._get_published_values())
+            np.testing.assert_array_equal(arrays.read()[BPM_PV], [1.0, 2.0])
+        finally:
+            arrays.close()
+
+    def test_messages_wait_in_order_while_driver_queue_is_full(self):
+        self.driver_queue = queue.Queue(maxsize=1)
+        self.driver_queue.put(('t', None))
+        section = self._create_section()
+        section._send_message('driver', ('sp', []))
+        section._send_message('driver', ('i', 'SI'))
+        self.assertEqual(self.driver_queue.get(), ('t', None))
+        section.process()
+        self.assertEqual(self.driver_queue.get(), ('sp', []))
+        section.process()
+        self.assertEqual(self.driver_queue.get(), ('i', 'SI'))
+
+    def test_superseded_parameters_are_coalesced(self):
+        li_queue = queue.Queue(maxsize=1)
+        li_queue.put(('p', {'injection_cycle': 0}))
+        section = self._create_section()
+        section._others_queue['LI'] = li_queue
+        section._send_parameters_to_other_area_structure(
+            'LI', {'update_delays': 1})
+        section._send_parameters_to_other_area_structure(
+            'LI', {'update_delays': 2})
+        li_queue.get()
+        section.process()
+        self.assertEqual(li_queue.get(), ('p', {'update_delays': 2}))
+        self.assertTrue(li_queue.empty())
+
+    def test_only_model_writes_are_pending(self):
+        section = self._create_section()
+        section._is_model_write = lambda pv_name: pv_name == BPM_PV
+        section._my_queue.put(('s', (CURRENT_PV, 0.0)))
+        self.assertFalse(section._has_pending_writes())
+        self.assertTrue(section.has_pending_requests())
+        section._my_queue.put(('s', (BPM_PV, 1.0)))
+        self.assertTrue(section._has_pending_writes())
+        section.process()
+        self.assertFalse(section.has_pending_requests())
+
+    def test_initialisation_sign_can_be_sent_again(self):
+        cache_dir = utils.CACHE_DIR
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            utils.CACHE_DIR = tmp_dir
+            try:
+                section = self._create_section()
+                section._send_initialisation_sign()
+                section._send_initialisation_sign()
+            finally:
+                utils.CACHE_DIR = cache_dir
+            self.assertEqual(self._get_messages('i'), ['SI', 'SI'])
+            path = os.path.join(tmp_dir, utils.STARTUP_DIR,
+                                'startup-{}.jsonl'.format(utils.VERSION))
+            with open(path) as f:
+                self.assertEqual(len(f.readlines()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+"""Tests of warm started closed orbit solves."""
+
+import types
+import unittest
+from unittest import mock
+
+import numpy as np
+import pyaccel
+
+from va.accelerators_model import RingModel
+
+
+class _Ring(RingModel):
+    """Ring model with only the state needed for closed orbit solves."""
+
+    def __init__(self, orbit):
+        self._orbit = orbit
+        self._log = lambda *args, **kwargs: None
+        self.model_module = types.SimpleNamespace(lattice_version='test')
+        self._find_closed_orbit_from = mock.Mock(return_value='orbit')
+
+
+class TestWarmStart(unittest.TestCase):
+
+    def setUp(self):
+        self.orbit = np.zeros((6, 3))
+        self.orbit[:, 0] = 1e-4
+
+    def test_solve_starts_from_last_orbit(self):
+        ring = _Ring(self.orbit)
+        self.assertEqual(ring._find_closed_orbit(), 'orbit')
+        guess, = ring._find_closed_orbit_from.call_args[0]
+        np.testing.assert_array_equal(guess, self.orbit[:, 0])
+
+    def test_failed_warm_start_falls_back_to_cold_start(self):
+        ring = _Ring(self.orbit)
+        ring._find_closed_orbit_from.side_effect = [
+            pyaccel.tracking.TrackingException, 'orbit']
+        self.assertEqual(ring._find_closed_orbit(), 'orbit')
+        self.assertEqual(ring._find_closed_orbit_from.call_count, 2)
+        self.assertEqual(ring._find_closed_orbit_from.call_args[0], (None, ))
+
+    def test_solve_starts_cold_without_valid_orbit(self):
+        for orbit in (None, np.full((6, 3), np.nan)):
+            with self.subTest(orbit=orbit):
+                ring = _Ring(orbit)
+                self.assertEqual(ring._find_closed_orbit(), 'orbit')
+                ring._find_closed_orbit_from.assert_called_once_with(None)
+
+
+if __name__ == '__main__':
+    unittest.main()
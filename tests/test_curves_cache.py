@@ -0,0 +1,121 @@
+"""Tests of local cache of excitation and pulse curves."""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from va import curves_cache
+from va import utils
+
+
+TEXT = '# curve\n0 0.0\n1 0.5\n2 1.0\n'
+NEW_TEXT = '# curve\n0 0.0\n1 0.6\n2 1.2\n'
+
+
+def _parse(text):
+    rows = [line.split() for line in text.splitlines()
+            if not line.startswith('#')]
+    data = np.array(rows, dtype=float)
+    return {'currents': data[:, 0], 'fields': data[:, 1],
+            'nr_points': len(rows)}
+
+
+class TestCurvesCache(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        for patcher in (
+                mock.patch.object(utils, 'CACHE_DIR', tmp_dir.name),
+                mock.patch.object(curves_cache, '_memo', dict()),
+                mock.patch.object(curves_cache, 'OFFLINE', False),
+                mock.patch.object(curves_cache, 'REFRESH', False),
+                mock.patch.object(curves_cache, 'REVALIDATE_INTERVAL', 3600),
+                mock.patch.object(
+                    curves_cache, 'magnets_excitation_data_read',
+                    return_value=TEXT)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.read = curves_cache.magnets_excitation_data_read
+        self.curves_dir = os.path.join(tmp_dir.name, curves_cache.CURVES_DIR)
+
+    def _check_data(self, data, text=TEXT):
+        expected = _parse(text)
+        self.assertEqual(sorted(data), sorted(expected))
+        for key, value in expected.items():
+            np.testing.assert_array_equal(data[key], value)
+
+    def test_curve_is_read_once(self):
+        data = curves_cache.get_curve('si-quadrupole.txt', _parse)
+        self._check_data(data)
+        self.assertIs(curves_cache.get_curve('si-quadrupole.txt', _parse), data)
+        self.read.assert_called_once_with('si-quadrupole.txt')
+
+    def test_curve_is_loaded_from_disk(self):
+        curves_cache.get_curve('si-quadrupole.txt', _parse)
+        curves_cache._memo.clear()
+        data = curves_cache.get_curve('si-quadrupole.txt', _parse)
+        self._check_data(data)
+        self.assertEqual(self.read.call_count, 1)
+
+    def test_files_with_same_contents_share_data(self):
+        curves_cache.get_curve('si-quadrupole.txt', _parse)
+        curves_cache.get_curve('bo-quadrupole.txt', _parse)
+        files = sorted(os.listdir(self.curves_dir))
+        self.assertEqual(len(files), 2)
+        self.assertIn(curves_cache._ENTRIES_DIR, files)
+        entries = os.listdir(
+            os.path.join(self.curves_dir, curves_cache._ENTRIES_DIR))
+        self.assertEqual(len(entries), 2)
+
+    def test_missing_curve_is_error_when_offline(self):
+        curves_cache.OFFLINE = True
+        with self.assertRaises(FileNotFoundError):
+            curves_cache.get_curve('si-quadrupole.txt', _parse)
+        self.read.assert_not_called()
+
+    def test_curves_are_read_again_on_refresh(self):
+        curves_cache.get_curve('si-quadrupole.txt', _parse)
+        curves_cache._memo.clear()
+        curves_cache.REFRESH = True
+        curves_cache.get_curve('si-quadrupole.txt', _parse)
+        self.assertEqual(self.read.call_count, 2)
+
+
+    def test_stale_curves_are_revalidated(self):
+        parser = mock.Mock(wraps=_parse)
+        curves_cache.get_curve('si-quadrupole.txt', parser)
+        curves_cache._memo.clear()
+        curves_cache.REVALIDATE_INTERVAL = -1
+        data = curves_cache.get_curve('si-quadrupole.txt', parser)
+        self._check_data(data)
+        self.assertEqual(self.read.call_count, 2)
+        self.assertEqual(parser.call_count, 1)  # contents did not change
+
+        curves_cache._memo.clear()
+        self.read.return_value = NEW_TEXT
+        data = curves_cache.get_curve('si-quadrupole.txt', parser)
+        self._check_data(data, NEW_TEXT)
+        self.assertEqual(parser.call_count, 2)
+
+    def test_stale_curves_are_used_when_server_fails(self):
+        curves_cache.get_curve('si-quadrupole.txt', _parse)
+        curves_cache._memo.clear()
+        curves_cache.REVALIDATE_INTERVAL = -1
+        self.read.side_effect = OSError('server down')
+        self._check_data(curves_cache.get_curve('si-quadrupole.txt', _parse))
+
+    def test_stale_curves_are_used_when_offline(self):
+        curves_cache.get_curve('si-quadrupole.txt', _parse)
+        curves_cache._memo.clear()
+        curves_cache.REVALIDATE_INTERVAL = -1
+        curves_cache.OFFLINE = True
+        self._check_data(curves_cache.get_curve('si-quadrupole.txt', _parse))
+        self.assertEqual(self.read.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
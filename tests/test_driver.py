@@ -0,0 +1,175 @@
+"""Tests of processing of client writes and reads in the driver."""
+
+import os
+import queue
+import threading
+import types
+import unittest
+from unittest import mock
+
+from va import driver
+
+
+PV1 = 'SI-01M1:PS-CH:Current-SP'
+PV2 = 'SI-01M1:PS-CV:Current-SP'
+CMD_PV = 'SI-Glob:VA-Control:BeamCurrentDump-Cmd'
+ADD_PV = 'SI-Glob:VA-Control:BeamCurrentAdd-SP'
+MON_PV = 'SI-13C4:DI-DCCT:Current-Mon'
+
+
+def _create_process(prefix, maxsize=0):
+    return types.SimpleNamespace(
+        area_structure_prefix=prefix, my_queue=queue.Queue(maxsize))
+
+
+class TestWriteCoalescing(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(driver.Driver, 'setParam')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.driver = driver.PCASDriver.__new__(driver.PCASDriver)
+        self.driver._internal_queue = queue.Queue()
+        self.driver._wakeup_r, self.driver._wakeup_w = os.pipe()
+        os.set_blocking(self.driver._wakeup_r, False)
+        self.addCleanup(os.close, self.driver._wakeup_r)
+        self.addCleanup(os.close, self.driver._wakeup_w)
+        self.driver._pending_writes = dict()
+        self.driver._writes_count = 0
+        self.driver._dropped_writes = 0
+
+    def _write(self, process, reason, value):
+        self.driver._internal_queue.put((process, reason, value))
+
+    def _get_writes(self, process):
+        writes = []
+        while not process.my_queue.empty():
+            cmd, data = process.my_queue.get()
+            self.assertEqual(cmd, 's')
+            writes.append(data)
+        return writes
+
+    def test_latest_value_of_each_pv_is_forwarded(self):
+        process = _create_process('SI')
+        self._write(process, PV1, 1.0)
+        self._write(process, PV1, 2.0)
+        self._write(process, PV2, 3.0)
+        self.driver._process_writes()
+        self.assertEqual(
+            self._get_writes(process), [(PV1, 2.0), (PV2, 3.0)])
+        self.assertEqual(self.driver._dropped_writes, 1)
+
+    def test_commands_are_not_coalesced(self):
+        process = _create_process('SI', maxsize=1)
+        process.my_queue.put(('p', None))
+        self._write(process, CMD_PV, 1)
+        self._write(process, CMD_PV, 1)
+        self.driver._process_writes()
+        self.assertEqual(len(self.driver._pending_writes), 2)
+        process.my_queue.get()
+        writes = []
+        while self.driver._pending_writes:
+            self.driver._process_writes()
+            writes += self._get_writes(process)
+        self.assertEqual(writes, [(CMD_PV, 1), (CMD_PV, 1)])
+        self.assertEqual(self.driver._dropped_writes, 0)
+
+    def test_beam_current_additions_are_not_coalesced(self):
+        process = _create_process('SI')
+        self._write(process, ADD_PV, 1.0)
+        self._write(process, PV1, 1.0)
+        self._write(process, ADD_PV, 2.0)
+        self.driver._process_writes()
+        self.assertEqual(
+            self._get_writes(process),
+            [(ADD_PV, 1.0), (PV1, 1.0), (ADD_PV, 2.0)])
+        self.assertEqual(self.driver._dropped_writes, 0)
+
+    def test_writes_are_coalesced_while_queue_is_full(self):
+        process = _create_process('SI', maxsize=1)
+        process.my_queue.put(('p', None))
+        self._write(process, PV1, 1.0)
+        self._write(process, PV2, 1.0)
+        self.driver._process_writes()
+        self._write(process, PV1, 2.0)
+        self.driver._process_writes()
+        self.assertEqual(self.driver._dropped_writes, 1)
+
+        process.my_queue.get()
+        writes = []
+        while self.driver._pending_writes:
+            self.driver._process_writes()
+            writes += self._get_writes(process)
+        self.assertEqual(writes, [(PV1, 2.0), (PV2, 1.0)])
+
+    def test_full_queue_does_not_hold_back_other_sections(self):
+        si_process = _create_process('SI', maxsize=1)
+        si_process.my_queue.put(('p', None))
+        bo_process = _create_process('BO')
+        self._write(si_process, PV1, 1.0)
+        self._write(bo_process, 'BO-01U:PS-CH:Current-SP', 1.0)
+        self.driver._process_writes()
+        self.assertEqual(
+            self._get_writes(bo_process),
+            [('BO-01U:PS-CH:Current-SP', 1.0)])
+        self.assertEqual(list(self.driver._pending_writes), [PV1])
+
+
+
+class TestClientReads(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(driver.Driver, 'read', return_value=1.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.driver = driver.PCASDriver.__new__(driver.PCASDriver)
+        self.driver._wakeup_r, self.driver._wakeup_w = os.pipe()
+        os.set_blocking(self.driver._wakeup_w, False)
+        self.addCleanup(os.close, self.driver._wakeup_r)
+        self.addCleanup(os.close, self.driver._wakeup_w)
+        self.process = _create_process('SI')
+        self.driver._processes = {'SI': self.process}
+        self.driver._processes_watched_pvs = {'SI': frozenset()}
+        self.driver._processes_evaluated_pvs = {'SI': frozenset([MON_PV])}
+        self.driver._pvs_read = dict()
+        self.driver._evaluations = set()
+        self.driver._evaluations_lock = threading.Lock()
+        self.driver._process_shared_arrays = mock.Mock(return_value=0)
+
+    def _get_requests(self):
+        requests = []
+        while not self.process.my_queue.empty():
+            requests.append(self.process.my_queue.get())
+        return requests
+
+    def test_unwatched_pv_is_evaluated_in_background(self):
+        self.assertEqual(self.driver.read(MON_PV), 1.0)
+        self.assertEqual(self.driver.read(MON_PV), 1.0)
+        self.assertEqual(self._get_requests(), [('r', {MON_PV})])
+
+        self.driver._process_request(('e', ('SI', {MON_PV})))
+        self.driver._process_shared_arrays.assert_called_once_with()
+        self.driver.read(MON_PV)
+        self.assertEqual(self._get_requests(), [('r', {MON_PV})])
+
+    def test_watched_pv_is_not_requested(self):
+        self.driver._processes_watched_pvs['SI'] = frozenset([MON_PV])
+        self.assertEqual(self.driver.read(MON_PV), 1.0)
+        self.driver.read(PV1)
+        self.assertEqual(self._get_requests(), [])
+
+    def test_pvs_are_not_watched_if_monitors_are_unknown(self):
+        self.driver._watch_update_time = 0.0
+        with mock.patch.object(driver, '_pcas_manager', None):
+            self.driver._update_watched_pvs()
+        self.assertEqual(self._get_requests(), [])
+
+    def test_request_is_dropped_when_queue_is_full(self):
+        self.process.my_queue = queue.Queue(1)
+        self.process.my_queue.put(('p', None))
+        self.assertEqual(self.driver.read(MON_PV), 1.0)
+        self.assertEqual(self.driver._evaluations, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
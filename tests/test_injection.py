@@ -0,0 +1,168 @@
+"""Tests of charge loss fraction estimates."""
+
+import os
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import numpy as np
+import pyaccel
+import pymodels
+
+from va import injection
+
+
+ENERGY_SPREAD = 1e-3
+EMITTANCE = 3.5e-9  # [m·rad]
+NR_ELEMENTS = 200  # elements of booster lattice used in tests
+
+
+def _calc_loss_fraction_by_offset(accelerator, init_twiss):
+    """Loss fraction in ring tracking one energy offset at a time."""
+    hmax = np.array([ele.hmax for ele in accelerator])
+    hmin = np.array([ele.hmin for ele in accelerator])
+    vmax = np.array([ele.vmax for ele in accelerator])
+    vmin = np.array([ele.vmin for ele in accelerator])
+    twiss, *_ = pyaccel.optics.calc_twiss(
+        accelerator, init_twiss=init_twiss, indices='open')
+    betax, etax = twiss.betax, twiss.etax
+    betay, etay = twiss.betay, twiss.etay
+    de = np.linspace(
+        -3*ENERGY_SPREAD, 3*ENERGY_SPREAD, injection.NR_ENERGY_OFFSETS)
+    de_probability = np.exp(-(de**2)/(2*(ENERGY_SPREAD**2)))
+    lost_fraction = np.zeros(len(de))
+    for i in range(len(de)):
+        pos = [p for p in init_twiss.co]
+        pos[4] += de[i]
+        orbit, *_ = pyaccel.tracking.linepass(accelerator, pos, indices='open')
+        if np.isnan(orbit[0, -1]):
+            lost_fraction[i] = 1.0
+            continue
+        rx, ry = orbit[[0, 2], :]
+        xlim_inf = np.maximum(rx - hmin, 0)
+        xlim_sup = np.maximum(hmax - rx, 0)
+        ylim_inf = np.maximum(ry - vmin, 0)
+        ylim_sup = np.maximum(vmax - ry, 0)
+        emit_x_inf = (xlim_inf**2 - (etax*ENERGY_SPREAD)**2)/betax
+        emit_x_sup = (xlim_sup**2 - (etax*ENERGY_SPREAD)**2)/betax
+        emit_y_inf = (ylim_inf**2 - (etay*ENERGY_SPREAD)**2)/betay
+        emit_y_sup = (ylim_sup**2 - (etay*ENERGY_SPREAD)**2)/betay
+        min_emit_x = max(np.amin([emit_x_inf, emit_x_sup]), 0.0)
+        min_emit_y = max(np.amin([emit_y_inf, emit_y_sup]), 0.0)
+        min_emit = min_emit_x+min_emit_y if min_emit_x*min_emit_y != 0 else 0.0
+        lost_fraction[i] = min(np.exp(-min_emit/EMITTANCE), 1.0)
+    total = np.sum(de_probability*lost_fraction)/np.sum(de_probability)
+    return min(total, 1.0)
+
+
+class TestRingLossFraction(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        twiss, *_ = pyaccel.optics.calc_twiss(pymodels.bo.create_accelerator())
+        cls.init_twiss = twiss[0].make_dict()
+
+    def setUp(self):
+        self.accelerator = pymodels.bo.create_accelerator()[:NR_ELEMENTS]
+        self.accmodel = types.SimpleNamespace(
+            accelerator=self.accelerator, prefix='BO',
+            log=lambda *args, **kwargs: None)
+
+    def _check_loss_fraction(self):
+        loss_fraction = injection.calc_charge_loss_fraction_in_ring(
+            self.accmodel, init_twiss=dict(self.init_twiss),
+            energy_spread=ENERGY_SPREAD, emittance=EMITTANCE,
+            transverse_samples=0)
+        expected = _calc_loss_fraction_by_offset(
+            self.accelerator, pyaccel.optics.Twiss.make_new(self.init_twiss))
+        self.assertAlmostEqual(loss_fraction, expected, places=12)
+        return loss_fraction
+
+    def test_all_offsets_tracked_at_once(self):
+        self._check_loss_fraction()
+
+    def test_lost_offsets(self):
+        # aperture between orbits of lowest and highest energy offsets
+        orbits = []
+        for de in (-3*ENERGY_SPREAD, 3*ENERGY_SPREAD):
+            pos = np.array(self.init_twiss['co'], dtype=float)
+            pos[4] += de
+            orbit, *_ = pyaccel.tracking.linepass(
+                self.accelerator, pos, indices='open')
+            orbits.append(orbit[0])
+        idx = np.argmax(np.abs(orbits[1] - orbits[0]))
+        x_low, x_high = orbits[0][idx], orbits[1][idx]
+        if x_high > x_low:
+            self.accelerator[idx].hmax = (x_low + x_high)/2
+        else:
+            self.accelerator[idx].hmin = (x_low + x_high)/2
+        self.accelerator.vchamber_on = True
+        self.assertGreater(self._check_loss_fraction(), 0.0)
+
+
+
+def _create_init_twiss():
+    return types.SimpleNamespace(
+        co=np.zeros(6), betax=10.0, alphax=1.0, etax=0.1, etapx=0.0,
+        betay=5.0, alphay=-1.0, etay=0.0, etapy=0.0)
+
+
+def _lose_half(func, lattices, batches):
+    return [batch.shape[1]//2 for batch in batches]
+
+
+class TestMonteCarloEstimator(unittest.TestCase):
+
+    def setUp(self):
+        self.estimator = injection.MonteCarloEstimator(nr_processes=2)
+        self.estimator._pool = mock.Mock()
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(lambda: os.path.exists(path) and os.remove(path))
+        self.lattice = (path, dict(), 'open', None, None, None, None)
+        self.cancelled = mock.Mock(**{'is_set.return_value': False})
+
+    def _calc_loss_fraction(self):
+        return self.estimator._calc_loss_fraction(
+            self.lattice, _create_init_twiss(), ENERGY_SPREAD, EMITTANCE,
+            0.01, self.cancelled)
+
+    def test_sampling_stops_at_target_error(self):
+        self.estimator._pool.map.return_value = [0, 0]
+        loss_fraction, error, nr_tracked = self._calc_loss_fraction()
+        self.assertEqual((loss_fraction, error), (0.0, 0.0))
+        self.assertEqual(nr_tracked, injection.MC_MIN_PARTICLES)
+        self.assertFalse(os.path.exists(self.lattice[0]))
+
+    def test_sampling_stops_at_maximum_particles(self):
+        self.estimator._pool.map.side_effect = _lose_half
+        with mock.patch.object(injection, 'MC_MAX_PARTICLES', 2000):
+            loss_fraction, error, nr_tracked = self._calc_loss_fraction()
+        self.assertEqual(loss_fraction, 0.5)
+        self.assertGreater(error, injection.MC_TARGET_ERROR)
+        self.assertEqual(nr_tracked, 2000)
+
+    def test_cancelled_calculation_returns_none(self):
+        self.cancelled.is_set.return_value = True
+        self.assertIsNone(self._calc_loss_fraction())
+        self.estimator._pool.map.assert_not_called()
+        self.assertFalse(os.path.exists(self.lattice[0]))
+
+    def test_beam_is_matched_to_twiss(self):
+        init_twiss = _create_init_twiss()
+        particles = injection._generate_beam(
+            init_twiss, ENERGY_SPREAD, EMITTANCE, 0.0, 200000)
+        delta = particles[4]
+        rx = particles[0] - init_twiss.etax*delta
+        px = particles[1] - init_twiss.etapx*delta
+        emittance = np.sqrt(np.mean(rx**2)*np.mean(px**2) - np.mean(rx*px)**2)
+        self.assertAlmostEqual(np.std(delta)/ENERGY_SPREAD, 1.0, places=1)
+        self.assertAlmostEqual(emittance/EMITTANCE, 1.0, places=1)
+        self.assertAlmostEqual(
+            np.mean(rx**2)/emittance/init_twiss.betax, 1.0, places=1)
+        self.assertFalse(np.any(particles[2]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""Tests of closed orbit updates from linear response to correctors."""
+
+import types
+import unittest
+
+import numpy as np
+import pyaccel
+import pymodels
+
+from va import accelerators_model
+from va.accelerators_model import Plane, RingModel
+
+
+KICK = 1e-6  # [rad]
+
+
+class _Ring(RingModel):
+    """Ring model with only the state needed for orbit calculations."""
+
+    def __init__(self, accelerator):
+        self._accelerator = accelerator
+        self._state_cache = dict()
+        self._lattice_changed = False
+        self._orbit_response = None
+        self._fast_orbit = None
+        self._log = lambda *args, **kwargs: None
+        self.model_module = types.SimpleNamespace(lattice_version='test')
+        self.bpm_indices = np.array(pyaccel.lattice.find_indices(
+            accelerator, 'fam_name', 'BPM'), dtype=int)
+        self._corrector_magnets = dict()
+        for fam_name, plane in (('CH', Plane.horizontal),
+                                ('CV', Plane.vertical)):
+            for idx in pyaccel.lattice.find_indices(
+                    accelerator, 'fam_name', fam_name):
+                magnet = types.SimpleNamespace(indices=[idx])
+                self._corrector_magnets[magnet] = plane
+
+    def _calc_bpm_slices(self):
+        return dict(), self.bpm_indices
+
+    def solve(self):
+        """Full orbit and optics solve, as done after lattice changes."""
+        self._fast_orbit = None
+        self._orbit = self._find_closed_orbit_from(None)
+        self._twiss, self._m66 = pyaccel.optics.calc_twiss(
+            self._accelerator, fixed_point=self._orbit[:, 0])
+        self._tunes = pyaccel.optics.get_frac_tunes(m1turn=self._m66)
+        self._init_orbit_response()
+
+
+def _add_kick(accelerator, idx, plane, kick):
+    element = accelerator[idx]
+    length = element.length if element.length != 0.0 else 1.0
+    if plane == Plane.horizontal:
+        polynom = element.polynom_b
+        polynom[0] -= kick/length
+        element.polynom_b = polynom
+    else:
+        polynom = element.polynom_a
+        polynom[0] += kick/length
+        element.polynom_a = polynom
+
+
+class TestOrbitResponse(unittest.TestCase):
+
+    def setUp(self):
+        self.accelerator = pymodels.si.create_accelerator()
+        self.accelerator.cavity_on = accelerators_model.TRACK6D
+        self.accelerator.radiation_on = accelerators_model.TRACK6D
+        self.model = _Ring(self.accelerator)
+        self.model.solve()
+        self.assertIsNotNone(self.model._orbit_response)
+
+    def _get_corrector(self, plane):
+        for magnet, plane_ in self.model._corrector_magnets.items():
+            if plane_ == plane:
+                return magnet.indices[0]
+
+    def _check_against_full_solve(self, plane, kick):
+        _add_kick(self.accelerator, self._get_corrector(plane), plane, kick)
+        orbit = self.model._orbit.copy()
+        self.assertTrue(self.model._calc_closed_orbit_from_response())
+        # full orbit is left as found by last full solve
+        np.testing.assert_array_equal(self.model._orbit, orbit)
+        bpm_orbit = self.model._get_bpm_orbit(self.model.bpm_indices)
+        expected = self.model._find_closed_orbit_from(None)[
+            :, self.model.bpm_indices]
+        change = np.abs(expected - orbit[:, self.model.bpm_indices]).max()
+        np.testing.assert_allclose(
+            bpm_orbit[[0, 2]], expected[[0, 2]], rtol=0, atol=0.05*change)
+
+    def test_horizontal_kick_matches_full_solve(self):
+        self._check_against_full_solve(Plane.horizontal, KICK)
+
+    def test_vertical_kick_matches_full_solve(self):
+        self._check_against_full_solve(Plane.vertical, KICK)
+
+    def test_large_kick_needs_full_solve(self):
+        plane = Plane.horizontal
+        _add_kick(self.accelerator, self._get_corrector(plane), plane,
+                  2*accelerators_model.ORBIT_FAST_MAX_KICK)
+        self.assertFalse(self.model._calc_closed_orbit_from_response())
+        self.assertIsNone(self.model._fast_orbit)
+
+    def test_large_tune_shift_needs_full_solve(self):
+        limit = accelerators_model.ORBIT_FAST_MAX_TUNE_SHIFT
+        try:
+            accelerators_model.ORBIT_FAST_MAX_TUNE_SHIFT = 0.0
+            plane = Plane.horizontal
+            _add_kick(self.accelerator, self._get_corrector(plane), plane,
+                      KICK)
+            self.assertFalse(self.model._calc_closed_orbit_from_response())
+        finally:
+            accelerators_model.ORBIT_FAST_MAX_TUNE_SHIFT = limit
+
+    def test_lattice_changes_need_full_solve(self):
+        self.model._lattice_changed = True
+        self.assertFalse(self.model._calc_closed_orbit_from_response())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""Tests of local cache of section PV databases."""
+
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+from va import utils
+from va.pvs import LocalData
+
+
+CURRENT_PV = 'SI-13C4:DI-DCCT:Current-Mon'
+POS_PV = 'SI-01M1:DI-BPM:PosX-Mon'
+SP_PV = 'SI-01M1:PS-CH:Current-SP'
+
+
+class _RecordNames(LocalData.RecordNames):
+    """Record names built from fixed lists, counting builds."""
+
+    nr_builds = 0
+
+    def _init_record_names(self):
+        _RecordNames.nr_builds += 1
+        self.all_record_names = {CURRENT_PV: {}, POS_PV: {}, SP_PV: {}}
+        self.database = {
+            CURRENT_PV: {'type': 'float', 'value': 0.0},
+            POS_PV: {'type': 'float', 'value': 0.0},
+            SP_PV: {'type': 'float', 'value': 0.0},
+            }
+        self.di_ro, self.di_rw = [CURRENT_PV, POS_PV], []
+        self.ps_ro, self.ps_rw = [], [SP_PV]
+        self.ap, self.rf, self.fk, self.fk_pos = [], [], [], []
+        self.ti, self.ti_ro, self.ti_rw = [], [], []
+
+
+class TestPVDatabaseCache(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        patcher = mock.patch.object(utils, 'CACHE_DIR', tmp_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        _RecordNames.nr_builds = 0
+
+    @staticmethod
+    def _create_record_names(lattice_version='si_v25_01'):
+        device_names = types.SimpleNamespace(
+            section='si', el_names={'DI': ['BPM', 'DCCT']},
+            fam_names={'PS': ['CH']}, glob_names={}, inj_names={})
+        model = types.SimpleNamespace(lattice_version=lattice_version)
+        return _RecordNames(
+            device_names, model, lambda: {'BPM': {'index': [1, 2]}})
+
+    def test_database_is_read_only_view(self):
+        database = self._create_record_names().get_database()
+        with self.assertRaises(TypeError):
+            database[SP_PV] = {}
+        self.assertIn(SP_PV, database)
+
+    def test_pv_lists_are_copies(self):
+        record_names = self._create_record_names()
+        record_names.get_read_only_pvs().append(SP_PV)
+        record_names.get_dynamical_pvs().append(SP_PV)
+        self.assertEqual(record_names.get_read_only_pvs(), [POS_PV])
+        self.assertEqual(record_names.get_dynamical_pvs(), [CURRENT_PV])
+
+    def test_database_is_built_once(self):
+        database = dict(self._create_record_names().get_database())
+        record_names = self._create_record_names()
+        self.assertEqual(dict(record_names.get_database()), database)
+        self.assertEqual(record_names.get_dynamical_pvs(), [CURRENT_PV])
+        self.assertEqual(record_names.get_read_only_pvs(), [POS_PV])
+        self.assertEqual(_RecordNames.nr_builds, 1)
+
+    def test_database_is_rebuilt_for_new_lattice(self):
+        self._create_record_names().get_database()
+        self._create_record_names('si_v26_01').get_database()
+        self.assertEqual(_RecordNames.nr_builds, 2)
+
+    def test_cache_key_follows_package_versions(self):
+        key = self._create_record_names().get_cache_key()
+        self.assertEqual(self._create_record_names().get_cache_key(), key)
+        with mock.patch.object(LocalData.lab_models, '__version__', 'other',
+                               create=True):
+            self.assertNotEqual(
+                self._create_record_names().get_cache_key(), key)
+
+
+if __name__ == '__main__':
+    unittest.main()
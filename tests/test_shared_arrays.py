@@ -0,0 +1,84 @@
+"""Tests of shared memory publication of PV arrays."""
+
+import pickle
+import unittest
+import multiprocessing
+
+import numpy as np
+
+from va.shared_arrays import SharedPVArrays
+
+
+BPM_PV = 'SI-01M1:DI-BPM:PosX-Mon'
+CURRENT_PV = 'SI-Glob:DI-DCCT:BbBCurrent-Mon'
+DATABASE = {
+    BPM_PV: {'type': 'float', 'count': 1},
+    CURRENT_PV: {'type': 'float', 'count': 4},
+    'SI-Glob:AP-CurrInfo:Current-Mon': {'type': 'float', 'count': 1},
+    'SI-01M1:DI-BPM:Name-Cte': {'type': 'string'},
+}
+
+
+def _write_in_child(arrays, values):
+    arrays.write(values)
+
+
+class TestSharedPVArrays(unittest.TestCase):
+
+    def setUp(self):
+        self.arrays = SharedPVArrays.from_database(DATABASE)
+
+    def tearDown(self):
+        self.arrays.close()
+
+    def test_layout_from_database(self):
+        self.assertIn(BPM_PV, self.arrays)
+        self.assertIn(CURRENT_PV, self.arrays)
+        self.assertNotIn('SI-Glob:AP-CurrInfo:Current-Mon', self.arrays)
+        self.assertNotIn('SI-01M1:DI-BPM:Name-Cte', self.arrays)
+        self.assertTrue(self.arrays.fits(CURRENT_PV, np.zeros(4)))
+        self.assertFalse(self.arrays.fits(CURRENT_PV, np.zeros(3)))
+        self.assertFalse(self.arrays.fits(BPM_PV, 'text'))
+
+    def test_read_returns_only_changed_values(self):
+        self.assertEqual(self.arrays.read(), dict())
+        self.arrays.write({BPM_PV: 1.5, CURRENT_PV: np.arange(4.0)})
+        values = self.arrays.read()
+        self.assertEqual(values[BPM_PV], 1.5)
+        np.testing.assert_array_equal(values[CURRENT_PV], np.arange(4.0))
+        self.assertEqual(self.arrays.read(), dict())
+        self.arrays.write({BPM_PV: 1.5, CURRENT_PV: np.ones(4)})
+        values = self.arrays.read()
+        self.assertEqual(set(values), {CURRENT_PV})
+
+    def test_first_zero_value_is_delivered(self):
+        self.arrays.write({BPM_PV: 0.0})
+        self.assertEqual(self.arrays.read(), {BPM_PV: 0.0})
+
+    def test_unwritten_values_are_not_delivered(self):
+        self.arrays.write({CURRENT_PV: np.zeros(4)})
+        self.assertEqual(set(self.arrays.read()), {CURRENT_PV})
+
+    def test_pickled_copy_writes_to_same_region(self):
+        copy = pickle.loads(pickle.dumps(self.arrays))
+        try:
+            copy.write({BPM_PV: 2.0})
+            self.assertEqual(self.arrays.read(), {BPM_PV: 2.0})
+        finally:
+            copy.close()
+        # closing a copy does not release the region
+        self.arrays.write({BPM_PV: 3.0})
+        self.assertEqual(self.arrays.read(), {BPM_PV: 3.0})
+
+    def test_write_in_spawned_process(self):
+        context = multiprocessing.get_context('spawn')
+        process = context.Process(
+            target=_write_in_child, args=(self.arrays, {BPM_PV: 4.0}))
+        process.start()
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+        self.assertEqual(self.arrays.read(), {BPM_PV: 4.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""Tests of snapshots of accelerator models in the local cache."""
+
+import os
+import tempfile
+import unittest
+
+import pymodels
+
+from va import snapshot
+from va import utils
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self._cache_dir = utils.CACHE_DIR
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        utils.CACHE_DIR = self._tmp_dir.name
+        self.snapshot = snapshot.Snapshot('SI', 'si_v25_01')
+
+    def tearDown(self):
+        utils.CACHE_DIR = self._cache_dir
+        self._tmp_dir.cleanup()
+
+    def _list_files(self):
+        return sorted(os.listdir(os.path.join(
+            self._tmp_dir.name, snapshot.SNAPSHOTS_DIR, self.snapshot.name)))
+
+    def test_state_is_saved_and_loaded(self):
+        state = {'orbit': [1.0, 2.0], 'tunes': (0.1, 0.2)}
+        self.snapshot.save_state(state)
+        loaded = snapshot.Snapshot('SI', 'si_v25_01').load_state()
+        self.assertEqual(loaded, state)
+        self.assertEqual(self._list_files(), ['state.pkl'])
+
+    def test_missing_snapshot_is_not_loaded(self):
+        self.assertIsNone(self.snapshot.load_state())
+        self.assertIsNone(self.snapshot.load_lattice())
+
+    def test_snapshots_are_keyed_by_model(self):
+        self.snapshot.save_state({'orbit': None})
+        other = snapshot.Snapshot('SI', 'si_v25_01', only_orbit=True)
+        self.assertIsNone(other.load_state())
+
+    def test_snapshots_are_keyed_by_database(self):
+        keyed = snapshot.Snapshot('SI', 'si_v25_01', key='a'*40)
+        keyed.save_state({'orbit': None})
+        self.assertEqual(
+            snapshot.Snapshot('SI', 'si_v25_01', key='a'*40).load_state(),
+            {'orbit': None})
+        other = snapshot.Snapshot('SI', 'si_v25_01', key='b'*40)
+        self.assertIsNone(other.load_state())
+        self.assertIsNone(self.snapshot.load_state())
+
+    def test_temporary_files_are_unique(self):
+        path1, final1 = self.snapshot._create_temp_file('state.pkl')
+        path2, final2 = self.snapshot._create_temp_file('state.pkl')
+        self.assertNotEqual(path1, path2)
+        self.assertEqual(final1, final2)
+        self.assertEqual(os.path.dirname(path1), os.path.dirname(final1))
+
+    def test_failed_save_leaves_no_files(self):
+        with self.assertRaises(Exception):
+            self.snapshot.save_state({'callback': lambda: None})
+        self.assertEqual(self._list_files(), [])
+        self.assertIsNone(self.snapshot.load_state())
+
+    def test_saving_lattice_invalidates_state(self):
+        accelerator = pymodels.si.create_accelerator()
+        self.snapshot.save_state({'orbit': None})
+        self.snapshot.save_lattice(accelerator)
+        self.assertIsNone(self.snapshot.load_state())
+        self.assertEqual(self._list_files(), ['lattice.txt'])
+        lattice = self.snapshot.load_lattice()
+        self.assertEqual(len(lattice), len(accelerator))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,241 @@
+"""Tests of memoization of model results by lattice state."""
+
+import collections
+import types
+import unittest
+from concurrent import futures
+from unittest import mock
+
+import numpy as np
+import pymodels
+
+from va import accelerators_model
+from va.accelerators_model import AcceleratorModel, RingModel
+
+
+class _Model(AcceleratorModel):
+    """Accelerator model with only the state needed for memoization."""
+
+    def __init__(self, accelerator):
+        self._accelerator = accelerator
+        self._state_epoch = self._lattice_epoch = 0
+        self._state_cache = dict()
+        self._states_memo = collections.OrderedDict()
+        self._element_digests = None
+        self._changed_elements = set()
+        self._transfer_maps = None
+
+
+class _Ring(RingModel):
+    """Ring model with only the state needed for memoization."""
+
+    def __init__(self):
+        self._states_memo = collections.OrderedDict()
+        self.simulate_only_orbit = False
+        self._equilibrium_future = None
+
+
+def _set_quadrupole(accelerator, idx, value):
+    polynom = accelerator[idx].polynom_b
+    polynom[1] = value
+    accelerator[idx].polynom_b = polynom
+
+
+class TestLatticeFingerprint(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.accelerator = pymodels.si.create_accelerator()
+        cls.quad = next(idx for idx, element in enumerate(cls.accelerator)
+                        if element.polynom_b[1] != 0)
+
+    def setUp(self):
+        self.model = _Model(self.accelerator)
+        self.strength = self.accelerator[self.quad].polynom_b[1]
+
+    def tearDown(self):
+        _set_quadrupole(self.accelerator, self.quad, self.strength)
+
+    def _change_quadrupole(self, value):
+        _set_quadrupole(self.accelerator, self.quad, value)
+        self.model._on_elements_changed([self.quad])
+
+    def test_fingerprint_follows_lattice_changes(self):
+        key = self.model._get_lattice_fingerprint()
+        self._change_quadrupole(1.001*self.strength)
+        changed_key = self.model._get_lattice_fingerprint()
+        self.assertNotEqual(changed_key, key)
+        self.assertEqual(
+            _Model(self.accelerator)._get_lattice_fingerprint(), changed_key)
+        self._change_quadrupole(self.strength)
+        self.assertEqual(self.model._get_lattice_fingerprint(), key)
+
+    def test_fingerprint_of_new_lattice(self):
+        key = self.model._get_lattice_fingerprint()
+        self.model._accelerator = self.accelerator[:]
+        _set_quadrupole(self.model._accelerator, self.quad, 1.001*self.strength)
+        self.assertNotEqual(self.model._get_lattice_fingerprint(), key)
+
+    def test_fingerprint_follows_rf_and_energy(self):
+        key = self.model._get_lattice_fingerprint()
+        energy = self.accelerator.energy
+        self.accelerator.energy = 1.01*energy
+        try:
+            self.assertNotEqual(self.model._get_lattice_fingerprint(), key)
+        finally:
+            self.accelerator.energy = energy
+
+    def test_transport_results_are_reused(self):
+        parameters = {'emittance': 1e-9, 'energy_spread': 1e-3}
+        calc = mock.Mock(return_value=(0.1, None, None))
+        with mock.patch.object(
+                accelerators_model.injection,
+                'calc_charge_loss_fraction_in_line', calc):
+            self.model._calc_transport_loss_fraction(parameters)
+            self.model._calc_transport_loss_fraction(
+                {'emittance': 1e-9 + 1e-20, 'energy_spread': 1e-3})
+            self.assertEqual(calc.call_count, 1)
+
+            # new lattice state: quantities derived from it are recomputed
+            self._change_quadrupole(1.001*self.strength)
+            self.model._state_deprecated = True
+            result = self.model._calc_transport_loss_fraction(parameters)
+            self.assertEqual(calc.call_count, 2)
+        self.assertEqual(result, (0.1, None, None))
+
+
+class TestStateCache(unittest.TestCase):
+
+    def test_cache_is_kept_until_state_is_deprecated(self):
+        model = _Model(None)
+        model._get_cached('key', lambda: 1)
+        model._state_deprecated = False
+        self.assertEqual(model._get_cached('key', lambda: 2), 1)
+        model._state_deprecated = True
+        self.assertEqual(model._get_cached('key', lambda: 2), 2)
+        self.assertEqual(model._state_epoch, 1)
+
+
+class TestInjectionParameters(unittest.TestCase):
+
+    def setUp(self):
+        self.model = _Model(None)
+        self.model._sent_injection_parameters = None
+        self.model._downstream_accelerator_prefix = 'TS'
+        self.model._send_parameters_to_other_area_structure = mock.Mock()
+
+    @staticmethod
+    def _create_parameters(emittance):
+        return {'emittance': emittance, 'energy_spread': 1e-3,
+                'init_twiss': {'betax': 1.0, 'co': np.zeros(6)}}
+
+    def test_unchanged_parameters_are_not_sent(self):
+        send = self.model._send_parameters_to_other_area_structure
+        self.model._send_injection_parameters(self._create_parameters(1e-9))
+        self.model._send_injection_parameters(
+            self._create_parameters(1e-9 + 1e-20))
+        send.assert_called_once()
+        self.assertEqual(send.call_args[1]['prefix'], 'TS')
+        self.assertEqual(
+            send.call_args[1]['_dict']['injection_parameters']['emittance'],
+            1e-9)
+
+    def test_changed_parameters_are_sent(self):
+        send = self.model._send_parameters_to_other_area_structure
+        self.model._send_injection_parameters(self._create_parameters(1e-9))
+        self.model._send_injection_parameters(self._create_parameters(2e-9))
+        self.assertEqual(send.call_count, 2)
+
+
+class TestStatesMemo(unittest.TestCase):
+
+    def setUp(self):
+        self.ring = _Ring()
+
+    @staticmethod
+    def _create_state(value):
+        return {
+            'orbit': np.full((6, 3), value), 'twiss': None, 'm66': None,
+            'tunes': (value, value), 'lifetime': None,
+            'orbit_response': None,
+            }
+
+    def test_least_recently_used_states_are_discarded(self):
+        size = accelerators_model.STATE_MEMO_SIZE
+        for key in range(size):
+            self.ring._memoize_state(key, self._create_state(key))
+        self.ring._get_memoized_state(0)
+        self.ring._memoize_state(size, self._create_state(size))
+        self.assertEqual(len(self.ring._states_memo), size)
+        self.assertIn(0, self.ring._states_memo)
+        self.assertNotIn(1, self.ring._states_memo)
+
+    def test_restored_orbit_is_a_copy(self):
+        self.ring._memoize_state('key', self._create_state(1.0))
+        self.assertTrue(self.ring._restore_memoized_state('key'))
+        self.ring._orbit[:] = 0.0
+        self.assertTrue(np.all(
+            self.ring._states_memo['key']['orbit'] == 1.0))
+        self.assertFalse(self.ring._lattice_changed)
+        self.assertFalse(self.ring._restore_memoized_state('other'))
+
+    def test_failed_calculations_are_not_memoized(self):
+        self.ring._orbit = np.zeros((6, 3))
+        self.ring._twiss = self.ring._m66 = self.ring._tunes = None
+        self.ring._orbit_response = None
+        self.ring._lifetime = None
+        self.ring._memoize_ring_state('key')
+        self.assertNotIn('key', self.ring._states_memo)
+
+        self.ring._equilibrium_future = types.SimpleNamespace()
+        self.ring._memoize_ring_state('key')
+        self.assertIsNone(self.ring._states_memo['key']['lifetime'])
+
+
+class TestEquilibriumParameters(unittest.TestCase):
+
+    def setUp(self):
+        self.ring = _Ring()
+        self.ring.model_module = types.SimpleNamespace(lattice_version='test')
+        self.ring._snapshot_pending = False
+        self.ring._stages_published = False
+        self.ring._beam_charge = None
+        self.ring._m66 = np.eye(6)
+        self.ring._lifetime = None
+        self.ring._lattice_epoch = 1
+        self.ring._state_key = 'key'
+        self.ring._states_memo['key'] = {'lifetime': None}
+
+    def _submit(self, result):
+        future = futures.Future()
+        future.set_result(result)
+        self.ring._equilibrium_epoch = self.ring._lattice_epoch
+        self.ring._equilibrium_future = future
+
+    def test_results_are_applied_and_memoized(self):
+        lifetime = object()
+        self._submit(lifetime)
+        self.ring._apply_equilibrium_parameters()
+        self.assertIs(self.ring._lifetime, lifetime)
+        self.assertIs(self.ring._states_memo['key']['lifetime'], lifetime)
+        self.assertIsNone(self.ring._equilibrium_future)
+
+    def test_results_of_superseded_lattice_are_discarded(self):
+        self._submit(object())
+        self.ring._lattice_epoch += 1
+        self.ring._apply_equilibrium_parameters()
+        self.assertIsNone(self.ring._lifetime)
+        self.assertIsNone(self.ring._states_memo['key']['lifetime'])
+        self.assertIsNone(self.ring._equilibrium_future)
+
+    def test_pending_results_are_kept(self):
+        future = self.ring._equilibrium_future = futures.Future()
+        self.ring._apply_equilibrium_parameters()
+        self.assertIs(self.ring._equilibrium_future, future)
+        self.ring._cancel_equilibrium_parameters()
+        self.assertTrue(future.cancelled())
+        self.assertIsNone(self.ring._equilibrium_future)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+"""Tests of incremental optics against full pyaccel calculations."""
+
+import unittest
+from unittest import mock
+
+import numpy as np
+import pyaccel
+import pymodels
+
+from va import transfer_maps
+from va.transfer_maps import TransferMaps
+
+
+TWISS_ATTRS = ('betax', 'alphax', 'mux', 'betay', 'alphay', 'muy')
+DISPERSION_ATTRS = ('etax', 'etapx')
+
+
+class _TestRingOptics:
+    """Checks common to rings with and without radiation."""
+
+    track6d = False
+
+    def setUp(self):
+        self.accelerator = pymodels.si.create_accelerator()
+        self.accelerator.cavity_on = self.track6d
+        self.accelerator.radiation_on = self.track6d
+        self.maps = TransferMaps(self.accelerator)
+
+    def _find_orbit(self):
+        if self.track6d:
+            return pyaccel.tracking.findorbit6(
+                self.accelerator, indices='open')
+        orbit = np.zeros((6, len(self.accelerator)))
+        orbit[:4] = pyaccel.tracking.findorbit4(
+            self.accelerator, indices='open')
+        return orbit
+
+    def _check_twiss(self):
+        orbit = self._find_orbit()
+        twiss, m66 = self.maps.calc_twiss(orbit)
+        expected, expected_m66 = pyaccel.optics.calc_twiss(
+            self.accelerator, fixed_point=orbit[:, 0])
+        # transverse rows and dispersion column, used for twiss
+        np.testing.assert_allclose(
+            m66[:4, :5], expected_m66[:4, :5], rtol=0, atol=1e-9)
+        for attr in TWISS_ATTRS:
+            np.testing.assert_allclose(
+                getattr(twiss, attr), getattr(expected, attr),
+                rtol=1e-6, atol=1e-9, err_msg=attr)
+        for attr in DISPERSION_ATTRS:
+            np.testing.assert_allclose(
+                getattr(twiss, attr), getattr(expected, attr),
+                rtol=0, atol=1e-6, err_msg=attr)
+
+    def _set_polynom(self, idx, attr, order, value):
+        element = self.accelerator[idx]
+        polynom = getattr(element, attr)
+        polynom[order] = value
+        setattr(element, attr, polynom)
+
+    def test_periodic_twiss(self):
+        self._check_twiss()
+
+    def test_twiss_after_quadrupole_change(self):
+        self._check_twiss()
+        idx = pyaccel.lattice.find_indices(
+            self.accelerator, 'fam_name', 'QFA')[0]
+        strength = self.accelerator[idx].polynom_b[1]
+        self._set_polynom(idx, 'polynom_b', 1, 1.001*strength)
+        self.maps.invalidate([idx])
+        self._check_twiss()
+
+    def test_twiss_after_corrector_change(self):
+        self._check_twiss()
+        idx = pyaccel.lattice.find_indices(
+            self.accelerator, 'fam_name', 'CH')[0]
+        length = self.accelerator[idx].length or 1.0
+        self._set_polynom(idx, 'polynom_b', 0, -10e-6/length)
+        self.maps.invalidate([idx])
+        self._check_twiss()
+
+    def test_single_pass_and_incremental_maps_agree(self):
+        orbit = self._find_orbit()
+        limit = transfer_maps.MAX_CHANGED_FRACTION
+        try:
+            transfer_maps.MAX_CHANGED_FRACTION = 1.0
+            cumulative = self.maps.get_cumulative_matrices(orbit).copy()
+        finally:
+            transfer_maps.MAX_CHANGED_FRACTION = limit
+        maps = TransferMaps(self.accelerator)
+        np.testing.assert_allclose(
+            maps.get_cumulative_matrices(orbit), cumulative,
+            rtol=0, atol=1e-9)
+
+
+class TestRingOptics4D(_TestRingOptics, unittest.TestCase):
+
+    track6d = False
+
+
+class TestRingOptics6D(_TestRingOptics, unittest.TestCase):
+
+    track6d = True
+
+
+class TestOrbitDrift(unittest.TestCase):
+
+    def setUp(self):
+        self.accelerator = pymodels.si.create_accelerator()
+        self.maps = TransferMaps(self.accelerator)
+        self.orbit = np.zeros((6, len(self.accelerator)))
+        self.cumulative = self.maps.get_cumulative_matrices(self.orbit).copy()
+
+    def _get_cumulative_matrices(self, orbit):
+        with mock.patch.object(
+                transfer_maps._pyaccel.tracking, 'find_m66',
+                wraps=pyaccel.tracking.find_m66) as find_m66:
+            cumulative = self.maps.get_cumulative_matrices(orbit)
+        return cumulative, find_m66
+
+    def test_small_drift_keeps_maps(self):
+        orbit = self.orbit + transfer_maps.ORBIT_TOLERANCE/2
+        cumulative, find_m66 = self._get_cumulative_matrices(orbit)
+        find_m66.assert_not_called()
+        np.testing.assert_array_equal(cumulative, self.cumulative)
+
+    def test_large_drift_recalculates_all_maps(self):
+        orbit = self.orbit.copy()
+        orbit[0] += 2*transfer_maps.ORBIT_TOLERANCE
+        _, find_m66 = self._get_cumulative_matrices(orbit)
+        find_m66.assert_called_once()
+        self.assertEqual(find_m66.call_args[1]['indices'], 'closed')
+
+    def test_changed_elements_use_current_orbit(self):
+        idx = pyaccel.lattice.find_indices(
+            self.accelerator, 'fam_name', 'QFA')[0]
+        orbit = self.orbit + transfer_maps.ORBIT_TOLERANCE/2
+        self.maps.invalidate([idx])
+        _, find_m66 = self._get_cumulative_matrices(orbit)
+        find_m66.assert_called_once()
+        np.testing.assert_array_equal(
+            find_m66.call_args[1]['fixed_point'], orbit[:, idx])
+
+
+class TestLineOptics(unittest.TestCase):
+
+    def test_line_twiss(self):
+        # ring lattice used as a transport line, from a matched beam
+        accelerator = pymodels.si.create_accelerator()
+        periodic, _ = pyaccel.optics.calc_twiss(accelerator)
+        init_twiss = periodic[0]
+        init_twiss.co = init_twiss.co + np.array([1e-4, 0, 1e-4, 0, 0, 0])
+        orbit, *_ = pyaccel.tracking.linepass(
+            accelerator, init_twiss.co, indices='open')
+        twiss, _ = TransferMaps(accelerator).calc_twiss(
+            orbit, init_twiss=init_twiss)
+        expected, *_ = pyaccel.optics.calc_twiss(
+            accelerator, init_twiss=init_twiss)
+        for attr in TWISS_ATTRS + DISPERSION_ATTRS:
+            np.testing.assert_allclose(
+                getattr(twiss, attr), getattr(expected, attr),
+                rtol=1e-6, atol=1e-9, err_msg=attr)
+
+
+if __name__ == '__main__':
+    unittest.main()
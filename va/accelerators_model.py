@@ -1,6 +1,11 @@
 
 import enum
 import time
+import hashlib
+import functools
+import copy
+import collections
+from concurrent import futures as _futures
 import numpy
 import mathphys
 import pyaccel
@@ -12,7 +17,11 @@ from va import magnet as _magnet
 from va import power_supply
 from va import beam_charge
 from va import injection
+from va import snapshot
 from va import utils
+from va.transfer_maps import TransferMaps
+from va.excitation_curve import ExcitationCurve
+from va.pulse_curve import PulseCurve
 
 _u = mathphys.units
 _light_speed = mathphys.constants.light_speed
@@ -20,8 +29,20 @@ _meter_2_nm = _u.meter_2_mm**3 # model to control system orbit conversion
 _undef_value = utils.UNDEF_VALUE
 
 TRACK6D = True
+ORBIT_FAST_MODE = True  # use linear response to correctors for orbit updates
+ORBIT_FAST_MAX_KICK = 20e-6  # [rad] max. corrector change for linear response
+ORBIT_FAST_MAX_DELTA = 200e-6  # [m] max. orbit change for linear response
+ORBIT_FAST_MAX_TUNE_SHIFT = 1e-3  # max. tune shift from orbit at sextupoles
+STATE_MEMO_SIZE = 8  # number of lattice states whose results are kept
+INCREMENTAL_OPTICS = True  # recalculate transfer maps of changed elements only
+ASYNC_EQUILIBRIUM = True  # calculate equilibrium parameters in background
+MAX_CONSECUTIVE_ABORTS = 10  # computations abandoned in a row for new writes
+PARAMETERS_DIGITS = 9  # significant digits of injection parameters compared
+MONTE_CARLO_SECTIONS = ()  # prefixes of sections whose efficiencies are tracked
 CALC_INJECTION_EFF = True
 CALC_TIMING_EFF = True
+USE_SNAPSHOTS = False  # restore initialised models from local cache (see server)
+CURVE_LOADERS = 8  # threads loading excitation and pulse curves at startup
 
 
 class Plane(enum.IntEnum):
@@ -37,50 +58,102 @@ class AcceleratorModel(area_structure.AreaStructure):
         # encapsulate DCCTs data structures within private methods,
         # just as for magnets and ps...
         self._dcct = {}
+        self._state_epoch = 0
+        self._lattice_epoch = 0
+        self._state_deprecated_flag = False
+        self._state_cache = dict()
+        self._lattice_changed = True  # changes other than corrector kicks
+        self._corrector_magnets = dict()  # orbit correctors and their planes
+        self._states_memo = collections.OrderedDict()
+        self._element_digests = None  # lattice and digests of its elements
+        self._changed_elements = set()  # elements whose digests are outdated
+        self._transfer_maps = None
+        self._consecutive_aborts = 0
+        self._sent_injection_parameters = None
+        self._monte_carlo = None  # background estimator of loss fractions
+        self._monte_carlo_epochs = dict()  # state epoch of each estimate
+        self._init_pv_routes()
         super().__init__(**kwargs)
+        self._init_snapshot()
         self._reset('reset', 'model {}'.format(
             self.model_module.lattice_version))
+        self._mark_startup('orbit')
         self._init_magnets_and_power_supplies()
         self._init_sp_pv_values()
+        self._save_snapshot()
+        self._mark_startup('snapshot')
 
     @property
     def accelerator(self):
         """."""
         return self._accelerator
 
+    def finalise(self):
+        if self._monte_carlo is not None:
+            self._monte_carlo.shutdown()
+        super().finalise()
+
+    @property
+    def _state_deprecated(self):
+        return self._state_deprecated_flag
+
+    @_state_deprecated.setter
+    def _state_deprecated(self, value):
+        # quantities derived from model state are computed once per epoch
+        if value:
+            self._state_epoch += 1
+            self._lattice_epoch += 1
+            self._lattice_changed = True
+            self._state_cache.clear()
+        self._state_deprecated_flag = value
+
+    def _deprecate_state_by_correctors(self):
+        """Deprecate model state after changes of corrector kicks only."""
+        lattice_changed = self._lattice_changed
+        lattice_epoch = self._lattice_epoch
+        self._state_deprecated = True
+        self._lattice_changed = lattice_changed
+        self._lattice_epoch = lattice_epoch
+
     # --- methods implementing response of model to get requests
 
     def _get_pv(self, pv_name):
-        parts = _SiriusPVName(pv_name)
-        value = self._get_pv_dynamic(pv_name, parts)
-        if value is None:
-            value = self._get_pv_fake(pv_name, parts)
-        if value is None:
-            value = self._get_pv_static(pv_name, parts)
-        if value is None:
-            value = self._get_pv_timing(pv_name, parts)
-        if value is None:
-            value = self._get_pv_not_implemented(pv_name, parts)
-        if value is None:
-            utils.log(
-                'warn',
-                'response to '+pv_name+' not implemented in model get_pv',
-                'yellow', a=['bold'])
-            value = 0
-            # raise Exception(
-            #     'response to '+pv_name+' not implemented in model get_pv')
-        return value
+        route = self._get_pv_routes.get(pv_name)
+        if route is not None:
+            value = route()
+            if value is not None:
+                return value
+        parts = self._get_pv_parts(pv_name)
+        handlers = (
+            self._get_pv_dynamic,
+            self._get_pv_fake,
+            self._get_pv_static,
+            self._get_pv_timing,
+            self._get_pv_not_implemented,
+            )
+        for handler in handlers:
+            value = handler(pv_name, parts)
+            if value is not None:
+                # next requests go straight to the handler that answered
+                self._get_pv_routes[pv_name] = \
+                    functools.partial(handler, pv_name, parts)
+                return value
+        utils.log(
+            'warn',
+            'response to '+pv_name+' not implemented in model get_pv',
+            'yellow', a=['bold'])
+        # raise Exception(
+        #     'response to '+pv_name+' not implemented in model get_pv')
+        return 0
 
     def _get_pv_dynamic(self, pv_name, parts):
         if parts.dis == 'DI' and parts.propty == 'BbBCurrent-Mon':
-            time_interval = pyaccel.optics.get_revolution_period(
-                self._accelerator)
+            time_interval = self._get_revolution_period()
             currents = self._beam_charge.current(time_interval)
             currents_mA = [bunch_current / _u.mA for bunch_current in currents]
             return currents_mA
         elif parts.dis == 'DI' and parts.propty == 'Current-Mon':
-            time_interval = pyaccel.optics.get_revolution_period(
-                self._accelerator)
+            time_interval = self._get_revolution_period()
             currents = self._beam_charge.current(time_interval)
             currents_mA = [bunch_current / _u.mA for bunch_current in currents]
             return sum(currents_mA)
@@ -105,15 +178,14 @@ class AcceleratorModel(area_structure.AreaStructure):
             if value is not None: return value
         elif parts.dis == 'DI':
             if parts.dev == 'BPM':
-                idx = self._get_elements_indices(pv_name)
                 if parts.propty == 'PosX-Mon':
                     if self._orbit is None:
                         return _undef_value
-                    return _meter_2_nm*self._orbit[0, idx]
+                    return self._get_bpm_reading(pv_name, Plane.horizontal)
                 elif parts.propty == 'PosY-Mon':
                     if self._orbit is None:
                         return _undef_value
-                    return _meter_2_nm*self._orbit[2, idx]
+                    return self._get_bpm_reading(pv_name, Plane.vertical)
                 return None
             elif parts.dev in ('SlitH', 'SlitV'):
                 return 0.0
@@ -157,20 +229,7 @@ class AcceleratorModel(area_structure.AreaStructure):
         elif parts.dis == 'MO':
             if parts.dev == 'Lattice':
                 if parts.propty == 'BPMPos-Cte':
-                    indices = self._get_elements_indices('BPM', flat=False)
-                    if isinstance(indices[0], int):
-                        pos = pyaccel.lattice.find_spos(
-                            self._accelerator, indices)
-                    else:
-                        pos = [pyaccel.lattice.find_spos(
-                            self._accelerator, idx[0]) for idx in indices]
-                    start = pyaccel.lattice.find_indices(
-                        self._accelerator, 'fam_name', 'start')[0]
-                    start_spos = pyaccel.lattice.find_spos(
-                        self._accelerator, start)
-                    pos = (pos-start_spos) % pyaccel.lattice.length(
-                        self._accelerator)
-                    return pos
+                    return self._get_elements_spos('BPM')
         return None
 
     def _get_pv_fake(self, pv_name, parts):
@@ -194,18 +253,7 @@ class AcceleratorModel(area_structure.AreaStructure):
         if 'SaveFlatfile' in pv_name:
             return 0
         if 'Pos' in pv_name:
-            indices = self._get_elements_indices(pv_name, flat=False)
-            if isinstance(indices[0], int):
-                pos = pyaccel.lattice.find_spos(self._accelerator, indices)
-            else:
-                pos = [
-                    pyaccel.lattice.find_spos(self._accelerator, idx[0])
-                    for idx in indices]
-            start = pyaccel.lattice.find_indices(
-                self._accelerator, 'fam_name', 'start')[0]
-            start_spos = pyaccel.lattice.find_spos(self._accelerator, start)
-            pos = (pos-start_spos) % pyaccel.lattice.length(self._accelerator)
-            return pos
+            return self._get_elements_spos(pv_name)
         else:
             return None
 
@@ -246,25 +294,41 @@ class AcceleratorModel(area_structure.AreaStructure):
     # --- methods implementing response of model to set requests
 
     def _set_pv(self, pv_name, value):
-        parts = _SiriusPVName(pv_name)
-        if self._set_pv_vaca(pv_name, value, parts):
-            return
-        if self._set_pv_magnets(pv_name, value, parts):
-            return
-        if self._set_pv_di(pv_name, value, parts):
-            return
-        if self._set_pv_rf(pv_name, value, parts):
-            return
-        if self._set_pv_fake(pv_name, value, parts):
-            return
-        if self._set_pv_timing(pv_name, value, parts):
-            return
+        route = self._set_pv_routes.get(pv_name)
+        if route is None:
+            parts = self._get_pv_parts(pv_name)
+            # set handlers are selected by discipline
+            handlers = {
+                'VA': self._set_pv_vaca,
+                'PS': self._set_pv_magnets,
+                'PU': self._set_pv_magnets,
+                'DI': self._set_pv_di,
+                'RF': self._set_pv_rf,
+                'FK': self._set_pv_fake,
+                'TI': self._set_pv_timing,
+                }
+            handler = handlers.get(parts.dis)
+            if handler is None:
+                return
+            route = functools.partial(handler, pv_name, parts=parts)
+            self._set_pv_routes[pv_name] = route
+        route(value)
+
+    def _is_model_write(self, pv_name):
+        parts = self._get_pv_parts(pv_name)
+        if parts.dis in ('PS', 'PU', 'RF'):
+            return True
+        if parts.dis == 'FK':
+            return 'SaveFlatfile' not in pv_name
+        if parts.dis == 'TI':
+            return pv_name in self._enabled2magnet or \
+                pv_name in self._delay2magnet
+        return False
 
     def _set_pv_vaca(self, pv_name, value, parts):
         if parts.dis == 'VA':
             if parts.propty == 'BeamCurrentAdd-SP':
-                time_interval = pyaccel.optics.get_revolution_period(
-                    self._accelerator)
+                time_interval = self._get_revolution_period()
                 nr_bunches = self._beam_charge.nr_bunches
                 charge_delta = _u.mA * (value/nr_bunches) * time_interval * numpy.ones(nr_bunches)
                 self._beam_inject(charge=charge_delta)
@@ -277,7 +341,7 @@ class AcceleratorModel(area_structure.AreaStructure):
                 prev_value = self._dcct[parts.device_name]['CurrThold']
                 if value != prev_value:
                     if value < 0:
-                        self._others_queue['driver'].put(('s', (pv_name, prev_value)))
+                        self._send_pv_to_driver(pv_name, prev_value)
                     else:
                         self._dcct[parts.device_name]['CurrThold'] = value
                     return True
@@ -290,7 +354,8 @@ class AcceleratorModel(area_structure.AreaStructure):
             prev_value = self._accelerator[idx[0]].voltage
             if value != prev_value:
                 self._accelerator[idx[0]].voltage = value
-                self._others_queue['driver'].put(('s', (pv_name.replace('Volt-SP','Volt-RB'), value))) # It would be cleaner if this were implemented inside PS object!
+                self._on_elements_changed(idx[:1])
+                self._send_pv_to_driver(pv_name.replace('Volt-SP','Volt-RB'), value) # It would be cleaner if this were implemented inside PS object!
                 self._state_deprecated = True
             return True
         elif parts.propty == 'Freq-SP':
@@ -298,7 +363,8 @@ class AcceleratorModel(area_structure.AreaStructure):
             prev_value = self._accelerator[idx[0]].frequency
             if value != prev_value:
                 self._accelerator[idx[0]].frequency = value
-                self._others_queue['driver'].put(('s', (pv_name.replace('Freq-SP','Freq-RB'), value))) # It would be cleaner if this were implemented inside PS object!
+                self._on_elements_changed(idx[:1])
+                self._send_pv_to_driver(pv_name.replace('Freq-SP','Freq-RB'), value) # It would be cleaner if this were implemented inside PS object!
                 self._state_deprecated = True
             return True
         return False
@@ -310,8 +376,11 @@ class AcceleratorModel(area_structure.AreaStructure):
             deprecated_pvs = dev.set_pv(pv_name, value, parts)
             if deprecated_pvs:
                 for pvname,value in deprecated_pvs.items():
-                    self._others_queue['driver'].put(('s', (pvname, value)))
-                self._state_deprecated = True
+                    self._send_pv_to_driver(pvname, value)
+                if all(m in self._corrector_magnets for m in dev.magnets):
+                    self._deprecate_state_by_correctors()
+                else:
+                    self._state_deprecated = True
                 return True
         return False
 
@@ -322,6 +391,7 @@ class AcceleratorModel(area_structure.AreaStructure):
             prev_errorx = pyaccel.lattice.get_error_misalignment_x(self._accelerator, idx[0])
             if value != prev_errorx:
                 pyaccel.lattice.set_error_misalignment_x(self._accelerator, idx, value)
+                self._on_elements_changed(idx)
                 self._state_deprecated = True
             return True
         elif 'ErrY' in pv_name:
@@ -329,6 +399,7 @@ class AcceleratorModel(area_structure.AreaStructure):
             prev_errory = pyaccel.lattice.get_error_misalignment_y(self._accelerator, idx[0])
             if value != prev_errory:
                 pyaccel.lattice.set_error_misalignment_y(self._accelerator, idx, value)
+                self._on_elements_changed(idx)
                 self._state_deprecated = True
             return True
         elif 'ErrR' in pv_name:
@@ -336,12 +407,13 @@ class AcceleratorModel(area_structure.AreaStructure):
             prev_errorr = pyaccel.lattice.get_error_rotation_roll(self._accelerator, idx[0])
             if value != prev_errorr:
                 pyaccel.lattice.set_error_rotation_roll(self._accelerator, idx, value)
+                self._on_elements_changed(idx)
                 self._state_deprecated = True
             return True
         elif 'SaveFlatfile' in pv_name:
             fname = 'flatfile_' + self.model_module.lattice_version + '.txt'
             pyaccel.lattice.write_flat_file(self._accelerator, fname)
-            self._others_queue['driver'].put(('s', (pv_name, 0)))
+            self._send_pv_to_driver(pv_name, 0)
             return True
         return None
 
@@ -369,6 +441,197 @@ class AcceleratorModel(area_structure.AreaStructure):
             self._beam_charge.dump()
         self._orbit = None  # means no closed orbit
         self._twiss = None  # means no optics
+        self._state_cache.clear()
+
+    def _is_computation_superseded(self):
+        """Check whether ongoing computation is to be abandoned.
+
+        Computations are abandoned when new writes are waiting, unless too
+        many were abandoned in a row, so that results are eventually seen
+        even during continuous scans.
+        """
+        if self._consecutive_aborts >= MAX_CONSECUTIVE_ABORTS:
+            return False
+        if not self._has_pending_writes():
+            return False
+        self._consecutive_aborts += 1
+        self._log('calc', '{}: computation superseded by new setpoints'.format(
+            self.model_module.lattice_version))
+        return True
+
+    def _get_monte_carlo_submitter(self, efficiency):
+        """Return function submitting tracking estimate of efficiency losses.
+
+        Returns None if efficiencies of section are not tracked.
+        """
+        if self.prefix not in MONTE_CARLO_SECTIONS:
+            return None
+        return functools.partial(self._submit_monte_carlo, efficiency)
+
+    def _submit_monte_carlo(self, efficiency, *args):
+        if self._monte_carlo is None:
+            self._monte_carlo = injection.MonteCarloEstimator()
+        self._monte_carlo_epochs[efficiency] = self._state_epoch
+        self._monte_carlo.submit(efficiency, *args)
+
+    def _apply_monte_carlo_results(self):
+        """Apply efficiencies estimated in background, if still valid."""
+        if self._monte_carlo is None:
+            return
+        latver = self.model_module.lattice_version
+        for efficiency, future in self._monte_carlo.pop_done().items():
+            if self._monte_carlo_epochs.pop(efficiency) != self._state_epoch:
+                continue  # results of a superseded state
+            try:
+                loss_fraction, error, nr_tracked = future.result()
+            except Exception as err:
+                self._log('calc', '{}: unable to track {} losses ({})'.format(
+                    latver, efficiency, str(err)), c='yellow')
+                continue
+            setattr(self, '_' + efficiency + '_efficiency', 1.0 - loss_fraction)
+            self._log('calc', '{}: tracked {} efficiency {:.2f} +- {:.2f} % ({} particles)'.format(
+                latver, efficiency, 100*(1.0 - loss_fraction), 100*error,
+                nr_tracked))
+            self._publish_stage('Efficiency')
+            self._state_changed = True
+
+    def _publish_stage(self, stage):
+        """Publish PV values calculated by a stage (only in rings)."""
+        pass
+
+    def _init_transfer_maps(self):
+        """Create cache of element transfer maps for current accelerator."""
+        self._transfer_maps = TransferMaps(self._accelerator) \
+            if INCREMENTAL_OPTICS else None
+
+    def _on_elements_changed(self, indices):
+        if self._transfer_maps is not None:
+            self._transfer_maps.invalidate(indices)
+        if self._element_digests is not None:
+            self._changed_elements.update(indices)
+
+    def _get_lattice_fingerprint(self):
+        """Return hash of element fields, misalignments, RF and energy.
+
+        Digests of elements are kept, and recalculated only for elements
+        reported by _on_elements_changed or when the lattice is replaced.
+        """
+        accelerator = self._accelerator
+        if self._element_digests is None or \
+                self._element_digests[0] is not accelerator:
+            digests = numpy.zeros((len(accelerator), 20), dtype=numpy.uint8)
+            changed = range(len(accelerator))
+            self._element_digests = (accelerator, digests)
+        else:
+            digests = self._element_digests[1]
+            changed = self._changed_elements
+        for idx in changed:
+            digests[idx] = _get_element_digest(accelerator[idx])
+        self._changed_elements = set()
+        sha = hashlib.sha1()
+        sha.update(repr((
+            accelerator.energy, accelerator.cavity_on,
+            accelerator.radiation_on)).encode())
+        sha.update(digests.tobytes())
+        return sha.digest()
+
+    def _get_memoized_state(self, key):
+        state = self._states_memo.get(key)
+        if state is not None:
+            self._states_memo.move_to_end(key)
+        return state
+
+    def _memoize_state(self, key, state):
+        """Keep results for a lattice state, discarding least used ones."""
+        self._states_memo[key] = state
+        self._states_memo.move_to_end(key)
+        while len(self._states_memo) > STATE_MEMO_SIZE:
+            self._states_memo.popitem(last=False)
+
+    def _get_transport_key(self, parameters):
+        """Return memo key of line state and (rounded) injection parameters."""
+        fingerprint = self._get_cached(
+            'lattice_fingerprint', self._get_lattice_fingerprint)
+        return ('transport', fingerprint, _freeze_parameters(parameters))
+
+    def _calc_transport_loss_fraction(self, parameters, **kwargs):
+        """Calculate line loss fraction, twiss and m66, reusing past results."""
+        key = self._get_transport_key(parameters)
+        result = self._get_memoized_state(key)
+        if result is None:
+            result = injection.calc_charge_loss_fraction_in_line(
+                self, **kwargs)
+            self._memoize_state(key, result)
+        return result
+
+    def _send_injection_parameters(self, parameters):
+        """Send injection parameters downstream, unless they did not change."""
+        frozen = _freeze_parameters(parameters)
+        if frozen == self._sent_injection_parameters:
+            return
+        self._sent_injection_parameters = frozen
+        self._send_parameters_to_other_area_structure(
+            prefix=self._downstream_accelerator_prefix,
+            _dict={'injection_parameters': parameters})
+
+    def _get_cached(self, key, func):
+        """Return quantity derived from model state, computed once per state."""
+        try:
+            return self._state_cache[key]
+        except KeyError:
+            value = self._state_cache[key] = func()
+            return value
+
+    def _get_revolution_period(self):
+        return self._get_cached(
+            'revolution_period',
+            lambda: pyaccel.optics.get_revolution_period(self._accelerator))
+
+    def _get_elements_spos(self, pv_name):
+        """Get longitudinal positions of elements relative to lattice start."""
+        def calc_spos():
+            indices = self._get_elements_indices(pv_name, flat=False)
+            if isinstance(indices[0], int):
+                pos = pyaccel.lattice.find_spos(self._accelerator, indices)
+            else:
+                pos = [
+                    pyaccel.lattice.find_spos(self._accelerator, idx[0])
+                    for idx in indices]
+            start = pyaccel.lattice.find_indices(
+                self._accelerator, 'fam_name', 'start')[0]
+            start_spos = pyaccel.lattice.find_spos(self._accelerator, start)
+            pos = (pos-start_spos) % pyaccel.lattice.length(self._accelerator)
+            return pos
+        device_name = self._get_pv_parts(pv_name).device_name
+        return self._get_cached(('spos', device_name), calc_spos)
+
+    def _get_bpm_reading(self, pv_name, plane):
+        """Get BPM orbit reading [nm] from a single gather over all BPMs."""
+        slices, indices = self._get_cached(
+            'bpm_slices', self._calc_bpm_slices)
+        readings = self._get_cached(
+            'bpm_readings',
+            lambda: _meter_2_nm*self._get_bpm_orbit(indices)[[0, 2], :])
+        device_name = self._get_pv_parts(pv_name).device_name
+        return readings[plane, slices[device_name]]
+
+    def _get_bpm_orbit(self, indices):
+        """Get orbit at BPMs, given their element indices."""
+        return self._orbit[:, indices]
+
+    def _calc_bpm_slices(self):
+        """Get slices of each BPM in the array of indices of all BPMs."""
+        slices, indices = dict(), []
+        for pv_name, parts in self._pv_parts.items():
+            if parts.dis != 'DI' or parts.dev != 'BPM':
+                continue
+            if parts.device_name in slices:
+                continue
+            idx = self._get_elements_indices(pv_name)
+            slices[parts.device_name] = slice(
+                len(indices), len(indices) + len(idx))
+            indices.extend(idx)
+        return slices, numpy.array(indices, dtype=int)
 
     def _beam_inject(self, charge=None):
         if charge is None:
@@ -386,10 +649,32 @@ class AcceleratorModel(area_structure.AreaStructure):
         self._beam_charge.dump()
         return charge
 
+    def _init_pv_routes(self):
+        """Initialise PV routing tables.
+
+        PV names are parsed once and get/set requests are routed straight
+        to the handler of each PV, with element indices resolved on first
+        use. Tables must be rebuilt whenever the accelerator is recreated.
+        """
+        self._pv_parts = {
+            pv_name: _SiriusPVName(pv_name) for pv_name in self.database}
+        self._get_pv_routes = dict()
+        self._set_pv_routes = dict()
+        self._elements_indices = dict()
+
+    def _get_pv_parts(self, pv_name):
+        parts = self._pv_parts.get(pv_name)
+        if parts is None:
+            parts = self._pv_parts[pv_name] = _SiriusPVName(pv_name)
+        return parts
+
     def _get_elements_indices(self, pv_name, flat=True):
         """Get flattened indices of element in the model"""
-        parts = _SiriusPVName(pv_name)
-        data = self._all_pvs[parts.device_name]
+        device_name = self._get_pv_parts(pv_name).device_name
+        indices = self._elements_indices.get((device_name, flat))
+        if indices is not None:
+            return indices
+        data = self._all_pvs[device_name]
         indices = []
         for key in data.keys():
             if flat:
@@ -397,6 +682,7 @@ class AcceleratorModel(area_structure.AreaStructure):
             else:
                 idx = data[key]
             indices.extend(idx)
+        self._elements_indices[(device_name, flat)] = indices
         return indices
 
     def _set_vacuum_chamber(self):
@@ -423,6 +709,80 @@ class AcceleratorModel(area_structure.AreaStructure):
         _dict['delta_angle'] = self._delta_angle
         return _dict
 
+    def _init_snapshot(self):
+        """Restore memoized results from snapshot of initialised model."""
+        self._snapshot = None
+        self._snapshot_pending = False  # snapshot is to be saved
+        self._snapshot_tables = None
+        if not USE_SNAPSHOTS:
+            return
+        self._snapshot = snapshot.Snapshot(
+            self.prefix, self.model_module.lattice_version,
+            key=self.pv_module.get_cache_key(),
+            only_orbit=self.simulate_only_orbit)
+        state = self._snapshot.load_state()
+        if state is None:
+            self._snapshot_pending = True
+            return
+        self._states_memo.update(state['states'])
+        self._snapshot_tables = state['power_supplies']
+        utils.log('init', '{}: restoring snapshot {}'.format(
+            self.prefix, self._snapshot.name), 'green')
+
+    def _get_initial_accelerator(self):
+        """Return lattice saved in snapshot, if any, or create it."""
+        if self._snapshot is not None and not self._snapshot_pending:
+            accelerator = self._snapshot.load_lattice()
+            if accelerator is not None:
+                self._mark_startup('lattice')
+                return accelerator
+            self._snapshot_pending = True
+            self._snapshot_tables = None
+        accelerator = self._create_accelerator()
+        self._mark_startup('lattice')
+        if self._snapshot_pending:
+            try:
+                self._snapshot.save_lattice(accelerator)
+            except Exception as err:
+                self._snapshot_pending = False
+                utils.log('init', '{}: unable to save snapshot ({})'.format(
+                    self.prefix, str(err)), 'yellow')
+        return accelerator
+
+    def _is_snapshot_complete(self):
+        """Check whether model results are ready to be saved in snapshot."""
+        return True
+
+    def _get_snapshot_states(self):
+        """Return memoized results that can be saved in snapshot."""
+        return collections.OrderedDict(
+            (key, state) for key, state in self._states_memo.items()
+            if snapshot.is_picklable(state))
+
+    def _save_snapshot(self):
+        """Save snapshot of initialised model, if pending and complete."""
+        if not self._snapshot_pending:
+            return
+        if self._snapshot_tables is None:
+            # property tables as initialised, before any client request
+            self._snapshot_tables = {
+                psname: copy.deepcopy(ps.properties) for psname, ps in
+                {**self._power_supplies,
+                 **self._pulsed_power_supplies}.items()}
+        if not self._is_snapshot_complete():
+            return
+        self._snapshot_pending = False
+        try:
+            self._snapshot.save_state({
+                'power_supplies': self._snapshot_tables,
+                'states': self._get_snapshot_states()})
+        except Exception as err:
+            utils.log('init', '{}: unable to save snapshot ({})'.format(
+                self.prefix, str(err)), 'yellow')
+            return
+        utils.log('init', '{}: snapshot {} saved'.format(
+            self.prefix, self._snapshot.name), 'green')
+
     def _append_marker(self):
         marker = pyaccel.elements.marker('marker')
         marker.hmin = self._accelerator[-1].hmin
@@ -448,6 +808,9 @@ class AcceleratorModel(area_structure.AreaStructure):
             self.device_names.get_magnet_delay_mapping(accelerator)
         self._magnet2enabled, self._enabled2magnet = \
             self.device_names.get_magnet_enabled_mapping(accelerator)
+        self._load_curves(
+            {fname for fname, _ in excit_curv_polarity_map.values()},
+            set(pulse_curve_mapping.values()))
 
         # create magnet objects
         self._magnets = dict()
@@ -491,11 +854,13 @@ class AcceleratorModel(area_structure.AreaStructure):
                     'horizontal_corrector'):
                 m = _magnet.NormalMagnet(
                     accelerator, indices, excitation_curve, polarity)
+                self._corrector_magnets[m] = Plane.horizontal
             elif family_type in (
                 'slow_vertical_corrector', 'fast_vertical_corrector',
                 'vertical_corrector'):
                 m = _magnet.SkewMagnet(
                     accelerator, indices, excitation_curve, polarity)
+                self._corrector_magnets[m] = Plane.vertical
             elif family_type == 'skew_quadrupole':
                 m = _magnet.SkewMagnet(
                     accelerator, indices, excitation_curve, polarity)
@@ -506,9 +871,13 @@ class AcceleratorModel(area_structure.AreaStructure):
                 m = None
 
             if m is not None:
+                m.add_changed_callback(self._on_elements_changed)
                 self._magnets[magnet_name] = m
+        self._element_digests = None  # magnets may resize polynoms
+        self._mark_startup('magnets')
 
         # create power supply objetcs
+        tables = self._snapshot_tables or dict()
         self._power_supplies = dict()
         self._pulsed_power_supplies = dict()
         for psname in ps2magnet.keys():
@@ -518,7 +887,8 @@ class AcceleratorModel(area_structure.AreaStructure):
                     magnets.add(self._magnets[magnet_name])
             if self.device_names.pvnaming_fam in psname:
                 ps = power_supply.FamilyPowerSupply(
-                    magnets, model=self, psname=psname)
+                    magnets, model=self, psname=psname,
+                    properties=tables.get(psname))
                 ps.initialise()
                 self._power_supplies[psname] = ps
 
@@ -531,18 +901,35 @@ class AcceleratorModel(area_structure.AreaStructure):
             if self.device_names.pvnaming_fam not in psname:
                 if 'PU' in psname:
                     ps = power_supply.PulsedMagnetPowerSupply(
-                        magnets, model=self, psname=psname)
+                        magnets, model=self, psname=psname,
+                        properties=tables.get(psname))
                     ps.initialise()
                     self._pulsed_power_supplies[psname] = ps
                 else:
                     ps = power_supply.IndividualPowerSupply(
-                        magnets, model=self, psname=psname)
+                        magnets, model=self, psname=psname,
+                        properties=tables.get(psname))
                     ps.initialise()
                     self._power_supplies[psname] = ps
+        self._mark_startup('power_supplies')
 
         utils.log('init',
             '{}: magnet and power supplies initialised ({:.0f} ms)'.format(self.prefix, 1e3*(time.time() - t0)), 'green')
 
+    def _load_curves(self, excitation_curves, pulse_curves):
+        """Load curves of all families concurrently into curves cache.
+
+        Magnets are created afterwards, one at a time since they change the
+        lattice, and find their curves already loaded. Errors are raised
+        again when the magnet using the curve is created.
+        """
+        with _futures.ThreadPoolExecutor(CURVE_LOADERS) as executor:
+            for fname in excitation_curves:
+                executor.submit(ExcitationCurve, fname)
+            for fname in pulse_curves:
+                executor.submit(PulseCurve, fname)
+        self._mark_startup('curves')
+
     def _get_sorted_pulsed_magnets(self):
         magnets_pos = []
         for magnet in self._pulsed_magnets.values():
@@ -614,17 +1001,23 @@ class LinacModel(AcceleratorModel):
     # --- methods that help updating the model state
 
     def _update_state(self, force=False):
+        self._apply_monte_carlo_results()
         if force or self._state_deprecated or self._update_injection_efficiency:
             self._calc_transport_efficiency()
             self._state_deprecated = False
             self._update_injection_efficiency = False
             self._state_changed = True
 
-    def _reset(self, message1='reset', message2='', c='white', a=None):
+    def _create_accelerator(self):
         self._accelerator, *_ = self.model_module.create_accelerator()
-        self._lattice_length = pyaccel.lattice.length(self._accelerator)
         self._append_marker()
+        return self._accelerator
+
+    def _reset(self, message1='reset', message2='', c='white', a=None):
+        self._accelerator = self._get_initial_accelerator()
+        self._lattice_length = pyaccel.lattice.length(self._accelerator)
         self._all_pvs = self.device_names.get_device_names(self._accelerator)
+        self._init_pv_routes()
         #self._all_pvs.update(self.pv_module.get_fake_record_names(self._accelerator))
         self._beam_charge  = beam_charge.BeamCharge(nr_bunches = self.nr_bunches)
         self._beam_dump(message1,message2,c,a)
@@ -656,8 +1049,9 @@ class LinacModel(AcceleratorModel):
     
         idx = pyaccel.lattice.find_indices(self._accelerator,'fam_name','twiss_at_match')
         _dict['accelerator'] = self._accelerator[idx:]
+        _dict['monte_carlo'] = self._get_monte_carlo_submitter('transport')
         loss_fraction, self._twiss, self._m66 = \
-            injection.calc_charge_loss_fraction_in_line(self, **_dict)
+            self._calc_transport_loss_fraction(inj_params, **_dict)
         self._transport_efficiency = 1.0 - loss_fraction
         self._log('calc', '{}: transport efficiency {:.2f} %'.format(
             self.model_module.lattice_version, 100*self._transport_efficiency))
@@ -669,9 +1063,7 @@ class LinacModel(AcceleratorModel):
         # picklable object
         args_dict['init_twiss'] = self._twiss[-1].make_dict()
         args_dict.update(inj_params)
-        self._send_parameters_to_other_area_structure(
-            prefix=self._downstream_accelerator_prefix,
-            _dict = {'injection_parameters': args_dict})
+        self._send_injection_parameters(args_dict)
 
     def _set_pulsed_magnets_parameters(self):
         _dict = { 'pulsed_magnet_parameters' : {
@@ -694,7 +1086,7 @@ class LinacModel(AcceleratorModel):
     def _update_delay_pvs_in_epics_memory(self):
         pv_name = self.device_names.join_name(
             '01', 'TI', 'EGun', proper='Delay-SP')
-        self._others_queue['driver'].put(('s', (pv_name, self._egun_delay)))
+        self._send_pv_to_driver(pv_name, self._egun_delay)
 
     def _injection_cycle(self, **kwargs):
 
@@ -743,21 +1135,28 @@ class TLineModel(AcceleratorModel):
     # --- methods that help updating the model state
 
     def _update_state(self, force=False):
+        self._apply_monte_carlo_results()
         if force or self._state_deprecated or self._update_injection_efficiency:
             self._calc_transport_efficiency()
             self._state_deprecated = False
             self._update_injection_efficiency = False
             self._state_changed = True
 
-    def _reset(self, message1='reset', message2='', c='white', a=None):
+    def _create_accelerator(self):
         self._accelerator, *_ = self.model_module.create_accelerator()
-        self._lattice_length = pyaccel.lattice.length(self._accelerator)
         self._append_marker()
+        return self._accelerator
+
+    def _reset(self, message1='reset', message2='', c='white', a=None):
+        self._accelerator = self._get_initial_accelerator()
+        self._lattice_length = pyaccel.lattice.length(self._accelerator)
         self._all_pvs = self.device_names.get_device_names(self._accelerator)
+        self._init_pv_routes()
         #self._all_pvs.update(self.pv_module.get_fake_record_names(self._accelerator))
         self._beam_charge  = beam_charge.BeamCharge(nr_bunches = self.nr_bunches)
         self._beam_dump(message1,message2,c,a)
         self._set_vacuum_chamber()
+        self._init_transfer_maps()
         self._state_deprecated = True
         self._update_state()
 
@@ -815,7 +1214,7 @@ class TLineModel(AcceleratorModel):
         for magnet_name, magnet in self._pulsed_magnets.items():
             pv_name = self._magnet2delay[magnet_name]
             value = magnet.delay
-            self._others_queue['driver'].put(('s', (pv_name, value)))
+            self._send_pv_to_driver(pv_name, value)
 
     def _calc_transport_efficiency(self):
         if self._injection_parameters is None:
@@ -830,7 +1229,11 @@ class TLineModel(AcceleratorModel):
         # for ps in self._pulsed_power_supplies.values():
         #     ps.pwrstate_sel = 1
 
-        loss_fraction, self._twiss, self._m66 = injection.calc_charge_loss_fraction_in_line(self, **_dict)
+        _dict['transfer_maps'] = self._transfer_maps
+        _dict['monte_carlo'] = self._get_monte_carlo_submitter('transport')
+        loss_fraction, self._twiss, self._m66 = \
+            self._calc_transport_loss_fraction(
+                self._injection_parameters, **_dict)
         self._transport_efficiency = 1.0 - loss_fraction
         self._log('calc', '{}: transport efficiency {:.2f} %'.format(
             self.model_module.lattice_version, 100*self._transport_efficiency))
@@ -843,9 +1246,7 @@ class TLineModel(AcceleratorModel):
         args_dict = {}
         args_dict.update(self._injection_parameters)
         args_dict['init_twiss'] = self._twiss[-1].make_dict() # picklable object
-        self._send_parameters_to_other_area_structure(
-            prefix=self._downstream_accelerator_prefix,
-            _dict={'injection_parameters': args_dict})
+        self._send_injection_parameters(args_dict)
 
     def _injection_cycle(self, **kwargs):
         charge = kwargs['charge']
@@ -882,32 +1283,316 @@ class RingModel(AcceleratorModel):
     """Ring models."""
 
     def __init__(self, **kwargs):
+        self._executor = None
+        self._equilibrium_future = None
+        self._equilibrium_epoch = None
+        self._state_key = None
+        self._fast_orbit = None  # orbit at response rows, if more recent
+        self._stage_pvs = None  # PVs updated by each publication stage
+        self._stages_published = False  # PVs are published once initialised
         super().__init__(**kwargs)
+        self._stages_published = True
         self._send_initialisation_sign()
 
+    def finalise(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        super().finalise()
+
     def _beam_dump(self, message1='panic', message2='', c='white', a=None):
         super()._beam_dump(message1, message2, c, a)
+        self._cancel_equilibrium_parameters()
+        self._orbit_response = None
+        self._fast_orbit = None
         self._m66 = None
         self._tunes = None
         self._transfer_matrices = None
         self._lifetime = None
         self._injection_efficiency = None
 
+    def _calc_ring_state(self):
+        """Calculate orbit, linear optics and equilibrium parameters.
+
+        Results are memoized by lattice fingerprint, so that returning to a
+        recent configuration does not require new calculations. Returns
+        False if calculations were abandoned because of new setpoints.
+        """
+        key = None
+        if STATE_MEMO_SIZE and self._lattice_changed:
+            key = self._get_lattice_fingerprint()
+            if self._restore_memoized_state(key):
+                self._log('calc', '{}: memoized state'.format(
+                    self.model_module.lattice_version))
+                self._state_key = key
+                self._publish_stage('Orbit')
+                if not self.simulate_only_orbit:
+                    self._publish_stage('Tunes')
+                    if self._lifetime is None:
+                        self._calc_equilibrium_parameters()
+                    else:
+                        self._calc_lifetimes()
+                        self._publish_stage('Lifetime')
+                return True
+
+        fast_orbit = self._calc_closed_orbit()
+        self._publish_stage('Orbit')
+        if not self.simulate_only_orbit and not fast_orbit:
+            if self._is_computation_superseded():
+                return False
+            self._calc_linear_optics()
+            self._publish_stage('Tunes')
+            if self._is_computation_superseded():
+                return False
+            self._calc_equilibrium_parameters()
+            if self._equilibrium_future is None:
+                self._calc_lifetimes()
+                self._publish_stage('Lifetime')
+
+        if STATE_MEMO_SIZE and not fast_orbit:
+            self._state_key = key or self._get_lattice_fingerprint()
+            self._memoize_ring_state(self._state_key)
+        return True
+
+    def _publish_stage(self, stage):
+        """Publish PV values calculated by a stage and time of their update.
+
+        Other read-only PVs are published once the state is updated.
+        """
+        if not self._stages_published:
+            return
+        if self._stage_pvs is None:
+            self._stage_pvs = self._get_stage_pvs()
+        pvs = self._stage_pvs[stage]
+        if self._watched_pvs is not None:
+            pvs = [pv for pv in pvs if pv in self._watched_pvs]
+        self._evaluate_pvs(pvs)
+        self._send_pv_to_driver(
+            utils.get_stage_timestamp_pv_name(self.prefix, stage), time.time())
+        self._flush_pvs_to_driver()
+
+    def _get_stage_pvs(self):
+        stage_pvs = {stage: [] for stage in utils.PUBLICATION_STAGES}
+        for pv_name in self.pv_module.get_dynamical_pvs() + \
+                self.pv_module.get_read_only_pvs():
+            parts = self._get_pv_parts(pv_name)
+            if parts.dis == 'DI' and parts.dev == 'BPM' and \
+                    parts.propty in ('PosX-Mon', 'PosY-Mon'):
+                stage_pvs['Orbit'].append(pv_name)
+            elif parts.dis == 'DI' and \
+                    parts.propty in ('Freq1-Mon', 'Freq2-Mon', 'Freq3-Mon'):
+                stage_pvs['Tunes'].append(pv_name)
+            elif parts.dis == 'AP' and \
+                    parts.propty in ('CurrLT-Mon', 'BbBCurrLT-Mon'):
+                stage_pvs['Lifetime'].append(pv_name)
+        # efficiencies are not published in PVs, only time of update
+        return stage_pvs
+
+    def _memoize_ring_state(self, key):
+        if self._orbit is None:
+            return
+        lifetime = self._lifetime
+        if self._equilibrium_future is not None:
+            lifetime = None  # memoized when background calculation ends
+        elif not self.simulate_only_orbit and lifetime is None:
+            return  # do not keep failed calculations
+        self._memoize_state(key, {
+            'orbit': self._orbit.copy(),
+            'twiss': self._twiss,
+            'm66': self._m66,
+            'tunes': self._tunes,
+            'lifetime': lifetime,
+            'orbit_response': self._orbit_response,
+            })
+
+    def _restore_memoized_state(self, key):
+        state = self._get_memoized_state(key)
+        if state is None:
+            return False
+        self._orbit = state['orbit'].copy()
+        self._twiss = state['twiss']
+        self._m66 = state['m66']
+        self._tunes = state['tunes']
+        self._lifetime = state['lifetime']
+        self._orbit_response = state['orbit_response']
+        self._fast_orbit = None
+        self._lattice_changed = False
+        return True
+
     def _calc_closed_orbit(self):
-        """Calculate closed orbit when there is beam."""
+        """Calculate closed orbit when there is beam.
+
+        Returns True if orbit was updated from its linear response to
+        corrector changes, in which case optics need not be recalculated.
+        """
 
         latver = self.model_module.lattice_version
 
+        if self._calc_closed_orbit_from_response():
+            self._log('calc', '{}: closed orbit (linear response)'.format(latver))
+            return True
+
+        self._lattice_changed = False
+        self._orbit_response = None
+        self._fast_orbit = None
         try:
             self._log('calc', '{}: closed orbit'.format(latver))
-            if TRACK6D:
-                self._orbit = pyaccel.tracking.findorbit6(self._accelerator, indices='open')
-            else:
-                self._orbit = numpy.zeros((6, len(self._accelerator)))
-                self._orbit[:4, :] = pyaccel.tracking.findorbit4(self._accelerator, indices='open')
+            t0 = time.time()
+            self._orbit = self._find_closed_orbit()
+            self._stats.add_time('Solve', time.time() - t0)
         except pyaccel.tracking.TrackingException:
             # beam is lost
             self._beam_dump('panic', '{}: closed orbit does not exist and beam is lost'.format(latver), c='red')
+        return False
+
+    def _find_closed_orbit(self):
+        """Find closed orbit starting from the last one, if there is one.
+
+        Falls back to a cold start if the warm started solve fails.
+        """
+        guess = None if self._orbit is None else self._orbit[:, 0]
+        if guess is not None and numpy.all(numpy.isfinite(guess)):
+            try:
+                return self._find_closed_orbit_from(guess)
+            except pyaccel.tracking.TrackingException:
+                self._log('calc', '{}: warm started closed orbit failed'.format(
+                    self.model_module.lattice_version), c='yellow')
+        return self._find_closed_orbit_from(None)
+
+    def _find_closed_orbit_from(self, guess):
+        if TRACK6D:
+            return pyaccel.tracking.findorbit6(
+                self._accelerator, indices='open', fixed_point_guess=guess)
+        orbit = numpy.zeros((6, len(self._accelerator)))
+        orbit[:4, :] = pyaccel.tracking.findorbit4(
+            self._accelerator, indices='open',
+            fixed_point_guess=None if guess is None else guess[:4])
+        return orbit
+
+    def _calc_closed_orbit_from_response(self):
+        """Update orbit at BPMs from corrector changes.
+
+        Only applicable when correctors are the only elements changed since
+        the last full orbit solve and changes are small enough for the
+        response to be linear: corrector and orbit changes are limited, and
+        so is the tune shift that orbit changes at sextupoles would cause,
+        as an estimate of the response nonlinearity. Orbit of last full
+        solve is kept in _orbit, while the updated one is kept in
+        _fast_orbit, at response rows only.
+        """
+        response = self._orbit_response
+        if response is None or self._lattice_changed or self._orbit is None:
+            return False
+        orbit = response['orbit'].copy()
+        for plane, (cols, matrix, kicks, delta) in response['planes'].items():
+            dkicks = self._get_corrector_kicks(cols, plane) - kicks
+            if numpy.any(numpy.abs(dkicks) > ORBIT_FAST_MAX_KICK):
+                return False
+            orbit[0 if plane == Plane.horizontal else 2] += matrix @ dkicks
+            if delta is not None:
+                orbit[4] += delta @ dkicks
+        dorbit = orbit[[0, 2]] - response['orbit'][[0, 2]]
+        if numpy.any(numpy.abs(dorbit) > ORBIT_FAST_MAX_DELTA):
+            return False
+        rows, weights = response['sextupoles']
+        if rows.size:
+            shifts = weights @ dorbit[:, rows].ravel()
+            if numpy.any(numpy.abs(shifts) > ORBIT_FAST_MAX_TUNE_SHIFT):
+                return False
+        self._fast_orbit = orbit
+        return True
+
+    def _get_bpm_orbit(self, indices):
+        if self._fast_orbit is None:
+            return super()._get_bpm_orbit(indices)
+        rows = numpy.searchsorted(self._orbit_response['rows'], indices)
+        return self._fast_orbit[:, rows]
+
+    def _find_sextupoles(self):
+        return numpy.array([
+            idx for idx, element in enumerate(self._accelerator)
+            if len(element.polynom_b) > 2 and element.polynom_b[2] != 0.0],
+            dtype=int)
+
+    def _calc_sextupole_tune_shifts(self, indices):
+        """Build matrix of tune shifts from orbit changes at sextupoles.
+
+        Orbit changes at sextupoles feed down to quadrupole and skew
+        quadrupole strengths. Rows of the matrix give horizontal and
+        vertical tune shifts and coupling coefficient for horizontal
+        and vertical orbit changes (concatenated).
+        """
+        strengths = numpy.array([
+            2*self._accelerator[idx].polynom_b[2] *
+            (self._accelerator[idx].length or 1.0) for idx in indices])
+        betax = numpy.asarray(self._twiss.betax)[indices]
+        betay = numpy.asarray(self._twiss.betay)[indices]
+        zeros = numpy.zeros(len(indices))
+        weights = numpy.array([
+            numpy.r_[strengths*betax, zeros]/(4*numpy.pi),
+            numpy.r_[-strengths*betay, zeros]/(4*numpy.pi),
+            numpy.r_[zeros, strengths*numpy.sqrt(betax*betay)]/(2*numpy.pi),
+            ])
+        return weights
+
+    def _init_orbit_response(self):
+        """Build orbit response matrices to correctors from linear optics."""
+        self._orbit_response = None
+        if not ORBIT_FAST_MODE or not self._corrector_magnets:
+            return
+        try:
+            _, bpm_indices = self._get_cached(
+                'bpm_slices', self._calc_bpm_slices)
+            sextupoles = self._find_sextupoles()
+            rows = numpy.unique(
+                numpy.r_[0, bpm_indices, sextupoles]).astype(int)
+            sextupole_rows = numpy.searchsorted(rows, sextupoles)
+            weights = self._calc_sextupole_tune_shifts(sextupoles)
+            length = pyaccel.lattice.length(self._accelerator)
+            mcf = pyaccel.optics.get_mcf(self._accelerator) if TRACK6D \
+                else None
+            planes = dict()
+            for plane in (Plane.horizontal, Plane.vertical):
+                cols = sorted(
+                    idx for m, plane_ in self._corrector_magnets.items()
+                    if plane_ == plane for idx in m.indices)
+                cols = numpy.array(cols, dtype=int)
+                if plane == Plane.horizontal:
+                    beta, mu = self._twiss.betax, self._twiss.mux
+                else:
+                    beta, mu = self._twiss.betay, self._twiss.muy
+                beta, mu = numpy.asarray(beta), numpy.asarray(mu)
+                tune = self._tunes[plane]
+                tune += numpy.round(mu[-1]/2/numpy.pi - tune)
+                dmu = numpy.abs(mu[rows][:, None] - mu[cols][None, :])
+                matrix = numpy.sqrt(beta[rows][:, None]*beta[cols][None, :])
+                matrix *= numpy.cos(dmu - numpy.pi*tune)
+                matrix /= 2*numpy.sin(numpy.pi*tune)
+                delta = None
+                if mcf is not None and plane == Plane.horizontal:
+                    # energy deviation from path length change at fixed RF
+                    eta = numpy.asarray(self._twiss.etax)
+                    delta = -eta[cols]/(mcf*length)
+                    matrix += eta[rows][:, None]*delta[None, :]
+                kicks = self._get_corrector_kicks(cols, plane)
+                planes[plane] = (cols, matrix, kicks, delta)
+        except Exception as err:
+            self._log('warn', '{}: orbit response not available ({})'.format(
+                self.model_module.lattice_version, str(err)), c='yellow')
+            return
+        self._orbit_response = {
+            'rows': rows, 'orbit': self._orbit[:, rows].copy(),
+            'planes': planes, 'sextupoles': (sextupole_rows, weights)}
+
+    def _get_corrector_kicks(self, indices, plane):
+        kicks = numpy.empty(len(indices))
+        for k, idx in enumerate(indices):
+            element = self._accelerator[idx]
+            length = element.length if element.length != 0.0 else 1.0
+            if plane == Plane.horizontal:
+                kicks[k] = -element.polynom_b[0]*length
+            else:
+                kicks[k] = element.polynom_a[0]*length
+        return kicks
 
     def _calc_linear_optics(self):
         """Calculate linear optics when there is beam."""
@@ -919,9 +1604,9 @@ class RingModel(AcceleratorModel):
 
         try:
             self._log('calc', '{}: linear optics'.format(latver))
-            self._twiss, self._m66 = \
-                pyaccel.optics.calc_twiss(self._accelerator, fixed_point=self._orbit[:, 0])
+            self._twiss, self._m66 = self._calc_periodic_twiss()
             self._tunes = pyaccel.optics.get_frac_tunes(m1turn=self._m66)
+            self._init_orbit_response()
         # Beam is lost
         except (
             ValueError,
@@ -932,6 +1617,18 @@ class RingModel(AcceleratorModel):
             self._beam_dump('panic',
                 '{}: unstable linear optics and beam is lost ({})'.format(latver, str(err)), c='red')
 
+    def _calc_periodic_twiss(self):
+        if self._transfer_maps is not None:
+            try:
+                return self._transfer_maps.calc_twiss(self._orbit)
+            except Exception as err:
+                # use full calculation from now on
+                self._log('warn', '{}: incremental optics disabled ({})'.format(
+                    self.model_module.lattice_version, str(err)), c='yellow')
+                self._transfer_maps = None
+        return pyaccel.optics.calc_twiss(
+            self._accelerator, fixed_point=self._orbit[:, 0])
+
     def _calc_equilibrium_parameters(self):
         """Calculate equilibrium parameters."""
 
@@ -940,6 +1637,17 @@ class RingModel(AcceleratorModel):
         if self._m66 is None:
             return
 
+        if ASYNC_EQUILIBRIUM:
+            # lifetimes of previous state are kept until results are ready
+            self._log('calc', '{}: equilibrium parameters (background)'.format(latver))
+            self._cancel_equilibrium_parameters()
+            if self._executor is None:
+                self._executor = _futures.ThreadPoolExecutor(max_workers=1)
+            self._equilibrium_epoch = self._lattice_epoch
+            self._equilibrium_future = self._executor.submit(
+                pyaccel.lifetime.Lifetime, self._accelerator[:])
+            return
+
         try:
             self._log('calc', '{}: equilibrium parameters'.format(latver))
             self._lifetime =  pyaccel.lifetime.Lifetime(self._accelerator)
@@ -947,12 +1655,56 @@ class RingModel(AcceleratorModel):
             self._beam_dump('panic',
                 '{}: unable to calc equilibrium parameters and beam is lost ({})'.format(latver, str(err)), c='red')
 
+    def _is_snapshot_complete(self):
+        return self._equilibrium_future is None
+
+    def _get_snapshot_states(self):
+        # equilibrium parameters that cannot be saved are recalculated
+        # when the state is restored
+        states = super()._get_snapshot_states()
+        for key, state in self._states_memo.items():
+            if key not in states and isinstance(state, dict):
+                state = dict(state, lifetime=None)
+                if snapshot.is_picklable(state):
+                    states[key] = state
+        return states
+
+    def _cancel_equilibrium_parameters(self):
+        if self._equilibrium_future is not None:
+            self._equilibrium_future.cancel()
+            self._equilibrium_future = None
+
+    def _apply_equilibrium_parameters(self):
+        """Apply results of background calculation, if still valid."""
+        future = self._equilibrium_future
+        if future is None or not future.done():
+            return
+        self._equilibrium_future = None
+        latver = self.model_module.lattice_version
+        if self._equilibrium_epoch != self._lattice_epoch or self._m66 is None:
+            return  # results of a superseded lattice state
+        try:
+            self._lifetime = future.result()
+        except Exception as err:
+            self._beam_dump('panic',
+                '{}: unable to calc equilibrium parameters and beam is lost ({})'.format(latver, str(err)), c='red')
+            return
+        state = self._states_memo.get(self._state_key)
+        if state is not None:
+            state['lifetime'] = self._lifetime
+        self._save_snapshot()
+        self._calc_lifetimes()
+        self._publish_stage('Lifetime')
+        self._update_injection_efficiency = True
+        self._update_ejection_efficiency = True
+        self._state_changed = True
+
     def _calc_lifetimes(self):
         latver = self.model_module.lattice_version
 
         if self._lifetime is None or self._beam_charge is None: return
 
-        time_interval = pyaccel.optics.get_revolution_period(self._accelerator)
+        time_interval = self._get_revolution_period()
         charge_total = self._beam_charge.total_value
         current_total = charge_total / time_interval
         self._lifetime.curr_per_bunch = current_total / self._beam_charge.nr_bunches
@@ -1005,17 +1757,17 @@ class BoosterModel(RingModel):
     # --- methods that help updating the model state
 
     def _update_state(self, force=False):
-        if force or self._state_deprecated:
-            self._calc_closed_orbit()
-            if not self.simulate_only_orbit:
-                self._calc_linear_optics()
-                self._calc_equilibrium_parameters()
-                self._calc_lifetimes()
+        self._apply_equilibrium_parameters()
+        self._apply_monte_carlo_results()
+        aborts = self._consecutive_aborts
+        if (force or self._state_deprecated) and self._calc_ring_state():
             self._update_injection_efficiency = True
             self._update_ejection_efficiency  = True
             self._state_changed = True
             self._state_deprecated = False
         self._calc_efficiencies()
+        if self._consecutive_aborts == aborts:
+            self._consecutive_aborts = 0
 
     def _calc_efficiencies(self):
         if self._lifetime is None:
@@ -1027,35 +1779,43 @@ class BoosterModel(RingModel):
         if self._update_injection_efficiency:# and (self._received_charge or self._injection_efficiency is None):
             self._update_injection_efficiency = False
             self._calc_injection_efficiency()
+            if not self._update_injection_efficiency:
+                self._publish_stage('Efficiency')
 
         # Calculate ejection efficiency
         if self._update_ejection_efficiency:# and (self._received_charge or self._ejection_efficiency is None):
             self._update_ejection_efficiency = False
             self._calc_ejection_efficiency()
+            self._publish_stage('Efficiency')
 
-    def _reset(self, message1='reset', message2='', c='white', a=None):
-        # Create beam charge object
-        self._beam_charge  = beam_charge.BeamCharge(nr_bunches = self.nr_bunches)
-        self._beam_dump(message1,message2,c,a)
-
+    def _create_accelerator(self):
         # Shift accelerator to start in the injection point
         self._accelerator  = self.model_module.create_accelerator(energy=self.init_energy)
-        self._lattice_length = pyaccel.lattice.length(self._accelerator)
         if not hasattr(self, '_injection_point_label'):
-            self._others_queue['driver'].put(('a', 'injection point label for ' + self.model_module.lattice_version + ' not defined!'))
+            self._send_message('driver', ('a', 'injection point label for ' + self.model_module.lattice_version + ' not defined!'))
         else:
             injection_point    = pyaccel.lattice.find_indices(self._accelerator, 'fam_name', self._injection_point_label)[0]
             if not injection_point:
-                self._others_queue['driver'].put(('a', 'injection point label "' + self._injection_point_label + '" not found in ' + self.model_module.lattice_version))
+                self._send_message('driver', ('a', 'injection point label "' + self._injection_point_label + '" not found in ' + self.model_module.lattice_version))
             else:
                 self._accelerator  = pyaccel.lattice.shift(self._accelerator, start = injection_point)
 
         # Append marker to accelerator
         self._append_marker()
+        return self._accelerator
+
+    def _reset(self, message1='reset', message2='', c='white', a=None):
+        # Create beam charge object
+        self._beam_charge  = beam_charge.BeamCharge(nr_bunches = self.nr_bunches)
+        self._beam_dump(message1,message2,c,a)
+
+        self._accelerator = self._get_initial_accelerator()
+        self._lattice_length = pyaccel.lattice.length(self._accelerator)
         self._extraction_point = pyaccel.lattice.find_indices(self._accelerator, 'fam_name', self._extraction_point_label)[0]
 
         # Create record names dictionary
         self._all_pvs = self.device_names.get_device_names(self._accelerator)
+        self._init_pv_routes()
         #self._all_pvs.update(self.pv_module.get_fake_record_names(self._accelerator))
 
         # Set radiation and cavity on
@@ -1063,6 +1823,7 @@ class BoosterModel(RingModel):
             pyaccel.tracking.set6dtracking(self._accelerator)
 
         self._set_vacuum_chamber()
+        self._init_transfer_maps()
         self._rampps_enabled = 1
         self._rampps_delay = 0
         self._state_deprecated = True
@@ -1127,7 +1888,7 @@ class BoosterModel(RingModel):
         for magnet_name, magnet in self._pulsed_magnets.items():
             pv_name = self._magnet2delay[magnet_name]
             value = magnet.delay
-            self._others_queue['driver'].put(('s', (pv_name, value)))
+            self._send_pv_to_driver(pv_name, value)
 
     def _get_tune_component(self, plane):
         charge = self._beam_charge.total_value
@@ -1164,7 +1925,13 @@ class BoosterModel(RingModel):
         _dict = self._injection_parameters
         _dict.update(self._get_vacuum_chamber())
         _dict.update(self._get_coordinate_system_parameters())
-        tracking_loss_fraction = injection.calc_charge_loss_fraction_in_ring(self, **_dict)
+        _dict['monte_carlo'] = self._get_monte_carlo_submitter('injection')
+        tracking_loss_fraction = injection.calc_charge_loss_fraction_in_ring(
+            self, cancel=self._is_computation_superseded, **_dict)
+        if tracking_loss_fraction is None:
+            # superseded by new setpoints: calculate again in next cycle
+            self._update_injection_efficiency = True
+            return
         self._injection_efficiency = 1.0 - tracking_loss_fraction
         self._log('calc', '{}: injection efficiency {:.2f} %'.format(
             self.model_module.lattice_version, 100*self._injection_efficiency))
@@ -1207,6 +1974,7 @@ class BoosterModel(RingModel):
         ejection_parameters = self._get_equilibrium_at_maximum_energy()
         _dict.update(ejection_parameters)
         _dict.update(self._get_vacuum_chamber(init_idx=idx, final_idx=self._extraction_point+1))
+        _dict['monte_carlo'] = self._get_monte_carlo_submitter('ejection')
         tracking_loss_fraction, twiss, *_ = \
             injection.calc_charge_loss_fraction_in_line(self, init_twiss=self._twiss[idx], **_dict)
         self._ejection_efficiency = 1.0 - tracking_loss_fraction
@@ -1225,9 +1993,7 @@ class BoosterModel(RingModel):
         args_dict.update(ejection_parameters)
         if twiss is not None:
             args_dict['init_twiss'] = twiss[-1].make_dict()
-            self._send_parameters_to_other_area_structure(
-                prefix = self._downstream_accelerator_prefix,
-                _dict  = {'injection_parameters' : args_dict})
+            self._send_injection_parameters(args_dict)
 
     def _change_injection_bunch(self, charge, charge_time, master_delay, bunch_separation):
         harmonic_number = self._accelerator.harmonic_number
@@ -1300,13 +2066,12 @@ class StorageRingModel(RingModel):
     def _get_pv_static(self, pv_name, parts):
         if parts.dis == 'DI' and parts.dev == 'BPM':
             charge = self._beam_charge.total_value
-            idx = self._get_elements_indices(pv_name)
             if parts.propty == 'PosX-Mon':
                 if self._orbit is None or charge == 0.0: return _undef_value
-                return _meter_2_nm*self._orbit[0,idx]
+                return self._get_bpm_reading(pv_name, Plane.horizontal)
             elif parts.propty == 'PosY-Mon':
                 if self._orbit is None or charge == 0.0: return _undef_value
-                return _meter_2_nm*self._orbit[2,idx]
+                return self._get_bpm_reading(pv_name, Plane.vertical)
             return None
         else:
             return super()._get_pv_static(pv_name, parts)
@@ -1314,16 +2079,16 @@ class StorageRingModel(RingModel):
     # --- methods that help updating the model state
 
     def _update_state(self, force=False):
-        if force or self._state_deprecated:
-            self._calc_closed_orbit()
-            if not self.simulate_only_orbit:
-                self._calc_linear_optics()
-                self._calc_equilibrium_parameters()
-                self._calc_lifetimes()
+        self._apply_equilibrium_parameters()
+        self._apply_monte_carlo_results()
+        aborts = self._consecutive_aborts
+        if (force or self._state_deprecated) and self._calc_ring_state():
             self._update_injection_efficiency = True
             self._state_deprecated = False
             self._state_changed = True
         self._calc_efficiencies()
+        if self._consecutive_aborts == aborts:
+            self._consecutive_aborts = 0
 
     def _calc_efficiencies(self):
         # Calculate nlk and on-axis injection efficiencies
@@ -1331,27 +2096,34 @@ class StorageRingModel(RingModel):
             self._update_injection_efficiency = False
             if not self.simulate_only_orbit:
                 self._calc_injection_efficiency()
+                if not self._update_injection_efficiency:
+                    self._publish_stage('Efficiency')
 
-    def _reset(self, message1='reset', message2='', c='white', a=None):
-        self._beam_charge  = beam_charge.BeamCharge(nr_bunches = self.nr_bunches)
-        self._beam_dump(message1,message2,c,a)
-
+    def _create_accelerator(self):
         # Shift accelerator to start in the injection point
         self._accelerator  = self.model_module.create_accelerator()
         if not hasattr(self, '_injection_point_label'):
-            self._others_queue['driver'].put(('a', 'injection point label for ' + self.model_module.lattice_version + ' not defined!'))
+            self._send_message('driver', ('a', 'injection point label for ' + self.model_module.lattice_version + ' not defined!'))
         else:
             injection_point    = pyaccel.lattice.find_indices(self._accelerator, 'fam_name', self._injection_point_label)[0]
             if not injection_point:
-                self._others_queue['driver'].put(('a', 'injection point label "' + self._injection_point_label + '" not found in ' + self.model_module.lattice_version))
+                self._send_message('driver', ('a', 'injection point label "' + self._injection_point_label + '" not found in ' + self.model_module.lattice_version))
             else:
                 self._accelerator  = pyaccel.lattice.shift(self._accelerator, start=injection_point)
 
         # Append marker to accelerator
         self._append_marker()
+        return self._accelerator
+
+    def _reset(self, message1='reset', message2='', c='white', a=None):
+        self._beam_charge  = beam_charge.BeamCharge(nr_bunches = self.nr_bunches)
+        self._beam_dump(message1,message2,c,a)
+
+        self._accelerator = self._get_initial_accelerator()
 
         # Create record names dictionary
         self._all_pvs = self.device_names.get_device_names(self._accelerator)
+        self._init_pv_routes()
         #self._all_pvs.update(self.pv_module.get_fake_record_names(self._accelerator))
 
         # Set radiation and cavity on
@@ -1359,6 +2131,7 @@ class StorageRingModel(RingModel):
             pyaccel.tracking.set6dtracking(self._accelerator)
 
         self._set_vacuum_chamber()
+        self._init_transfer_maps()
         self._state_deprecated = True
         self._update_state()
 
@@ -1395,7 +2168,8 @@ class StorageRingModel(RingModel):
         for magnet_name in nominal_delays.keys():
             nominal_delays[magnet_name] -= min_delay
 
-        self._others_queue['LI'].put(('p', {'update_delays' : nominal_delays}))
+        self._send_parameters_to_other_area_structure(
+            prefix='LI', _dict={'update_delays' : nominal_delays})
 
     def _update_pulsed_magnets_delays(self, delays):
         for magnet_name, delay in delays.items():
@@ -1407,7 +2181,7 @@ class StorageRingModel(RingModel):
         for magnet_name, magnet in self._pulsed_magnets.items():
             pv_name = self._magnet2delay[magnet_name]
             value = magnet.delay
-            self._others_queue['driver'].put(('s', (pv_name, value)))
+            self._send_pv_to_driver(pv_name, value)
 
     def _get_tune_component(self, plane):
         charge = self._beam_charge.total_value
@@ -1422,6 +2196,7 @@ class StorageRingModel(RingModel):
         _dict = self._injection_parameters
         _dict.update(self._get_vacuum_chamber())
         _dict.update(self._get_coordinate_system_parameters())
+        _dict['monte_carlo'] = self._get_monte_carlo_submitter('injection')
 
         for psname, ps in self._pulsed_power_supplies.items():
             if 'InjNLKckr' in psname:
@@ -1437,7 +2212,12 @@ class StorageRingModel(RingModel):
             #     if 'InjNLKckr' in psname and ps.enabled:
             #         ps.pwrstate_sel = 1
 
-            injection_loss_fraction = injection.calc_charge_loss_fraction_in_ring(self, **_dict)
+            injection_loss_fraction = injection.calc_charge_loss_fraction_in_ring(
+                self, cancel=self._is_computation_superseded, **_dict)
+            if injection_loss_fraction is None:
+                # superseded by new setpoints: calculate again in next cycle
+                self._update_injection_efficiency = True
+                return
             self._injection_efficiency = 1.0 - injection_loss_fraction
             
             # for psname, ps in self._pulsed_power_supplies.items():
@@ -1452,7 +2232,12 @@ class StorageRingModel(RingModel):
             #     if 'InjDpKckr' in psname and ps.enabled:
             #         ps.pwrstate_sel = 1
             
-            injection_loss_fraction = injection.calc_charge_loss_fraction_in_ring(self, **_dict)
+            injection_loss_fraction = injection.calc_charge_loss_fraction_in_ring(
+                self, cancel=self._is_computation_superseded, **_dict)
+            if injection_loss_fraction is None:
+                # superseded by new setpoints: calculate again in next cycle
+                self._update_injection_efficiency = True
+                return
             self._injection_efficiency = 1.0 - injection_loss_fraction
             
             # for psname, ps in self._pulsed_power_supplies.items():
@@ -1504,3 +2289,27 @@ class StorageRingModel(RingModel):
             self._log(message1='cycle', message2='beam injection in {0:s}: {1:.2f}% efficiency'.format(self.prefix, 100*efficiency))
 
         self._beam_inject(charge=charge)
+
+
+def _get_element_digest(element):
+    """Return hash of element fields, misalignments and RF, as bytes."""
+    sha = hashlib.sha1()
+    for attr in ('polynom_a', 'polynom_b', 't_in', 't_out', 'r_in', 'r_out'):
+        sha.update(numpy.asarray(getattr(element, attr), dtype=float).tobytes())
+    sha.update(numpy.array(
+        [element.voltage, element.frequency], dtype=float).tobytes())
+    return numpy.frombuffer(sha.digest(), dtype=numpy.uint8)
+
+
+def _freeze_parameters(value):
+    """Return hashable copy of parameters, with floats rounded."""
+    if hasattr(value, 'make_dict'):
+        value = value.make_dict()
+    if isinstance(value, dict):
+        return tuple(sorted(
+            (key, _freeze_parameters(val)) for key, val in value.items()))
+    if isinstance(value, (list, tuple, numpy.ndarray)):
+        return tuple(_freeze_parameters(val) for val in value)
+    if isinstance(value, (float, numpy.floating)):
+        return float('{:.{}g}'.format(value, PARAMETERS_DIGITS))
+    return value
@@ -1,11 +1,20 @@
 import uuid as _uuid
+import time
+import queue
+import threading
+import collections
 import multiprocessing
+import numpy as _np
 from va import utils
+from va.shared_arrays import SharedPVArrays
 import traceback
 import sys
 # import prctl #Used in debugging
 
 SIMUL_ONLY_ORBIT = False
+PV_UPDATE_TOLERANCE = 0.0  # absolute tolerance to consider a PV value changed
+USE_SHARED_MEMORY = True  # publish orbit and bunch arrays via shared memory
+QUEUE_MAX_SIZE = 100  # bound on area structure queues
 
 class AreaStructureProcess(multiprocessing.Process):
 
@@ -14,11 +23,13 @@ class AreaStructureProcess(multiprocessing.Process):
 
         Keyword arguments: see start_and_run_area_structure
         """
-        my_queue = multiprocessing.Queue()
+        my_queue = multiprocessing.Queue(QUEUE_MAX_SIZE)
         self.others_queue = dict()
         self.my_queue = my_queue
         self.area_structure_cls = area_structure_cls
         self.area_structure_prefix = area_structure_cls.prefix
+        self.shared_arrays = SharedPVArrays.from_database(
+            area_structure_cls.database) if USE_SHARED_MEMORY else None
 
         super().__init__(
             target=self.start_and_run_area_structure,
@@ -29,6 +40,7 @@ class AreaStructureProcess(multiprocessing.Process):
                 # Queues are supposed to be exchanged
                 'others_queue': self.others_queue,
                 'my_queue': my_queue,
+                'shared_arrays': self.shared_arrays,
                 'finalisation': finalisation,
                 },
             name = 'Thread-' + area_structure_cls.prefix
@@ -40,6 +52,12 @@ class AreaStructureProcess(multiprocessing.Process):
                 continue
             self.others_queue[prefix] = queue
 
+    def close_shared_arrays(self):
+        """Release shared memory region, once process has finished."""
+        if self.shared_arrays is not None:
+            self.shared_arrays.close()
+            self.shared_arrays = None
+
     def start_and_run_area_structure(self, area_structure_cls, interval, stop_event, finalisation, **kwargs):
         """Start periodic processing of area_structure
 
@@ -52,10 +70,13 @@ class AreaStructureProcess(multiprocessing.Process):
         """
         area_structure = area_structure_cls(**kwargs)
         # prctl.set_name(self.name) # For debug
+        waitables = [utils.get_queue_waitable(kwargs['my_queue'])]
 
         try:
             while not stop_event.is_set():
-                utils.process_and_wait_interval(area_structure.process, interval)
+                utils.process_and_wait_events(
+                    area_structure.process, interval, waitables,
+                    area_structure.has_pending_requests)
         except Exception as ex:
             exc_info = sys.exc_info()
             print('--- traceback ---')
@@ -74,12 +95,28 @@ class AreaStructureProcess(multiprocessing.Process):
 
 class AreaStructure:
 
-    def __init__(self, others_queue, my_queue, log_func=utils.log, **kwargs):
+    def __init__(self, others_queue, my_queue, shared_arrays=None,
+                 log_func=utils.log, **kwargs):
         self._uuid = _uuid.uuid4()
         self._others_queue = others_queue
         self._my_queue = my_queue
+        self._shared_arrays = shared_arrays
         self._log = log_func
         self._state_changed = False
+        self._pvs_sent = dict()  # last values sent to driver, by PV name
+        self._pvs_to_send = dict()  # PV values waiting for next bulk message
+        self._pvs_to_share = dict()  # PV values waiting for shared memory
+        self._pv_index = None
+        self._watched_pvs = None  # PVs watched by clients, None if unknown
+        self._pvs_to_evaluate = set()  # PVs that have just become watched
+        self._pvs_to_acknowledge = set()  # PVs evaluated on client reads
+        self._pending_requests = collections.deque()  # read from my_queue
+        self._outboxes = dict()  # messages waiting for room, by destination
+        self._thread = threading.current_thread()  # thread processing requests
+        self._posted_pvs = dict()  # PV values posted by other threads
+        self._posted_pvs_lock = threading.Lock()
+        self._stats = utils.PerformanceCounters()
+        self._timeline = utils.StartupTimeline(self.prefix)
         self.simulate_only_orbit = SIMUL_ONLY_ORBIT
 
     @property
@@ -88,22 +125,106 @@ class AreaStructure:
         return self._log
         
     def process(self):
+        t0 = time.time()
+        self._flush_outboxes()
         self._process_requests()
+        t1 = time.time()
         self._update_state()
+        t2 = time.time()
         self._update_pvs()
+        self._flush_pvs_to_driver()
+        self._acknowledge_evaluations()
+        t3 = time.time()
+        self._stats.add_time('Requests', t1 - t0)
+        self._stats.add_time('State', t2 - t1)
+        self._stats.add_time('PVs', t3 - t2)
+        self._stats.add_time('Cycle', t3 - t0)
+        self._send_stats_to_driver()
+
+    def _send_stats_to_driver(self):
+        if self._stats.is_due():
+            # statistics not sent yet are superseded
+            self._send_message(
+                'driver', ('t', (self.prefix, self._stats.get_summary())),
+                key='t')
+
+    def _get_outbox(self, prefix):
+        outbox = self._outboxes.get(prefix)
+        if outbox is None:
+            outbox = utils.QueueOutbox(self._others_queue[prefix])
+            self._outboxes[prefix] = outbox
+        return outbox
+
+    def _send_message(self, prefix, message, key=None):
+        """Send message to driver or other area structure.
+
+        Queues are bounded: messages that do not fit are kept and sent, in
+        order, in the next cycles. Messages with a key supersede waiting
+        ones with the same key.
+        """
+        self._get_outbox(prefix).put(message, key)
+
+    def _flush_outboxes(self):
+        for outbox in self._outboxes.values():
+            outbox.flush()
+
+    def _put_in_driver_queue(self, message):
+        """Put message in driver queue if there is room for it.
+
+        Messages kept in driver outbox go first, to keep the order.
+        """
+        if not self._get_outbox('driver').flush():
+            return False
+        try:
+            self._others_queue['driver'].put_nowait(message)
+            return True
+        except queue.Full:
+            return False
 
     def _process_requests(self):
-        size = self._my_queue.qsize()
+        self._read_requests()
+        self._send_posted_pvs()
+        size = len(self._pending_requests)
+        self._stats.set_gauge('QueueSize', size)
+        self._stats.add_count('Msg', size)
         for _ in range(size):
-            request = self._my_queue.get()
+            request = self._pending_requests.popleft()
             self._process_request(request)
 
+    def _read_requests(self):
+        size = self._my_queue.qsize()
+        for _ in range(size):
+            self._pending_requests.append(self._my_queue.get())
+
+    def has_pending_requests(self):
+        """Check whether requests already read from queue await processing.
+
+        These no longer wake up processing through the queue.
+        """
+        return bool(self._pending_requests)
+
+    def _has_pending_writes(self):
+        """Check whether there are writes changing the model waiting."""
+        self._read_requests()
+        return any(cmd == 's' and self._is_model_write(data[0])
+                   for cmd, data in self._pending_requests)
+
+    def _is_model_write(self, pv_name):
+        """Check whether writing to PV changes the state being computed."""
+        return True
+
     def _process_request(self, request):
         cmd, data = request
         if cmd == 's':
             self._set_parameter(data)
         elif cmd == 'p':
             self._get_parameters_from_other_area_structure(data)
+        elif cmd == 'w':
+            self._set_watched_pvs(data)
+        elif cmd == 'v':
+            pass  # values posted by other threads, sent in every cycle
+        elif cmd == 'r':
+            self._request_evaluation(data)
         else:
             utils.log('!cmd', cmd, c='red', a=['bold'])
 
@@ -114,6 +235,25 @@ class AreaStructure:
         pv_name, value = data
         self._set_pv(pv_name, value)
 
+    def _set_watched_pvs(self, pvs):
+        if self._watched_pvs is None:
+            self._watched_pvs = set()
+        self._pvs_to_evaluate.update(pvs - self._watched_pvs)
+        self._watched_pvs = pvs
+
+    def _request_evaluation(self, pvs):
+        """Evaluate PVs read by clients, acknowledging it to driver."""
+        self._pvs_to_evaluate.update(pvs)
+        self._pvs_to_acknowledge.update(pvs)
+
+    def _acknowledge_evaluations(self):
+        # values must reach driver before acknowledgement
+        if not self._pvs_to_acknowledge or self._pvs_to_send:
+            return
+        if self._put_in_driver_queue(
+                ('e', (self.prefix, self._pvs_to_acknowledge))):
+            self._pvs_to_acknowledge = set()
+
     def _update_pvs(self):
         pvs = []
 
@@ -121,21 +261,113 @@ class AreaStructure:
         if not self.simulate_only_orbit:
             pvs = pvs + self.pv_module.get_dynamical_pvs()
 
-        # if model changes, also update all read-only PVs
-        # NOTE: this can be improved. instead of sending all read_only_pvs to drive
-        # one can keep a list of changed PVs.
+        # if model changes, also update all read-only PVs. Only values that
+        # differ from the ones last sent are propagated to the driver.
         pvs = pvs + (self.pv_module.get_read_only_pvs() if self._state_changed else [])
-        for pv in pvs:
-            self._others_queue['driver'].put(('s', (pv, self._get_pv(pv))))
+
+        # PVs no client is watching are evaluated when they become watched
+        # or are read
+        if self._watched_pvs is not None:
+            pvs = [pv for pv in pvs if pv in self._watched_pvs]
+        if self._pvs_to_evaluate:
+            pvs_to_evaluate = self._pvs_to_evaluate.difference(pvs)
+            self._pvs_to_evaluate = set()
+            pvs.extend(
+                pv for pv in self.pv_module.get_dynamical_pvs() +
+                self.pv_module.get_read_only_pvs()
+                if pv in pvs_to_evaluate)
+        self._evaluate_pvs(pvs)
 
         # signal that model state change has already been propagated to epics driver
         self._state_changed = False
 
+    def _evaluate_pvs(self, pvs):
+        """Evaluate PVs, sending values that changed to driver."""
+        for pv in pvs:
+            value = self._get_pv(pv)
+            if self._pv_value_changed(pv, value):
+                self._send_pv_to_driver(pv, value)
+
+    def _pv_value_changed(self, pv_name, value):
+        if pv_name not in self._pvs_sent:
+            return True
+        return _value_changed(
+            self._pvs_sent[pv_name], value, PV_UPDATE_TOLERANCE)
+
+    def _send_pv_to_driver(self, pv_name, value):
+        self._pvs_sent[pv_name] = value
+        if self._shared_arrays is not None and \
+                self._shared_arrays.fits(pv_name, value):
+            self._pvs_to_share[pv_name] = value
+        else:
+            self._pvs_to_send[pv_name] = value
+
+    def _post_pv_to_driver(self, pv_name, value):
+        """Send PV value to driver from any thread.
+
+        Values computed in other threads are kept, latest value by PV, until
+        the processing loop, woken up through own queue, sends them. So PV
+        buffers are only touched by the thread processing requests.
+        """
+        if threading.current_thread() is self._thread:
+            self._send_pv_to_driver(pv_name, value)
+            return
+        with self._posted_pvs_lock:
+            self._posted_pvs[pv_name] = value
+        try:
+            self._my_queue.put_nowait(('v', None))
+        except queue.Full:
+            pass  # loop wakes up anyway to process requests in queue
+
+    def _send_posted_pvs(self):
+        with self._posted_pvs_lock:
+            pvs, self._posted_pvs = self._posted_pvs, dict()
+        for pv_name, value in pvs.items():
+            self._send_pv_to_driver(pv_name, value)
+
+    def _flush_pvs_to_driver(self):
+        """Send all pending PV values to driver in a single bulk message."""
+        if self._pvs_to_share:
+            pvs, self._pvs_to_share = self._pvs_to_share, dict()
+            self._shared_arrays.write(pvs)
+            if not self._pvs_to_send:
+                # wake up driver to read shared memory
+                self._send_message('driver', ('u', self.prefix), key='u')
+        if not self._pvs_to_send:
+            return
+        if self._pv_index is None:
+            self._pv_index = {
+                pv: i for i, pv in enumerate(
+                    utils.get_pv_names_table(self.database))}
+        pvs, self._pvs_to_send = self._pvs_to_send, dict()
+        indices, values, indices_names = [], [], []
+        for pv_name, value in list(pvs.items()):
+            idx = self._pv_index.get(pv_name)
+            if idx is None:
+                # PV not in section database: send it by name
+                if self._put_in_driver_queue(('s', (pv_name, value))):
+                    del pvs[pv_name]
+            else:
+                indices.append(idx)
+                values.append(value)
+                indices_names.append(pv_name)
+        if indices and self._put_in_driver_queue(
+                ('b', (self.prefix, _np.array(indices, dtype=_np.int32),
+                       values))):
+            for pv_name in indices_names:
+                del pvs[pv_name]
+        if pvs:
+            # driver queue full: values are coalesced with the ones of next
+            # cycle
+            pvs.update(self._pvs_to_send)
+            self._pvs_to_send = pvs
+
     def close_others_queues(self):
         for q in self._others_queue.values():
             q.close()
 
     def empty_my_queue(self):
+        self._pending_requests.clear()
         while not self._my_queue.empty():
             self._my_queue.get()
 
@@ -147,7 +379,9 @@ class AreaStructure:
     def _send_parameters_to_other_area_structure(self, prefix, _dict):
         if prefix in self._others_queue:
             # print('{} sending to {}: '.format(self.prefix, prefix), _dict)
-            self._others_queue[prefix].put(('p', _dict))
+            # parameters not sent yet are superseded, cycles are not
+            key = None if 'injection_cycle' in _dict else tuple(sorted(_dict))
+            self._send_message(prefix, ('p', _dict), key=key)
 
     def _get_parameters_from_other_area_structure(self, _dict):
         # print('{} receiving: '.format(self.prefix), _dict)
@@ -172,8 +406,38 @@ class AreaStructure:
         for pv in self.pv_module.get_read_write_pvs() + self.pv_module.get_constant_pvs():
             value = self._get_pv(pv)
             sp_pv_list.append((pv, value))
-        self._others_queue['driver'].put(('sp', sp_pv_list))
+        self._send_message('driver', ('sp', sp_pv_list))
+        self._mark_startup('pvs')
 
     def _send_initialisation_sign(self):
         self.process()
-        self._others_queue['driver'].put(('i', self.prefix))
+        self._send_message('driver', ('i', self.prefix))
+        self._mark_startup('pvs_sent')
+        # sign is sent again when models are reinitialised
+        if self._timeline is not None:
+            self._timeline.save()
+            self._timeline = None
+
+    def _mark_startup(self, phase):
+        """Mark end of startup phase, ignored once initialised."""
+        if self._timeline is not None:
+            self._timeline.mark(phase)
+
+
+def _value_changed(old_value, new_value, tolerance=0.0):
+    """Check whether a PV value differs from the previous one.
+
+    Numeric values (scalars or arrays) are compared within the absolute
+    tolerance; any other type is compared for equality.
+    """
+    if isinstance(new_value, (str, bytes)) or \
+            isinstance(old_value, (str, bytes)):
+        return old_value != new_value
+    try:
+        old_value, new_value = _np.asarray(old_value), _np.asarray(new_value)
+        if old_value.shape != new_value.shape:
+            return True
+        return not _np.allclose(
+            old_value, new_value, rtol=0.0, atol=tolerance, equal_nan=True)
+    except (TypeError, ValueError):
+        return True
@@ -0,0 +1,140 @@
+"""Module with local cache of excitation and pulse curve data.
+
+Curve files are read from the web server once per host and revalidated
+when their cache entry is older than REVALIDATE_INTERVAL. Each file is
+parsed and saved as a .npz file named after the hash of its contents, and
+an entry file per curve maps its name to the content hash and to the time
+it was last read. Parsed data are also kept in memory, so that magnets
+sharing a curve do not load it again.
+"""
+
+import os as _os
+import json as _json
+import time as _time
+import hashlib as _hashlib
+import threading as _threading
+import numpy as _np
+from siriuspy.clientweb import magnets_excitation_data_read
+
+from va import utils
+
+
+CURVES_DIR = 'curves'  # subdirectory of local cache
+OFFLINE = _os.environ.get('VACA_OFFLINE', '0') not in ('', '0')
+REFRESH = False  # read files from web server even if cached
+REVALIDATE_INTERVAL = 24*3600  # [s] age of cached curves read again, online
+
+_ENTRIES_DIR = 'entries'  # subdirectory with an entry file per curve
+_memo = dict()
+_lock = _threading.Lock()
+
+
+def get_curve(name, parser):
+    """Return parsed data of a curve file.
+
+    Keyword arguments:
+    name -- file name, as passed to magnets_excitation_data_read
+    parser -- function converting file text to dict of numpy arrays
+
+    Raises FileNotFoundError in offline mode if file is not cached. Stale
+    cached data are used if the web server cannot be reached.
+    """
+    with _lock:
+        data = _memo.get(name)
+    if data is not None:
+        return data
+    entry = None if REFRESH else _read_entry(name)
+    data = None if entry is None else _load(entry['digest'])
+    if data is None or (not OFFLINE and _is_stale(entry)):
+        data = _read_from_server(name, parser, entry, data)
+    with _lock:
+        _memo[name] = data
+    return data
+
+
+def _read_from_server(name, parser, entry, data):
+    """Read file, parsing it again only if its contents changed."""
+    if OFFLINE:
+        raise FileNotFoundError(
+            '{} not in local cache (offline mode)'.format(name))
+    try:
+        text = magnets_excitation_data_read(name)
+    except OSError as err:
+        if data is None:
+            raise
+        utils.log('cache', 'unable to revalidate {} ({})'.format(name, err),
+                  'yellow')
+        return data
+    digest = _hashlib.sha1(text.encode()).hexdigest()
+    if data is None or digest != entry['digest']:
+        data = parser(text)
+        _save(name, digest, data)
+    else:
+        _save_entry(name, digest)
+    return data
+
+
+def _get_dir(*subdirs):
+    return utils.get_cache_dir(CURVES_DIR, *subdirs)
+
+
+def _get_entry_path(name):
+    digest = _hashlib.sha1(name.encode()).hexdigest()
+    return _os.path.join(_get_dir(_ENTRIES_DIR), digest + '.json')
+
+
+def _get_tmp_path(path):
+    # files are written by several processes and threads
+    return '{}.{}-{}.tmp'.format(
+        path, _os.getpid(), _threading.get_ident())
+
+
+def _is_stale(entry):
+    return _time.time() - entry.get('time', 0.0) > REVALIDATE_INTERVAL
+
+
+def _read_entry(name):
+    try:
+        with open(_get_entry_path(name), 'r') as f:
+            entry = _json.load(f)
+    except (OSError, ValueError):
+        return None
+    return entry if entry.get('name') == name else None
+
+
+def _load(digest):
+    try:
+        with _np.load(_os.path.join(_get_dir(), digest + '.npz')) as npz:
+            return {key: npz[key][()] if npz[key].ndim == 0 else npz[key]
+                    for key in npz.files}
+    except (OSError, ValueError):
+        return None
+
+
+def _save(name, digest, data):
+    path = _os.path.join(_get_dir(), digest + '.npz')
+    try:
+        tmp_path = _get_tmp_path(path)
+        with open(tmp_path, 'wb') as f:
+            _np.savez(f, **data)
+        _os.replace(tmp_path, path)
+    except OSError as err:
+        utils.log('cache', 'unable to cache {} ({})'.format(name, err),
+                  'yellow')
+        return
+    _save_entry(name, digest)
+
+
+def _save_entry(name, digest):
+    # each curve has its own entry file, replaced atomically, so that
+    # processes saving different curves do not overwrite each other
+    path = _get_entry_path(name)
+    try:
+        tmp_path = _get_tmp_path(path)
+        with open(tmp_path, 'w') as f:
+            _json.dump({'name': name, 'digest': digest, 'time': _time.time()},
+                       f, indent=1, sort_keys=True)
+        _os.replace(tmp_path, path)
+    except OSError as err:
+        utils.log('cache', 'unable to cache {} ({})'.format(name, err),
+                  'yellow')
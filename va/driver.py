@@ -1,14 +1,34 @@
 """Module with Virtual Accelerator driver."""
 
+import os
+import time
 import queue
 import threading
 import multiprocessing
 import numpy as _np
+import pcaspy as _pcaspy
 from pcaspy import Driver
 from va import utils
 
 
 PREFIX_LEN = utils.PREFIX_LEN
+WATCH_UPDATE_INTERVAL = 1.0  # [s] interval between watched PVs updates
+WATCH_READ_TIMEOUT = 10.0  # [s] time a client read keeps a PV watched
+WATCH_PCASPY_VERSIONS = ((0, 7), (0, 8))  # pcaspy versions tracking monitors
+QUEUE_MAX_SIZE = 1000  # maximum number of messages in driver queue
+OVERLOAD_FRACTION = 0.8  # driver queue usage fraction signaling overload
+UNMERGED_WRITES = ('-Cmd', ':BeamCurrentAdd-SP')  # PVs with additive writes
+DROPPED_WRITES_PV = 'AS-Glob:VA-Control:DroppedWrites-Mon'
+OVERLOAD_PV = 'AS-Glob:VA-Control:Overload-Mon'
+
+# monitors are found in pcaspy internals, known only for some versions; with
+# other versions all PVs are evaluated in every cycle
+_pcas_manager = None
+if tuple(getattr(_pcaspy, 'version_info', ())[:2]) in WATCH_PCASPY_VERSIONS:
+    try:
+        from pcaspy.driver import manager as _pcas_manager
+    except ImportError:
+        pass
 
 
 class DriverThread(threading.Thread):
@@ -24,7 +44,7 @@ class DriverThread(threading.Thread):
         stop_event -- event to stop processing
         finalisation -- barrier to wait before finalisation
         """
-        self.my_queue = multiprocessing.Queue()
+        self.my_queue = multiprocessing.Queue(QUEUE_MAX_SIZE)
         self._interval = interval
         self._stop_event = stop_event
         self._finalisation = finalisation
@@ -44,8 +64,9 @@ class DriverThread(threading.Thread):
         # prctl.set_name(self.name) # For debug
         try:
             while not self._stop_event.is_set():
-                utils.process_and_wait_interval(self._driver.process,
-                                                self._interval)
+                utils.process_and_wait_events(self._driver.process,
+                                              self._interval,
+                                              self._driver.waitables)
         except Exception as ex:
             utils.log('error', 'in driver main: ' + str(ex), 'red')
             self.stop_event.set()
@@ -68,39 +89,142 @@ class PCASDriver(Driver):
         self._start_event = start_event
         self._internal_queue = queue.Queue()
         self.my_queue = my_queue
+        # pipe used to wake up driver thread on client writes
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
         self._stop_event = stop_event
         self._processes = dict()
         self._processes_database = dict()
+        self._processes_pv_names = dict()
         self._processes_initialisation = dict()
+        self._processes_evaluated_pvs = dict()
         for p in processes:
             prefix = p.area_structure_prefix
             self._processes[prefix] = p
             self._processes_initialisation[prefix] = False
             self._processes_database[prefix] = \
                 p.area_structure_cls.pv_module.get_database()
+            self._processes_pv_names[prefix] = utils.get_pv_names_table(
+                p.area_structure_cls.database)
+            pv_module = p.area_structure_cls.pv_module
+            self._processes_evaluated_pvs[prefix] = frozenset(
+                pv_module.get_dynamical_pvs() + pv_module.get_read_only_pvs())
+        self._pvs_read = dict()  # time of last client read, by PV name
+        self._processes_watched_pvs = dict()
+        self._evaluations = set()  # PVs read by clients being evaluated
+        self._evaluations_lock = threading.Lock()
+        self._watch_update_time = 0.0
+        self._pending_writes = dict()  # writes not forwarded yet, by PV
+        self._writes_count = 0
+        self._dropped_writes = 0  # writes superseded by newer ones
+        self._overload = False
+        self._stats = utils.PerformanceCounters()
+        self._stats_names = set(utils.get_stats_names())
+
+    @property
+    def waitables(self):
+        """Objects that become readable when there is work to be done."""
+        return [utils.get_queue_waitable(self.my_queue), self._wakeup_r]
 
     def process(self):
         """Function that run continuously."""
+        t0 = time.time()
         statusw = self._process_writes() > 0
         statusr = self._process_requests() > 0
+        statuss = self._process_shared_arrays() > 0
         statusf = self._process_fluctuations() > 0
-        if statusw or statusr or statusf:
+        if statusw or statusr or statuss or statusf:
             self.updatePVs()  # NOTE: should we update all PVs?
+        self._update_watched_pvs()
+        self._stats.add_time('Cycle', time.time() - t0)
+        if self._stats.is_due():
+            self._set_stats_in_memory(
+                (utils.STATS_DRIVER_PREFIX, self._stats.get_summary()))
 
     def _process_writes(self):
+        try:
+            while os.read(self._wakeup_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
         size = self._internal_queue.qsize()
+        # last write wins: only the latest value of each PV is forwarded
+        dropped = 0
         for _ in range(size):
             process, reason, value = self._internal_queue.get()
-            process.my_queue.put(('s', (reason, value)))
-        return size
+            self._writes_count += 1
+            if reason.endswith(UNMERGED_WRITES):
+                key = (reason, self._writes_count)
+            else:
+                key = reason
+            if key in self._pending_writes:
+                dropped += 1  # value replaced in position of first write
+            self._pending_writes[key] = (process, reason, value)
+        if dropped:
+            self._dropped_writes += dropped
+            super().setParam(DROPPED_WRITES_PV, self._dropped_writes)
+        return size + self._forward_pending_writes()
+
+    def _forward_pending_writes(self):
+        """Forward writes to area structures whose queues are not full.
+
+        Writes to area structures lagging behind are held back, to be
+        coalesced with newer writes to the same PVs.
+        """
+        if not self._pending_writes:
+            return 0
+        full = set()
+        forwarded = 0
+        for key, (process, reason, value) in \
+                list(self._pending_writes.items()):
+            prefix = process.area_structure_prefix
+            if prefix in full:
+                continue  # keep order of writes to each area structure
+            try:
+                process.my_queue.put_nowait(('s', (reason, value)))
+            except queue.Full:
+                full.add(prefix)
+                continue
+            forwarded += 1
+            del self._pending_writes[key]
+        return forwarded
+
+    def _update_overload(self, queue_size):
+        overload = bool(self._pending_writes) or \
+            queue_size >= OVERLOAD_FRACTION*QUEUE_MAX_SIZE
+        if overload == self._overload:
+            return
+        self._overload = overload
+        if overload:
+            utils.log('!load', 'virtual accelerator overloaded', c='red')
+        else:
+            utils.log('load', 'virtual accelerator load back to normal')
+        super().setParam(OVERLOAD_PV, int(overload))
 
     def _process_requests(self):
         size = self.my_queue.qsize()
+        self._update_overload(size)
+        self._stats.set_gauge('QueueSize', size)
+        self._stats.add_count('Msg', size)
         for _ in range(size):
             request = self.my_queue.get()
             self._process_request(request)
         return size
 
+    def _process_shared_arrays(self):
+        size = 0
+        for process in self._processes.values():
+            if process.shared_arrays is None:
+                continue
+            values = process.shared_arrays.read()
+            size += len(values)
+            pvs_fluctuation = process.area_structure_cls.pvs_fluctuation
+            for pv_name, value in values.items():
+                value = pvs_fluctuation.set_pv(pv_name, value)
+                self.setParam(pv_name, value)
+        return size
+
     def _process_fluctuations(self):
         size = 0
         for section in self._processes_database:
@@ -112,10 +236,67 @@ class PCASDriver(Driver):
                     self.setParam(pvname, value)
         return size
 
+    def _update_watched_pvs(self):
+        """Tell area structures which PVs are watched by clients.
+
+        PVs are watched while they have active monitors or were read
+        recently. Area structures evaluate only watched dynamical PVs.
+        """
+        now = time.time()
+        if now - self._watch_update_time < WATCH_UPDATE_INTERVAL:
+            return
+        self._watch_update_time = now
+        monitored_pvs = self._get_monitored_pvs()
+        if monitored_pvs is None:
+            # monitors cannot be tracked: area structures evaluate all PVs
+            return
+        pvs_read = dict(self._pvs_read)
+        for pv_name, read_time in pvs_read.items():
+            if now - read_time > WATCH_READ_TIMEOUT:
+                # PV remains watched if it has monitors
+                self._pvs_read.pop(pv_name, None)
+            else:
+                monitored_pvs.add(pv_name)
+        watched_pvs = {prefix: set() for prefix in self._processes}
+        for pv_name in monitored_pvs:
+            try:
+                process = self._get_pv_process(pv_name)
+            except KeyError:
+                continue
+            watched_pvs[process.area_structure_prefix].add(pv_name)
+        for prefix, pvs in watched_pvs.items():
+            pvs = frozenset(pvs)
+            if pvs != self._processes_watched_pvs.get(prefix):
+                try:
+                    self._processes[prefix].my_queue.put_nowait(('w', pvs))
+                except queue.Full:
+                    # sent again in next update, with latest watched PVs
+                    continue
+                self._processes_watched_pvs[prefix] = pvs
+
+    @staticmethod
+    def _get_monitored_pvs():
+        if _pcas_manager is None:
+            return None
+        monitored_pvs, supported = set(), False
+        for pvs in _pcas_manager.pvs.values():
+            for reason, pv in pvs.items():
+                interest = getattr(pv, 'interest', None)
+                if interest is None:
+                    continue
+                supported = True
+                if interest:
+                    monitored_pvs.add(reason)
+        return monitored_pvs if supported else None
+
     def _process_request(self, request):
         cmd, data = request
-        if cmd == 's':  # set PV value in EPICS memory DB
+        if cmd == 'b':  # set bulk of PV values in EPICS memory DB
+            self._set_parameters_in_memory(data)
+        elif cmd == 's':  # set PV value in EPICS memory DB
             self._set_parameter_in_memory(data)
+        elif cmd == 'u':  # shared memory updated, read in every cycle
+            pass
         elif cmd == 'sp':  # initialise setpoints
             self._set_sp_parameters_in_memory(data)
         elif cmd == 'a':  # anomalous condition signed by area_structure
@@ -123,9 +304,21 @@ class PCASDriver(Driver):
             self._stop_event.set()
         elif cmd == 'i':  # initialisation signaling
             self._initialisation_sign_received(data)
+        elif cmd == 't':  # performance statistics
+            self._set_stats_in_memory(data)
+        elif cmd == 'e':  # PVs evaluated for client reads
+            self._evaluation_received(data)
         else:
             utils.log('!cmd', cmd, c='red', a=['bold'])
 
+    def _evaluation_received(self, data):
+        _, pv_names = data
+        # values of evaluated PVs may have been written to shared memory;
+        # they are published with the other updates of this cycle
+        self._process_shared_arrays()
+        with self._evaluations_lock:
+            self._evaluations.difference_update(pv_names)
+
     def _set_parameter_in_memory(self, data):
         pv_name, value = data
         try:
@@ -135,6 +328,30 @@ class PCASDriver(Driver):
         except:
             print('error in set_parameter_in_memory: ', pv_name, value)
 
+    def _set_parameters_in_memory(self, data):
+        prefix, indices, values = data
+        pv_names = self._processes_pv_names[prefix]
+        for idx, value in zip(indices, values):
+            pv_name = pv_names[idx]
+            try:
+                process = self._get_pv_process(pv_name)
+                value = process.area_structure_cls.pvs_fluctuation.set_pv(
+                    pv_name, value)
+                self.setParam(pv_name, value)
+            except:
+                print('error in set_parameters_in_memory: ', pv_name, value)
+
+    def _set_stats_in_memory(self, data):
+        prefix, stats = data
+        for name, value in stats.items():
+            if name in self._stats_names:
+                super().setParam(utils.get_stats_pv_name(prefix, name), value)
+
+    def setParam(self, reason, value):
+        """Set PV value in EPICS memory DB."""
+        self._stats.add_count('SetParam')
+        super().setParam(reason, value)
+
     def _set_sp_parameters_in_memory(self, data):
         sp_pv_list = data
         for pv_name, value in sp_pv_list:
@@ -173,13 +390,50 @@ class PCASDriver(Driver):
         """Finalise properly."""
         self.my_queue.close()
         self.my_queue.join_thread()
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
         utils.log('exit', 'driver ')
 
     def read(self, reason):
-        """Read PV value from database."""
+        """Read PV value from database.
+
+        Last value is returned right away. PVs no client is watching are
+        evaluated in background, and their values posted when ready.
+        """
         utils.log('read', reason, c='yellow')
+        if reason not in self._pvs_read:
+            # start evaluating PV in its area structure right away
+            self._watch_update_time = 0.0
+            self._wake_up()
+        self._pvs_read[reason] = time.time()
+        self._request_evaluation(reason)
         return super().read(reason)
 
+    def _request_evaluation(self, reason):
+        """Ask area structure to evaluate PV no client is watching.
+
+        PVs watched by clients are evaluated in every cycle. A PV is not
+        requested again while its evaluation is pending.
+        """
+        try:
+            process = self._get_pv_process(reason)
+        except KeyError:
+            return
+        prefix = process.area_structure_prefix
+        watched_pvs = self._processes_watched_pvs.get(prefix)
+        if watched_pvs is None or reason in watched_pvs or \
+                reason not in self._processes_evaluated_pvs[prefix]:
+            return
+        with self._evaluations_lock:
+            if reason in self._evaluations:
+                return
+            self._evaluations.add(reason)
+        try:
+            process.my_queue.put_nowait(('r', {reason}))
+        except queue.Full:
+            with self._evaluations_lock:
+                self._evaluations.discard(reason)
+
     def write(self, reason, value):
         """Write PV value to database."""
         # process VACA pvs first
@@ -190,6 +444,7 @@ class PCASDriver(Driver):
             if self._isValid(process, reason, value):
                 self.setParam(reason, value)
                 self._internal_queue.put((process, reason, value))
+                self._wake_up()
                 if type(value) in (list, tuple,
                                    _np.ndarray) and len(value) > 10:
                     msg = reason + ' (' + str(len(value)) + ') ' \
@@ -207,6 +462,12 @@ class PCASDriver(Driver):
             utils.log('!write', reason, c='red', a=['bold'])
             return False
 
+    def _wake_up(self):
+        try:
+            os.write(self._wakeup_w, b'\0')
+        except BlockingIOError:
+            pass  # pipe full: driver is already due to wake up
+
     def _write_vaca_pvs(self, reason, value):
         if reason == 'AS-Glob:VA-Control:Quit-Cmd':
             utils.log('quit', 'quitting virtual machine', c='red', a=['bold'])
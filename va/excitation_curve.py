@@ -1,8 +1,9 @@
 
 import numpy as _numpy
-from siriuspy.clientweb import magnets_excitation_data_read
 import os as _os
 
+from va import curves_cache as _curves_cache
+
 
 class ExcitationCurve:
 
@@ -14,12 +15,11 @@ class ExcitationCurve:
         """
         self._filename = fname
         try:
-            text = magnets_excitation_data_read(fname)
+            data = _curves_cache.get_curve(fname, _parse_excitation_curve)
         except:
             print('Error trying to read excdata {}'.format(fname))
             raise
-        lines = text.split('\n')
-        self._load_excitation_curve(lines, polarity)
+        self._load_excitation_curve(data, polarity)
 
 
     @property
@@ -88,31 +88,15 @@ class ExcitationCurve:
     def _interpolate_main_field(self, field, field_array, current_array):
         return _numpy.interp(field, field_array, current_array)
 
-    def _load_excitation_curve(self, lines, polarity):
-
-        # first parse the header to get the main harmonics and the harmonics:
-        for line in lines:
-            if not line.strip().startswith('#'):
-                continue
-            words = line[1:].strip().lower().split()
-            if 'main_harmonic' in words:
-                self._main_harmonic = int(words[1])
-                if len(words) <= 2:
-                    self._curve_type = 'normal' # default
-                elif words[2] in ('normal', 'skew'):
-                    self._curve_type = words[2]
-                else:
-                    raise ValueError("invalid curve type: '" + words[2] + "'")
-            elif 'harmonics' in words:
-                self._harmonics = [int(n) for n in words[1:]]
-                self._highest_harmonic = max(self._harmonics)
-
-        if not hasattr(self, '_main_harmonic'): raise AttributeError('missing main_harmonic')
-        if not hasattr(self, '_harmonics'):     raise AttributeError('missing harmonics')
+    def _load_excitation_curve(self, data, polarity):
+        self._main_harmonic = int(data['main_harmonic'])
+        self._curve_type = str(data['curve_type'])
+        self._harmonics = [int(n) for n in data['harmonics']]
+        self._highest_harmonic = max(self._harmonics)
         self._main_harmonic_index = self._harmonics.index(self._main_harmonic)
 
         # Now load the curve
-        data = _numpy.loadtxt(lines)
+        data = data['data']
         current = data[:, 0] # current
         fields = polarity*data[:, 1:] # integrated fields (normal and skew)
 
@@ -168,3 +152,35 @@ class ExcitationCurve:
     def _reverse(self, *args):
         result = [arg[::-1] for arg in args]
         return tuple(result)
+
+
+def _parse_excitation_curve(text):
+    """Parse excitation curve file into header values and data table."""
+    lines = text.split('\n')
+    main_harmonic, curve_type, harmonics = None, 'normal', None
+
+    # first parse the header to get the main harmonics and the harmonics:
+    for line in lines:
+        if not line.strip().startswith('#'):
+            continue
+        words = line[1:].strip().lower().split()
+        if 'main_harmonic' in words:
+            main_harmonic = int(words[1])
+            if len(words) <= 2:
+                curve_type = 'normal' # default
+            elif words[2] in ('normal', 'skew'):
+                curve_type = words[2]
+            else:
+                raise ValueError("invalid curve type: '" + words[2] + "'")
+        elif 'harmonics' in words:
+            harmonics = [int(n) for n in words[1:]]
+
+    if main_harmonic is None: raise AttributeError('missing main_harmonic')
+    if harmonics is None:     raise AttributeError('missing harmonics')
+
+    return {
+        'main_harmonic': main_harmonic,
+        'curve_type': curve_type,
+        'harmonics': _numpy.array(harmonics),
+        'data': _numpy.loadtxt(lines),
+        }
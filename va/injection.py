@@ -1,8 +1,30 @@
 
+import os as _os
 import math as _math
+import tempfile as _tempfile
+import itertools as _itertools
+import threading as _threading
+import multiprocessing as _multiprocessing
+from concurrent import futures as _futures
 import numpy as _np
 import pyaccel as _pyaccel
 
+from va import utils
+
+
+NR_ENERGY_OFFSETS = 21  # energy offsets tracked in ring loss fraction
+TRANSVERSE_SAMPLES = 0  # random betatron samples per energy offset (0: none)
+MC_PROCESSES = 4  # worker processes tracking Monte Carlo particles
+MC_BATCH_SIZE = 250  # particles tracked by each worker in each round
+MC_MIN_PARTICLES = 1000  # particles tracked before error is checked
+MC_MAX_PARTICLES = 20000  # particles tracked when error target is not met
+MC_TARGET_ERROR = 0.005  # statistical error of loss fraction to stop sampling
+MC_LATTICES_DIR = 'monte_carlo'  # subdirectory of local cache for workers
+
+_LATTICE_FLAGS = (
+    'energy', 'harmonic_number', 'cavity_on', 'radiation_on', 'vchamber_on')
+_mc_lattice = None  # lattice file and accelerator last loaded by worker
+
 
 def calc_charge_loss_fraction_in_line(accmodel, **kwargs):
     """Calculate charge loss in a line
@@ -18,10 +40,15 @@ def calc_charge_loss_fraction_in_line(accmodel, **kwargs):
     hmin              -- [m]
     vmax              -- [m]
     vmin              -- [m]
+    transfer_maps     -- TransferMaps of accelerator, for incremental optics
+    monte_carlo       -- function to which a refined estimate of losses by
+                         tracking a random beam is submitted (see
+                         MonteCarloEstimator.submit, without key)
     """
     accelerator, init_twiss, energy_spread, emittance, hmax, hmin, vmax, vmin = \
         _process_loss_fraction_args(accmodel, **kwargs)
     coupling = kwargs['global_coupling']
+    transfer_maps = kwargs.get('transfer_maps')
 
     if len(accelerator) == 0:
         accmodel.log('calc', '{}: charge_loss_fraction_in_line - accelerator length null!'.format(accmodel.prefix), c='red')
@@ -29,8 +56,13 @@ def calc_charge_loss_fraction_in_line(accmodel, **kwargs):
         return (loss_fraction, _pyaccel.optics.TwissArray(init_twiss), None)
 
     try:
-        twiss, m66 = _pyaccel.optics.calc_twiss(
-            accelerator, init_twiss=init_twiss, indices='open')
+        twiss = None
+        if transfer_maps is not None and \
+                transfer_maps.accelerator is accelerator:
+            twiss, m66 = _calc_line_twiss(accmodel, transfer_maps, init_twiss)
+        if twiss is None:
+            twiss, m66 = _pyaccel.optics.calc_twiss(
+                accelerator, init_twiss=init_twiss, indices='open')
         betax, etax = twiss.betax, twiss.etax
         betay, etay = twiss.betay, twiss.etay
         if _np.isnan(betax[-1]):
@@ -44,6 +76,11 @@ def calc_charge_loss_fraction_in_line(accmodel, **kwargs):
         loss_fraction = 1.0
         return (loss_fraction, None, None)
 
+    monte_carlo = kwargs.get('monte_carlo')
+    if monte_carlo is not None:
+        monte_carlo(accelerator, init_twiss, 'open', energy_spread,
+                    emittance, coupling, hmax, hmin, vmax, vmin)
+
     emitx = emittance * 1 / (1 + coupling)
     emity = emittance * coupling / (1 + coupling)
     sigmax = _np.sqrt(betax * emitx + (etax * energy_spread)**2)
@@ -94,10 +131,20 @@ def calc_charge_loss_fraction_in_ring(accmodel, **kwargs):
     hmin              -- [m]
     vmax              -- [m]
     vmin              -- [m]
+    transverse_samples -- random betatron samples per energy offset; if
+                         zero, losses are estimated from apertures along
+                         the orbit of each energy offset
+    cancel            -- function checked before and after tracking; if it
+                         returns True, calculation is abandoned and None
+                         is returned
+    monte_carlo       -- function to which a refined estimate of losses by
+                         tracking a random beam is submitted (see
+                         MonteCarloEstimator.submit, without key)
     """
     accelerator, init_twiss, energy_spread, emittance, hmax, hmin, vmax, vmin = \
         _process_loss_fraction_args(accmodel, **kwargs)
     init_pos = init_twiss.co
+    cancel = kwargs.get('cancel')
 
     if len(hmax) == len(accelerator):
         indices = 'open'
@@ -124,53 +171,242 @@ def calc_charge_loss_fraction_in_ring(accmodel, **kwargs):
         loss_fraction = 1.0
         return loss_fraction
 
-    de = _np.linspace(-(3*energy_spread), (3*energy_spread), 21)
-    de_probability = _np.zeros(len(de))
-    lost_fraction = _np.zeros(len(de))
-    total_lost_fraction = 0
-
-    for i in range(len(de)):
-        de_probability[i] = _np.exp(-(de[i]**2)/(2*(energy_spread**2)))/(_np.sqrt(2*_np.pi)*energy_spread)
-        pos = [p for p in init_pos]
-        pos[4] += de[i]
-        orbit, *_ = _pyaccel.tracking.linepass(accelerator, pos, indices='open')
-        if indices == 'closed':
-            orb, *_ = _pyaccel.tracking.linepass(
-                accelerator[-1:], particles=orbit[:, -1])
-            orbit = _np.append(orbit, orb.transpose(), axis=1)
-
-        if _np.isnan(orbit[0, -1]):
-            lost_fraction[i] = 1.0
-            total_lost_fraction += de_probability[i]*lost_fraction[i]
-            continue
-
-        rx, ry = orbit[[0, 2], :]
-        xlim_inf, xlim_sup = rx - hmin, hmax - rx
-        ylim_inf, ylim_sup = ry - vmin, vmax - ry
-        xlim_inf[xlim_inf < 0] = 0
-        xlim_sup[xlim_sup < 0] = 0
-        ylim_inf[ylim_inf < 0] = 0
-        ylim_sup[ylim_sup < 0] = 0
-        emit_x_inf = (xlim_inf**2 - (etax*energy_spread)**2)/betax
-        emit_x_sup = (xlim_sup**2 - (etax*energy_spread)**2)/betax
-        emit_y_inf = (ylim_inf**2 - (etay*energy_spread)**2)/betay
-        emit_y_sup = (ylim_sup**2 - (etay*energy_spread)**2)/betay
-        emit_x_inf[emit_x_inf < 0] = 0.0
-        emit_x_sup[emit_x_sup < 0] = 0.0
-        emit_y_inf[emit_y_inf < 0] = 0.0
-        emit_y_sup[emit_y_sup < 0] = 0.0
-        min_emit_x = _np.amin([emit_x_inf, emit_x_sup])
-        min_emit_y = _np.amin([emit_y_inf, emit_y_sup])
-        min_emit = min_emit_x+min_emit_y if min_emit_x*min_emit_y !=0 else 0.0
-        lf = _np.exp(-min_emit/emittance)
-        lost_fraction[i] = lf if lf < 1 else 1.0
-        total_lost_fraction += de_probability[i]*lost_fraction[i]
+    if cancel is not None and cancel():
+        return None
+
+    monte_carlo = kwargs.get('monte_carlo')
+    if monte_carlo is not None:
+        monte_carlo(accelerator, init_twiss, indices, energy_spread,
+                    emittance, kwargs.get('global_coupling', 0.0),
+                    hmax, hmin, vmax, vmin)
+
+    # all energy offsets (and transverse samples) are tracked at once
+    de = _np.linspace(-(3*energy_spread), (3*energy_spread), NR_ENERGY_OFFSETS)
+    de_probability = _np.exp(-(de**2)/(2*(energy_spread**2)))/(_np.sqrt(2*_np.pi)*energy_spread)
+    nr_samples = kwargs.get('transverse_samples', TRANSVERSE_SAMPLES)
+    particles = _np.tile(_np.asarray(init_pos, dtype=float)[:, None], (1, len(de)))
+    particles[4, :] += de
+    if nr_samples:
+        coupling = kwargs.get('global_coupling', 0.0)
+        particles = _add_transverse_samples(
+            particles, init_twiss, emittance, coupling, nr_samples)
+    orbits, *_ = _pyaccel.tracking.linepass(
+        accelerator, particles, indices=indices)
+    orbits = _np.reshape(orbits, (6, particles.shape[1], -1))
+
+    if cancel is not None and cancel():
+        return None
+
+    rx, ry = orbits[0], orbits[2]
+    with _np.errstate(invalid='ignore'):
+        if nr_samples:
+            # fraction of samples lost at each energy offset
+            lost = _np.isnan(orbits[0, :, -1])
+            lost |= _np.any((rx < hmin) | (rx > hmax), axis=1)
+            lost |= _np.any((ry < vmin) | (ry > vmax), axis=1)
+            lost_fraction = _np.mean(
+                _np.reshape(lost, (nr_samples, len(de))), axis=0)
+        else:
+            lost_fraction = _calc_lost_fraction_from_apertures(
+                rx, ry, hmax, hmin, vmax, vmin, betax, betay, etax, etay,
+                energy_spread, emittance)
+            lost_fraction[_np.isnan(orbits[0, :, -1])] = 1.0
 
+    total_lost_fraction = _np.sum(de_probability*lost_fraction)
     total_lost_fraction = total_lost_fraction/_np.sum(de_probability)
     loss_fraction = total_lost_fraction if total_lost_fraction < 1.0 else 1.0
     return loss_fraction
 
 
+def _calc_lost_fraction_from_apertures(
+        rx, ry, hmax, hmin, vmax, vmin, betax, betay, etax, etay,
+        energy_spread, emittance):
+    """Return loss fraction of each orbit (rows) given apertures along it."""
+    xlim_inf = _np.maximum(rx - hmin, 0)
+    xlim_sup = _np.maximum(hmax - rx, 0)
+    ylim_inf = _np.maximum(ry - vmin, 0)
+    ylim_sup = _np.maximum(vmax - ry, 0)
+    emit_x_inf = _np.maximum((xlim_inf**2 - (etax*energy_spread)**2)/betax, 0)
+    emit_x_sup = _np.maximum((xlim_sup**2 - (etax*energy_spread)**2)/betax, 0)
+    emit_y_inf = _np.maximum((ylim_inf**2 - (etay*energy_spread)**2)/betay, 0)
+    emit_y_sup = _np.maximum((ylim_sup**2 - (etay*energy_spread)**2)/betay, 0)
+    min_emit_x = _np.minimum(emit_x_inf.min(axis=1), emit_x_sup.min(axis=1))
+    min_emit_y = _np.minimum(emit_y_inf.min(axis=1), emit_y_sup.min(axis=1))
+    min_emit = _np.where(
+        min_emit_x*min_emit_y != 0, min_emit_x + min_emit_y, 0.0)
+    return _np.minimum(_np.exp(-min_emit/emittance), 1.0)
+
+
+def _add_transverse_samples(particles, init_twiss, emittance, coupling,
+                            nr_samples):
+    """Replicate particles with random betatron coordinates.
+
+    Columns of the result are grouped by sample: column k*n + j is sample
+    k of particle j, n being the number of particles.
+    """
+    nr_particles = particles.shape[1]
+    samples = _np.tile(particles, (1, nr_samples))
+    emitx = emittance / (1 + coupling)
+    emity = emittance * coupling / (1 + coupling)
+    planes = (
+        (0, emitx, init_twiss.betax, init_twiss.alphax),
+        (2, emity, init_twiss.betay, init_twiss.alphay))
+    for idx, emit, beta, alpha in planes:
+        u, v = _np.random.randn(2, nr_particles*nr_samples)
+        samples[idx] += _np.sqrt(emit*beta)*u
+        samples[idx+1] += _np.sqrt(emit/beta)*(v - alpha*u)
+    return samples
+
+
+class MonteCarloEstimator:
+    """Estimator of loss fractions by tracking random beams in background.
+
+    Each calculation runs in a background thread, which distributes rounds
+    of MC_BATCH_SIZE particles to worker processes until the statistical
+    error of the loss fraction is below MC_TARGET_ERROR. Workers are
+    started once, by a fork server, so that they do not inherit threads of
+    the section process, and load the lattice of each calculation from a
+    flat file in the local cache.
+    """
+
+    def __init__(self, nr_processes=MC_PROCESSES):
+        self._nr_processes = nr_processes
+        self._pool = None
+        self._executor = None
+        self._calcs = dict()  # key -> (future, cancelled event)
+
+    def submit(self, key, accelerator, init_twiss, indices, energy_spread,
+               emittance, coupling, hmax, hmin, vmax, vmin):
+        """Start calculation, superseding the one with same key.
+
+        Future of calculation is returned by pop_done, with tuple of loss
+        fraction, its statistical error and number of tracked particles.
+        """
+        self.cancel(key)
+        if self._pool is None:
+            self._pool = _futures.ProcessPoolExecutor(
+                self._nr_processes,
+                mp_context=_multiprocessing.get_context('forkserver'))
+            self._executor = _futures.ThreadPoolExecutor(max_workers=1)
+        fd, path = _tempfile.mkstemp(
+            suffix='.txt', dir=utils.get_cache_dir(MC_LATTICES_DIR))
+        _os.close(fd)
+        _pyaccel.lattice.write_flat_file(accelerator, path)
+        flags = {name: getattr(accelerator, name) for name in _LATTICE_FLAGS}
+        apertures = tuple(
+            _np.array(a, dtype=float) for a in (hmax, hmin, vmax, vmin))
+        lattice = (path, flags, indices) + apertures
+        init_twiss = _pyaccel.optics.Twiss.make_new(init_twiss.make_dict())
+        cancelled = _threading.Event()
+        future = self._executor.submit(
+            self._calc_loss_fraction, lattice, init_twiss, energy_spread,
+            emittance, coupling, cancelled)
+        self._calcs[key] = (future, cancelled)
+
+    def pop_done(self):
+        """Return dictionary with futures of calculations that are done."""
+        done = {key: future for key, (future, _) in self._calcs.items()
+                if future.done()}
+        for key in done:
+            del self._calcs[key]
+        return done
+
+    def cancel(self, key=None):
+        """Abandon calculation with key, or all of them."""
+        keys = list(self._calcs) if key is None else [key]
+        for key in keys:
+            calc = self._calcs.pop(key, None)
+            if calc is not None:
+                calc[1].set()
+
+    def shutdown(self):
+        """Abandon calculations and stop worker processes."""
+        self.cancel()
+        if self._pool is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _calc_loss_fraction(self, lattice, init_twiss, energy_spread,
+                            emittance, coupling, cancelled):
+        nr_lost, nr_tracked = 0, 0
+        loss_fraction, error = 1.0, 0.0
+        try:
+            while nr_tracked < MC_MAX_PARTICLES:
+                if cancelled.is_set():
+                    return None
+                batches = [_generate_beam(
+                    init_twiss, energy_spread, emittance, coupling,
+                    MC_BATCH_SIZE) for _ in range(self._nr_processes)]
+                nr_lost += sum(self._pool.map(
+                    _count_lost_particles, _itertools.repeat(lattice),
+                    batches))
+                nr_tracked += MC_BATCH_SIZE*self._nr_processes
+                loss_fraction = nr_lost/nr_tracked
+                error = _math.sqrt(
+                    loss_fraction*(1 - loss_fraction)/nr_tracked)
+                if nr_tracked >= MC_MIN_PARTICLES and \
+                        error < MC_TARGET_ERROR:
+                    break
+        finally:
+            _os.remove(lattice[0])
+        return loss_fraction, error, nr_tracked
+
+
+def _generate_beam(init_twiss, energy_spread, emittance, coupling,
+                   nr_particles):
+    """Return gaussian beam (6xN array) matched to twiss parameters."""
+    particles = _np.tile(
+        _np.asarray(init_twiss.co, dtype=float)[:, None], (1, nr_particles))
+    delta = energy_spread*_np.random.randn(nr_particles)
+    particles[4] += delta
+    emitx = emittance / (1 + coupling)
+    emity = emittance * coupling / (1 + coupling)
+    planes = (
+        (0, emitx, init_twiss.betax, init_twiss.alphax,
+         init_twiss.etax, init_twiss.etapx),
+        (2, emity, init_twiss.betay, init_twiss.alphay,
+         init_twiss.etay, init_twiss.etapy))
+    for idx, emit, beta, alpha, eta, etap in planes:
+        u, v = _np.random.randn(2, nr_particles)
+        particles[idx] += _np.sqrt(emit*beta)*u + eta*delta
+        particles[idx+1] += _np.sqrt(emit/beta)*(v - alpha*u) + etap*delta
+    return particles
+
+
+def _count_lost_particles(lattice, particles):
+    """Track particles in a worker and return how many were lost."""
+    global _mc_lattice
+    path, flags, indices, hmax, hmin, vmax, vmin = lattice
+    if _mc_lattice is None or _mc_lattice[0] != path:
+        accelerator = _pyaccel.lattice.read_flat_file(path)
+        for name, value in flags.items():
+            setattr(accelerator, name, value)
+        _mc_lattice = (path, accelerator)
+    accelerator = _mc_lattice[1]
+    orbits, *_ = _pyaccel.tracking.linepass(
+        accelerator, particles, indices=indices)
+    orbits = _np.reshape(orbits, (6, particles.shape[1], -1))
+    rx, ry = orbits[0], orbits[2]
+    with _np.errstate(invalid='ignore'):
+        lost = _np.isnan(orbits[0, :, -1])
+        lost |= _np.any((rx < hmin) | (rx > hmax), axis=1)
+        lost |= _np.any((ry < vmin) | (ry > vmax), axis=1)
+    return int(_np.sum(lost))
+
+
+def _calc_line_twiss(accmodel, transfer_maps, init_twiss):
+    try:
+        orbit, *_ = _pyaccel.tracking.linepass(
+            transfer_maps.accelerator, init_twiss.co, indices='open')
+        return transfer_maps.calc_twiss(orbit, init_twiss=init_twiss)
+    except Exception as err:
+        accmodel.log('calc', '{}: incremental optics failed ({})'.format(
+            accmodel.prefix, str(err)), c='yellow')
+        transfer_maps.invalidate()
+        return None, None
+
+
 def _process_loss_fraction_args(accmodel, **kwargs):
     
     accelerator = kwargs.get('accelerator', accmodel.accelerator)
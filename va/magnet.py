@@ -16,6 +16,7 @@ class Magnet(object):
         using value converted with excitation curve.
         """
         self._power_supplies = set()
+        self._changed_callbacks = []
         self._accelerator = accelerator
         self._prev_brho = accelerator.brho
 
@@ -92,6 +93,14 @@ class Magnet(object):
     def add_power_supply(self, power_supply):
         self._power_supplies.add(power_supply)
 
+    def add_changed_callback(self, callback):
+        """Add function called with element indices when fields change."""
+        self._changed_callbacks.append(callback)
+
+    def _run_changed_callbacks(self):
+        for callback in self._changed_callbacks:
+            callback(self._indices)
+
     def process(self):
         """Change strengths of the magnet when the current is changed"""
         prev_current = self._current_mon
@@ -112,7 +121,8 @@ class Magnet(object):
         delta_normal_fields = numpy.array(new_normal_fields) - numpy.array(prev_normal_fields)
         delta_skew_fields   = numpy.array(new_skew_fields) - numpy.array(prev_skew_fields)
 
-        self.value = [delta_normal_fields, delta_skew_fields]
+        if numpy.any(delta_normal_fields) or numpy.any(delta_skew_fields):
+            self.value = [delta_normal_fields, delta_skew_fields]
 
     def renormalize_magnet(self):
         """Change strengths of the magnet when accelerator energy is changed"""
@@ -120,6 +130,7 @@ class Magnet(object):
             self._accelerator[i].polynom_b = self._accelerator[i].polynom_b*(self._prev_brho/self._accelerator.brho)
             self._accelerator[i].polynom_a = self._accelerator[i].polynom_a*(self._prev_brho/self._accelerator.brho)
         self._prev_brho = self._accelerator.brho
+        self._run_changed_callbacks()
 
     @property
     def value(self):
@@ -176,6 +187,7 @@ class Magnet(object):
 
             self._accelerator[idx].polynom_b += delta_polynom_b
             self._accelerator[idx].polynom_a += delta_polynom_a
+        self._run_changed_callbacks()
 
     def _fill_with_zeros(self, integrated_field):
         field = numpy.zeros(self._len_fields)
@@ -220,7 +232,8 @@ class BoosterDipoleMagnet(Magnet):
 
         # Don't change the main harmonic value of polynom_b
         delta_normal_fields[0] = 0.0
-        self.value = [delta_normal_fields, delta_skew_fields]
+        if numpy.any(delta_normal_fields) or numpy.any(delta_skew_fields):
+            self.value = [delta_normal_fields, delta_skew_fields]
         self._current_mon = current
 
 
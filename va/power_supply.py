@@ -1,4 +1,5 @@
 
+import copy as _copy
 import time as _time
 import math as _math
 from siriuspy.namesys.implementation import SiriusPVName
@@ -128,9 +129,10 @@ class PowerSupply:
         'Intlk7Label-Cte',
         )
 
-    def __init__(self, magnets, model, psname):
+    def __init__(self, magnets, model, psname, properties=None):
         """Gets and sets current [A]
         Connected magnets are processed after current is set.
+        Property table is built from siriuspy database unless given.
         """
         self.psname = psname
         if ':PU' in psname:
@@ -141,7 +143,10 @@ class PowerSupply:
         self._magnets = magnets
         self._psmodel = _PSSearch.conv_psname_2_psmodel(psname)
         self._pstype = _PSSearch.conv_psname_2_pstype(psname)
-        self.properties = self._get_propty_subset_database()
+        if properties is None:
+            self.properties = self._get_propty_subset_database()
+        else:
+            self.properties = _copy.deepcopy(properties)
         self.pulsedps = ':PU' in psname
         self.sofbps = 'SOFBMode-Sel' in self.properties
         self.refmonps = 'CurrentRef-Mon' in self.properties
@@ -152,6 +157,11 @@ class PowerSupply:
         # add power supply to beaglebones and get controling beaglebone
         self.beagle = PowerSupply.beaglebones.add_power_supply(self)
 
+    @property
+    def magnets(self):
+        """Magnets driven by power supply."""
+        return self._magnets
+
     def process(self):
         for m in self._magnets:
             m.process()
@@ -435,9 +445,11 @@ class PowerSupply:
 
 class FamilyPowerSupply(PowerSupply):
 
-    def __init__(self, magnets, model, psname, current=None):
+    def __init__(self, magnets, model, psname, current=None,
+                 properties=None):
         """Initialises current from average integrated field in magnets"""
-        super().__init__(magnets, model=model, psname=psname)
+        super().__init__(
+            magnets, model=model, psname=psname, properties=properties)
         if (current is None) and (len(magnets) > 0):
             total_current = 0.0
             for m in magnets:
@@ -449,8 +461,10 @@ class FamilyPowerSupply(PowerSupply):
 
 class IndividualPowerSupply(PowerSupply):
 
-    def __init__(self, magnets, model, psname, current=None):
-        super().__init__(magnets, model=model, psname=psname)
+    def __init__(self, magnets, model, psname, current=None,
+                 properties=None):
+        super().__init__(
+            magnets, model=model, psname=psname, properties=properties)
         # if len(magnets) > 1:
         #     raise Exception('Individual Power Supply')
         # elif (current is None) and (len(magnets) > 0):
@@ -468,8 +482,10 @@ class IndividualPowerSupply(PowerSupply):
 
 class PulsedMagnetPowerSupply(IndividualPowerSupply):
 
-    def __init__(self, magnets, model, psname, current=None):
-        super().__init__(magnets, model=model, psname=psname)
+    def __init__(self, magnets, model, psname, current=None,
+                 properties=None):
+        super().__init__(
+            magnets, model=model, psname=psname, properties=properties)
         if current is not None:
             self.current_sp = current
 
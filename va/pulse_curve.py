@@ -1,5 +1,6 @@
 import numpy as _np
-from siriuspy.clientweb import magnets_excitation_data_read
+
+from va import curves_cache as _curves_cache
 
 
 _HEADER_CHAR = '#'
@@ -28,13 +29,24 @@ class PulseCurve:
 
     def _load_pulse_curve_web(self, filename):
         try:
-            text = magnets_excitation_data_read(
-                '../pulse-curve-data/'+filename)
+            data = _curves_cache.get_curve(
+                '../pulse-curve-data/'+filename, self._parse_pulse_curve)
         except:
             print('Error trying to read excdata {}'.format(filename))
             raise
-        lines = text.split('\n')
-        self._process_pulse_curve_file_lines(lines)
+        self._rise_time = float(data['rise_time'])
+        self._flat_top = float(data['flat_top'])
+        self._pulse_time = data['pulse_time']
+        self._pulse_shape = data['pulse_shape']
+
+    def _parse_pulse_curve(self, text):
+        self._process_pulse_curve_file_lines(text.split('\n'))
+        return {
+            'rise_time': self._rise_time,
+            'flat_top': self._flat_top,
+            'pulse_time': self._pulse_time,
+            'pulse_shape': self._pulse_shape,
+            }
 
     def _process_pulse_curve_file_lines(self, lines):
         conversion_data = []
@@ -32,3 +32,4 @@ get_read_only_pvs = record_names.get_read_only_pvs
 get_read_write_pvs = record_names.get_read_write_pvs
 get_dynamical_pvs = record_names.get_dynamical_pvs
 get_constant_pvs = record_names.get_constant_pvs
+get_cache_key = record_names.get_cache_key
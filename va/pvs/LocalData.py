@@ -1,11 +1,75 @@
+import os as _os
+import sys as _sys
 import copy as _copy
+import json as _json
+import types as _types
+import hashlib as _hashlib
 
+import siriuspy as _siriuspy
 from siriuspy.namesys import SiriusPVName as _PVName
 from siriuspy.namesys import join_name as _join_name
 from siriuspy.pwrsupply import csdev as _pwrsupply_csdev
 
 from ..power_supply import PowerSupply as _PowerSupply
 from ..timesys import TimingSimulation
+from .. import utils as _utils
+from .. import __version__
+from .models import LAB_PREFIX, lab_models
+
+
+FAMILY_DATA_DIR = 'family_data'  # subdirectory of local cache
+DATABASE_DIR = 'pv_database'  # subdirectory of local cache
+
+
+def load_family_data(model, create_accelerator):
+    """Return family data of a model, from local cache if available.
+
+    Building family data requires the lattice to be created, so they are
+    cached by laboratory, lattice version, package version and version of
+    the laboratory models package.
+    """
+    fname = '{}-{}-{}-{}.json'.format(
+        LAB_PREFIX, model.lattice_version, __version__,
+        getattr(lab_models, '__version__', None))
+    path = _os.path.join(_utils.CACHE_DIR, FAMILY_DATA_DIR, fname)
+    try:
+        with open(path, 'r') as f:
+            return _json.load(f)
+    except (OSError, ValueError):
+        pass
+    family_data = model.get_family_data(create_accelerator())
+    try:
+        path = _os.path.join(_utils.get_cache_dir(FAMILY_DATA_DIR), fname)
+        with open(path + '.{}.tmp'.format(_os.getpid()), 'w') as f:
+            _json.dump(family_data, f, default=_to_json)
+        _os.replace(path + '.{}.tmp'.format(_os.getpid()), path)
+    except (OSError, TypeError) as err:
+        _utils.log('cache', 'unable to cache family data ({})'.format(err),
+                   'yellow')
+    return family_data
+
+
+def get_lazy_accelerator(module_name, create_accelerator):
+    """Return module __getattr__ creating attribute accelerator on first use.
+
+    Lattice is only created when needed, since each area structure process
+    creates its own.
+    """
+    def __getattr__(name):
+        if name == 'accelerator':
+            accelerator = create_accelerator()
+            setattr(_sys.modules[module_name], 'accelerator', accelerator)
+            return accelerator
+        raise AttributeError(
+            'module {!r} has no attribute {!r}'.format(module_name, name))
+    return __getattr__
+
+
+def _to_json(obj):
+    # numpy values and other sequences in family data
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    return list(obj)
 
 
 class DeviceNames:
@@ -248,15 +312,75 @@ class RecordNames:
         [type]: [description]
     """
     def __init__(self, device_names, model=None, family_data=None):
+        """Record names are built on first use. family_data may be a
+        function returning them."""
         self.family_data = family_data
         self.database = dict()
         self.model = model
         self.device_names = device_names
-        self._build_data()
+        self._built = False
+
+    # attributes saved in local cache of record names
+    _CACHED_ATTRS = (
+        'all_record_names', 'database', 'di_ro', 'di_rw', 'ps_ro', 'ps_rw',
+        'ap', 'rf', 'ti', 'ti_ro', 'ti_rw', 'fk', 'fk_pos', 'dynamical_pvs')
 
     def _build_data(self):
-        self._init_record_names()
-        self._init_dynamical_pvs()
+        if self._built:
+            return
+        if callable(self.family_data):
+            self.family_data = self.family_data()
+        if not self._load_cached_data():
+            self._init_record_names()
+            self._init_dynamical_pvs()
+            self._save_cached_data()
+        self._built = True
+
+    def _get_cache_path(self):
+        fname = '{}-{}.json'.format(LAB_PREFIX, self.device_names.section)
+        return _os.path.join(_utils.CACHE_DIR, DATABASE_DIR, fname)
+
+    def get_cache_key(self):
+        """Return hash of versions and device lists records depend on."""
+        if callable(self.family_data):
+            self.family_data = self.family_data()
+        dev = self.device_names
+        data = [
+            __version__, _siriuspy.__version__,
+            getattr(lab_models, '__version__', None),
+            getattr(self.model, 'lattice_version', None),
+            dev.el_names, dev.fam_names, dev.glob_names, dev.inj_names,
+            self.family_data]
+        text = _json.dumps(data, sort_keys=True, default=_to_json)
+        return _hashlib.sha1(text.encode()).hexdigest()
+
+    def _load_cached_data(self):
+        try:
+            with open(self._get_cache_path(), 'r') as f:
+                data = _json.load(f)
+            if data['key'] != self.get_cache_key():
+                return False
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        for attr, value in data['attrs'].items():
+            setattr(self, attr, value)
+        return True
+
+    def _save_cached_data(self):
+        path = self._get_cache_path()
+        tmp_path = path + '.{}.tmp'.format(_os.getpid())
+        attrs = {attr: getattr(self, attr) for attr in self._CACHED_ATTRS
+                 if hasattr(self, attr)}
+        try:
+            _utils.get_cache_dir(DATABASE_DIR)
+            with open(tmp_path, 'w') as f:
+                _json.dump(
+                    {'key': self.get_cache_key(), 'attrs': attrs}, f,
+                    default=_to_json)
+            _os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as err:
+            _utils.log('cache', 'unable to cache {} PV database ({})'.format(
+                self.device_names.section, err), 'yellow')
 
     def _init_record_names(self):
         self.all_record_names = {}
@@ -484,20 +608,27 @@ class RecordNames:
                 self.ps_ro.remove(pv)
 
     def get_all_record_names(self):
+        self._build_data()
         return _copy.deepcopy(self.all_record_names)
 
     def get_database(self):
-        return _copy.deepcopy(self.database)
+        """Return read-only view of PV database."""
+        self._build_data()
+        return _types.MappingProxyType(self.database)
 
     def get_read_only_pvs(self):
+        self._build_data()
         return self.di_ro + self.ap + self.ps_ro + self.ti_ro  # a copy!
 
     def get_read_write_pvs(self):
+        self._build_data()
         # a copy!
         return self.di_rw + self.ps_rw + self.fk + self.rf + self.ti_rw
 
     def get_dynamical_pvs(self):
+        self._build_data()
         return _copy.deepcopy(self.dynamical_pvs)
 
     def get_constant_pvs(self):
+        self._build_data()
         return _copy.deepcopy(self.fk_pos)
@@ -1,5 +1,7 @@
+import functools as _functools
 from .models import lab_models
-from .LocalData import DeviceNames, RecordNames
+from .LocalData import DeviceNames, RecordNames, load_family_data, \
+    get_lazy_accelerator
 
 
 # PVs not connecting to real machine:
@@ -77,10 +79,17 @@ device_names  = DeviceNames(
     _excitation_curves_mapping, _pulse_curve_mapping, model.get_family_data)
 
 
-accelerator = model.create_accelerator(energy=3e9)   # [3 GeV]
-family_data = model.get_family_data(accelerator)
+energy = 3e9  # [eV]
+
+
+def _create_accelerator():
+    return model.create_accelerator(energy=energy)
+
+
 # build record names
-record_names = RecordNames(device_names, model, family_data)
+record_names = RecordNames(
+    device_names, model,
+    _functools.partial(load_family_data, model, _create_accelerator))
 
 # --- Module API ---
 get_all_record_names = record_names.get_all_record_names
@@ -89,3 +98,6 @@ get_read_only_pvs = record_names.get_read_only_pvs
 get_read_write_pvs = record_names.get_read_write_pvs
 get_dynamical_pvs = record_names.get_dynamical_pvs
 get_constant_pvs = record_names.get_constant_pvs
+get_cache_key = record_names.get_cache_key
+
+__getattr__ = get_lazy_accelerator(__name__, _create_accelerator)
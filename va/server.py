@@ -1,10 +1,13 @@
 
 import time
+_import_time = time.time()  # start of startup timeline of server
 import signal
 import multiprocessing
+from concurrent import futures
 import pcaspy
 from va import driver
 from va import area_structure
+from va import accelerators_model
 from va import sirius_area_structures
 from va import utils
 
@@ -13,13 +16,18 @@ JOIN_TIMEOUT = 10.0
 INIT_TIMEOUT = 60*5
 
 
-def run(laboratory, prefix, only_orbit=False, print_pvs=True):
+def run(laboratory, prefix, only_orbit=False, print_pvs=True,
+        use_snapshots=False):
     """Start virtual accelerator with given PV prefix
 
     Keyword arguments:
     prefix -- prefix to be added to PVs
+    use_snapshots -- restore initialised models from local cache, if valid
     """
+    timeline = utils.StartupTimeline('server', _import_time)
+    timeline.mark('import')
     area_structure.SIMUL_ONLY_ORBIT = only_orbit
+    accelerators_model.USE_SNAPSHOTS = use_snapshots
     global start_event
     global stop_event
     start_event = multiprocessing.Event()
@@ -27,6 +35,7 @@ def run(laboratory, prefix, only_orbit=False, print_pvs=True):
     set_sigint_handler(set_global_stop_event)
 
     area_structures = get_area_structures()
+    build_pv_databases(area_structures)
     pv_database = get_pv_database(area_structures)
     pv_names = get_pv_names(area_structures)
     utils.print_banner(laboratory, prefix, **pv_names)
@@ -38,6 +47,7 @@ def run(laboratory, prefix, only_orbit=False, print_pvs=True):
     server = pcaspy.SimpleServer()
     prefix_ = prefix + '-' if prefix else prefix
     server.createPV(prefix_, pv_database)
+    timeline.mark('pv_database')
 
     num_parties = len(area_structures) + 1  # number of parties for barrier
     finalisation_barrier = multiprocessing.Barrier(
@@ -45,8 +55,11 @@ def run(laboratory, prefix, only_orbit=False, print_pvs=True):
 
     processes, driver_thread = create_and_start_processes_and_threads(
         area_structures, start_event, stop_event, finalisation_barrier)
+    timeline.mark('processes')
 
     wait_for_initialisation()
+    timeline.mark('sections')
+    timeline.save()
     while not stop_event.is_set():
         server.process(WAIT_TIMEOUT)
 
@@ -87,9 +100,40 @@ def get_virtual_pv_database():
         'type': 'float', 'value': 0}
     pv_database['SI-Glob:VA-Control:BeamCurrentDump-Cmd'] = {
         'type': 'int', 'value': 0}
+    pv_database[driver.DROPPED_WRITES_PV] = {
+        'type': 'int', 'value': 0}
+    pv_database[driver.OVERLOAD_PV] = {
+        'type': 'enum', 'enums': ['No', 'Yes'], 'value': 0}
+    for prefix in ('BO', 'SI'):
+        for stage in utils.PUBLICATION_STAGES:
+            pv_database[utils.get_stage_timestamp_pv_name(prefix, stage)] = {
+                'type': 'float', 'value': 0.0, 'prec': 3, 'unit': 's'}
+    prefixes = [As.prefix for As in get_area_structures()]
+    for prefix in prefixes + [utils.STATS_DRIVER_PREFIX]:
+        for name in utils.get_stats_names():
+            pv_database[utils.get_stats_pv_name(prefix, name)] = {
+                'type': 'float', 'value': 0.0, 'prec': 3}
     return pv_database
 
 
+def build_pv_databases(area_structures):
+    """Build PV databases of area structures in parallel.
+
+    Databases not in local cache require lattices to be created, so they
+    are built in worker processes, one per area structure, which fill the
+    cache. They are then loaded from it.
+    """
+    context = multiprocessing.get_context('fork')
+    with futures.ProcessPoolExecutor(
+            len(area_structures), mp_context=context) as executor:
+        for _ in executor.map(_build_pv_database, area_structures):
+            pass
+
+
+def _build_pv_database(area_structure_cls):
+    area_structure_cls.pv_module.get_database()
+
+
 def get_pv_database(area_structures):
     pv_database = {}
     for As in area_structures:
@@ -131,7 +175,6 @@ def create_and_start_processes_and_threads(
     for proc in processes:
         proc.set_others_queue(all_queues)
         proc.start()
-        time.sleep(0.2)
     driver_thread.start()
 
     return processes, driver_thread
@@ -161,4 +204,6 @@ def join_processes(processes, driver_thread):
     for process in processes:
         process.join(JOIN_TIMEOUT)
     driver_thread.join(JOIN_TIMEOUT)
+    for process in processes:
+        process.close_shared_arrays()
     utils.log('join', 'done')
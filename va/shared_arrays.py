@@ -0,0 +1,153 @@
+"""Module with shared memory publication of numeric PV values."""
+
+import re as _re
+import numpy as _np
+
+try:
+    from multiprocessing import shared_memory as _shared_memory
+except ImportError:  # python < 3.8
+    _shared_memory = None
+
+
+# PVs published through shared memory instead of interprocess queues
+SHARED_PVS_PATTERN = _re.compile(
+    r'.*:(DI-BPM.*:Pos(X|Y)-Mon|.*:BbBCurrent-Mon|.*:BbBCurrLT-Mon)$')
+_MAX_READ_TRIES = 10
+
+
+class SharedPVArrays:
+    """Float PV values of an area structure kept in a shared memory region.
+
+    The region starts with a sequence number used as a seqlock: the writer
+    makes it odd while values are being updated and even when it is done,
+    so that readers detect and discard torn reads. Values of all PVs are
+    stored contiguously after the header, each PV taking 'count' elements,
+    followed by flags of PVs already written.
+    """
+
+    def __init__(self, layout):
+        """Create shared memory region.
+
+        Keyword arguments:
+        layout -- dictionary with PV names and number of elements.
+        """
+        self._slots = dict()
+        size = 0
+        for pv_name, count in layout.items():
+            self._slots[pv_name] = (size, count)
+            size += count
+        shm = _shared_memory.SharedMemory(
+            create=True, size=8*(1 + size) + len(self._slots))
+        self._attach(shm, owner=True)
+        self._seq[0] = 0
+        self._data[:] = 0.0
+        self._written[:] = 0
+
+    def __getstate__(self):
+        # processes started by spawn or forkserver attach region by name
+        return {'name': self._shm.name, 'slots': self._slots}
+
+    def __setstate__(self, state):
+        self._slots = state['slots']
+        try:
+            shm = _shared_memory.SharedMemory(name=state['name'], track=False)
+        except TypeError:  # python < 3.13
+            shm = _shared_memory.SharedMemory(name=state['name'])
+        self._attach(shm, owner=False)
+
+    def _attach(self, shm, owner):
+        size = sum(count for _, count in self._slots.values())
+        self._slot_index = {
+            pv_name: i for i, pv_name in enumerate(self._slots)}
+        self._shm = shm
+        self._owner = owner
+        self._seq = _np.ndarray(
+            (1, ), dtype=_np.uint64, buffer=shm.buf)
+        self._data = _np.ndarray(
+            (size, ), dtype=_np.float64, buffer=shm.buf, offset=8)
+        # whether each slot has ever been written
+        self._written = _np.ndarray(
+            (len(self._slots), ), dtype=_np.uint8, buffer=shm.buf,
+            offset=8*(1 + size))
+        self._last_seq = 0
+        self._last_data = None
+        self._last_written = None
+
+    @classmethod
+    def from_database(cls, database):
+        """Create region for the shared PVs of a database, if any."""
+        if _shared_memory is None:
+            return None
+        layout = dict()
+        for pv_name in sorted(database):
+            if not SHARED_PVS_PATTERN.match(pv_name):
+                continue
+            if database[pv_name].get('type', 'float') != 'float':
+                continue
+            layout[pv_name] = database[pv_name].get('count', 1)
+        return cls(layout) if layout else None
+
+    def __contains__(self, pv_name):
+        return pv_name in self._slots
+
+    def fits(self, pv_name, value):
+        """Check whether value can be stored in the PV slot."""
+        if pv_name not in self._slots:
+            return False
+        try:
+            value = _np.asarray(value)
+        except (TypeError, ValueError):
+            return False
+        return value.dtype.kind in 'biuf' and \
+            value.size == self._slots[pv_name][1]
+
+    def write(self, values):
+        """Write PV values (dict) to shared memory as one update."""
+        self._seq[0] += 1  # odd: update in progress
+        for pv_name, value in values.items():
+            offset, count = self._slots[pv_name]
+            self._data[offset:offset+count] = value
+            self._written[self._slot_index[pv_name]] = 1
+        self._seq[0] += 1
+
+    def read(self):
+        """Return PV values changed since last read (dict)."""
+        for _ in range(_MAX_READ_TRIES):
+            seq = int(self._seq[0])
+            if seq == self._last_seq:
+                return dict()
+            if seq % 2:
+                continue
+            data = self._data.copy()
+            written = self._written.copy()
+            if int(self._seq[0]) == seq:
+                break
+        else:
+            return dict()
+
+        values = dict()
+        for i, (pv_name, (offset, count)) in enumerate(self._slots.items()):
+            if not written[i]:
+                continue
+            new = data[offset:offset+count]
+            if self._last_data is not None and self._last_written[i] and \
+                    _np.array_equal(
+                        new, self._last_data[offset:offset+count],
+                        equal_nan=True):
+                continue
+            values[pv_name] = new[0] if count == 1 else new
+        self._last_seq = seq
+        self._last_data = data
+        self._last_written = written
+        return values
+
+    def close(self):
+        """Release shared memory region."""
+        self._seq = self._data = self._written = None
+        self._shm.close()
+        if not self._owner:
+            return
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
@@ -22,6 +22,29 @@ VACA_LAB = _os.environ.get('VACA_LAB', default='sirius')
 VACA_LAB = 'VA-' if VACA_LAB == '' else VACA_LAB
 
 
+class _Database:
+    """PV database of area structure, built on first access.
+
+    Databases not in local cache require lattices to be created, which is
+    not to be done at import (see server.build_pv_databases).
+    """
+
+    def __get__(self, instance, owner):
+        return owner.pv_module.get_database()
+
+
+class _Fluctuation:
+    """PVFluctuation of area structure, created on first access."""
+
+    def __get__(self, instance, owner):
+        fluctuation = owner.__dict__.get('_pvs_fluctuation')
+        if fluctuation is None:
+            fluctuation = _PVFluctuation(
+                owner.database, owner.fluctuation_sigmas)
+            owner._pvs_fluctuation = fluctuation
+        return fluctuation
+
+
 class ASModel(_area_structure.AreaStructure):
     """Definition of AS area structure."""
 
@@ -32,8 +55,9 @@ class ASModel(_area_structure.AreaStructure):
     pv_module = _pvs_As
     device_names = pv_module.device_names
     prefix = device_names.section.upper()
-    database = pv_module.get_database()
-    pvs_fluctuation = _PVFluctuation(database, dict())
+    database = _Database()
+    fluctuation_sigmas = dict()
+    pvs_fluctuation = _Fluctuation()
 
     def __init__(self, **kwargs):
         """Initialize the instance."""
@@ -49,7 +73,8 @@ class ASModel(_area_structure.AreaStructure):
         self._timing.add_injection_callback(self._uuid, self._injection_cycle)
 
     def _callback(self, propty, value, **kwargs):
-        self._others_queue['driver'].put(('s', (propty, value)))
+        # timing callbacks may run in injection thread
+        self._post_pv_to_driver(propty, value)
 
     def _get_pv(self, pv_name):
         parts = _PVName(pv_name)
@@ -99,13 +124,13 @@ class LiModel(_accelerators_model.LinacModel):
     model_module = pv_module.model
     device_names = pv_module.device_names
     prefix = device_names.section.upper()
-    database = pv_module.get_database()
+    database = _Database()
     accelerator_data = model_module.accelerator_data
-    pvs_fluctuation = _PVFluctuation(
-        database, {
-            '.*:PS-.*:Current-Mon': 0.005,  # [A]
-            '.*:DI-.*:Pos(X|Y)-Mon': 500,  # [nm]
-            })
+    fluctuation_sigmas = {
+        '.*:PS-.*:Current-Mon': 0.005,  # [A]
+        '.*:DI-.*:Pos(X|Y)-Mon': 500,  # [nm]
+        }
+    pvs_fluctuation = _Fluctuation()
 
     # Injection parameters
     _downstream_accelerator_prefix = 'TB'
@@ -129,13 +154,13 @@ class TbModel(_accelerators_model.TLineModel):
     model_module = pv_module.model
     device_names = pv_module.device_names
     prefix = device_names.section.upper()
-    database = pv_module.get_database()
-    pvs_fluctuation = _PVFluctuation(
-        database, {
-            '.*:PS-.*:Current-Mon': 0.005,  # [A]
-            '.*:PU-.*:Voltage-Mon': 0.1,  # [V]
-            '.*:DI-.*:Pos(X|Y)-Mon': 500,  # [nm]
-            })
+    database = _Database()
+    fluctuation_sigmas = {
+        '.*:PS-.*:Current-Mon': 0.005,  # [A]
+        '.*:PU-.*:Voltage-Mon': 0.1,  # [V]
+        '.*:DI-.*:Pos(X|Y)-Mon': 500,  # [nm]
+        }
+    pvs_fluctuation = _Fluctuation()
 
     # Injection parameters
     nr_bunches = LiModel.nr_bunches
@@ -150,16 +175,16 @@ class BoModel(_accelerators_model.BoosterModel):
     model_module = pv_module.model
     device_names = pv_module.device_names
     prefix = device_names.section.upper()
-    database = pv_module.get_database()
-    pvs_fluctuation = _PVFluctuation(
-        database, {
-            '.*:PS-.*:Current-Mon': 0.005,  # [A]
-            '.*:PU-.*:Voltage-Mon': 0.1,  # [V]
-            '.*:DI-.*:Pos(X|Y)-Mon': 500,  # [nm]
-            '.*:DI-DCCT:Current-Mon': 0.002,  # [mA]
-            })
+    database = _Database()
+    fluctuation_sigmas = {
+        '.*:PS-.*:Current-Mon': 0.005,  # [A]
+        '.*:PU-.*:Voltage-Mon': 0.1,  # [V]
+        '.*:DI-.*:Pos(X|Y)-Mon': 500,  # [nm]
+        '.*:DI-DCCT:Current-Mon': 0.002,  # [mA]
+        }
+    pvs_fluctuation = _Fluctuation()
 
-    init_energy = _pvs_bo.accelerator.energy
+    init_energy = _pvs_bo.energy
 
     # Injection parameters
     nr_bunches = model_module.harmonic_number
@@ -179,13 +204,13 @@ class TsModel(_accelerators_model.TLineModel):
     model_module = pv_module.model
     device_names = pv_module.device_names
     prefix = device_names.section.upper()
-    database = pv_module.get_database()
-    pvs_fluctuation = _PVFluctuation(
-        database, {
-            '.*:PS-.*:Current-Mon': 0.005,  # [A]
-            '.*:PU-.*:Voltage-Mon': 0.1,  # [V]
-            '.*:DI-.*:Pos(X|Y)-Mon': 500,  # [nm]
-            })
+    database = _Database()
+    fluctuation_sigmas = {
+        '.*:PS-.*:Current-Mon': 0.005,  # [A]
+        '.*:PU-.*:Voltage-Mon': 0.1,  # [V]
+        '.*:DI-.*:Pos(X|Y)-Mon': 500,  # [nm]
+        }
+    pvs_fluctuation = _Fluctuation()
 
     # Injection parameters
     nr_bunches = BoModel.nr_bunches
@@ -200,14 +225,14 @@ class SiModel(_accelerators_model.StorageRingModel):
     model_module = pv_module.model
     device_names = pv_module.device_names
     prefix = device_names.section.upper()
-    database = pv_module.get_database()
-    pvs_fluctuation = _PVFluctuation(
-        database, {
-            '.*:PS-.*:Current-Mon': 0.005,  # [A]
-            '.*:PU-.*:Voltage-Mon': 0.1,  # [V]
-            '.*:DI-.*:Pos(X|Y)-Mon': 500,  # [nm]
-            '.*:DI-DCCT:Current-Mon': 0.002,  # [mA]
-            })
+    database = _Database()
+    fluctuation_sigmas = {
+        '.*:PS-.*:Current-Mon': 0.005,  # [A]
+        '.*:PU-.*:Voltage-Mon': 0.1,  # [V]
+        '.*:DI-.*:Pos(X|Y)-Mon': 500,  # [nm]
+        '.*:DI-DCCT:Current-Mon': 0.002,  # [mA]
+        }
+    pvs_fluctuation = _Fluctuation()
 
     # Injection parameters
     nr_bunches = model_module.harmonic_number
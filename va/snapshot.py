@@ -0,0 +1,122 @@
+"""Module with snapshots of initialised accelerator models."""
+
+import os as _os
+import pickle as _pickle
+import tempfile as _tempfile
+import pyaccel as _pyaccel
+
+from va import __version__
+from va import utils
+
+
+SNAPSHOTS_DIR = 'snapshots'  # subdirectory of local cache
+KEY_LENGTH = 12  # characters of database key in snapshot name
+_LATTICE_FILE = 'lattice.txt'
+_STATE_FILE = 'state.pkl'
+
+
+def is_picklable(obj):
+    """Check whether object can be saved in snapshot."""
+    try:
+        _pickle.dumps(obj, protocol=_pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return False
+    return True
+
+
+class Snapshot:
+    """Initialised state of an accelerator model kept in the local cache.
+
+    Snapshots are keyed by section, lattice version, package version and
+    a key of the PV database (versions of the packages and device lists it
+    depends on), so that they are ignored when any of them changes. The lattice, as
+    created before magnets are initialised, is kept as a pyaccel flat file.
+    Power supply property tables and memoized model results (orbit, optics
+    and equilibrium parameters) are pickled.
+    """
+
+    def __init__(self, prefix, lattice_version, key=None, only_orbit=False):
+        """Locate snapshot of an accelerator model.
+
+        Keyword arguments:
+        prefix -- section prefix
+        lattice_version -- lattice version of model
+        key -- hash of versions and device lists of PV database, if any
+        only_orbit -- whether model simulates only orbit
+        """
+        name = '{}-{}-{}'.format(prefix, lattice_version, __version__)
+        if key is not None:
+            name += '-' + key[:KEY_LENGTH]
+        if only_orbit:
+            name += '-orbit'
+        self._dir = _os.path.join(utils.CACHE_DIR, SNAPSHOTS_DIR, name)
+        self._state = None
+
+    @property
+    def name(self):
+        """Name of snapshot directory."""
+        return _os.path.basename(self._dir)
+
+    def load_lattice(self):
+        """Return accelerator saved in snapshot, or None."""
+        try:
+            return _pyaccel.lattice.read_flat_file(
+                _os.path.join(self._dir, _LATTICE_FILE))
+        except Exception:
+            return None
+
+    def load_state(self):
+        """Return dictionary of state saved in snapshot, or None."""
+        if self._state is None:
+            try:
+                with open(_os.path.join(self._dir, _STATE_FILE), 'rb') as f:
+                    self._state = _pickle.load(f)
+            except Exception:
+                return None
+        return self._state
+
+    def save_lattice(self, accelerator):
+        """Save lattice, invalidating any state saved before."""
+        self._remove(_STATE_FILE)
+        self._state = None
+        tmp_path, path = self._create_temp_file(_LATTICE_FILE)
+        try:
+            _pyaccel.lattice.write_flat_file(accelerator, tmp_path)
+            _os.replace(tmp_path, path)
+        finally:
+            self._remove_temp_file(tmp_path)
+
+    def save_state(self, state):
+        """Save state (dict), which makes snapshot valid."""
+        tmp_path, path = self._create_temp_file(_STATE_FILE)
+        try:
+            with open(tmp_path, 'wb') as f:
+                _pickle.dump(state, f, protocol=_pickle.HIGHEST_PROTOCOL)
+            _os.replace(tmp_path, path)
+        finally:
+            self._remove_temp_file(tmp_path)
+        self._state = state
+
+    def _create_temp_file(self, filename):
+        """Return unique temporary path and final path of snapshot file.
+
+        Files are written to temporary paths and then renamed, so that
+        processes saving the same snapshot do not see partial files.
+        """
+        dirname = utils.get_cache_dir(SNAPSHOTS_DIR, self.name)
+        fd, tmp_path = _tempfile.mkstemp(prefix=filename + '.', dir=dirname)
+        _os.close(fd)
+        return tmp_path, _os.path.join(dirname, filename)
+
+    @staticmethod
+    def _remove_temp_file(path):
+        try:
+            _os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _remove(self, filename):
+        try:
+            _os.remove(_os.path.join(self._dir, filename))
+        except FileNotFoundError:
+            pass
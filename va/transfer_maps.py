@@ -0,0 +1,176 @@
+"""Module with incremental linear optics from cached transfer maps."""
+
+import numpy as _np
+import pyaccel as _pyaccel
+
+
+ORBIT_TOLERANCE = 10e-6  # [m, rad] orbit drift above which all maps are
+                         # recalculated
+MAX_CHANGED_FRACTION = 0.1  # fraction of changed maps above which all are
+                            # recalculated in a single pass
+
+
+class TransferMaps:
+    """Transfer matrices of lattice elements, recomputed only when changed.
+
+    Matrices are linearised around the orbit at the entrance of each element
+    and are recalculated only for elements marked as changed (by magnets,
+    through callbacks). Cumulative products are then updated downstream of
+    the first changed element. Orbit drift changes maps of elements that
+    depend on orbit (nonlinear fields, kinematic terms); it is absorbed
+    once it exceeds ORBIT_TOLERANCE at any of them, when all maps are
+    recalculated with a single tracking of the whole lattice, as when many
+    maps changed.
+    """
+
+    def __init__(self, accelerator):
+        """Create cache of transfer maps.
+
+        Keyword arguments:
+        accelerator -- accelerator whose elements maps are calculated.
+        """
+        self._accelerator = accelerator
+        nr_elements = len(accelerator)
+        self._spos = _np.asarray(_pyaccel.lattice.find_spos(
+            accelerator, indices='open'))
+        self._matrices = _np.zeros((nr_elements, 6, 6))
+        self._cumulative = _np.zeros((nr_elements+1, 6, 6))
+        self._cumulative[0] = _np.eye(6)
+        self._orbit = _np.full((6, nr_elements), _np.nan)
+        self._orbit_dependent = _np.ones(nr_elements, dtype=bool)
+        self._energy = None
+        self._radiation_on = None
+        self._changed = set(range(nr_elements))
+
+    @property
+    def accelerator(self):
+        """Accelerator whose transfer maps are cached."""
+        return self._accelerator
+
+    def invalidate(self, indices=None):
+        """Mark elements as changed, all of them if indices is None."""
+        if indices is None:
+            self._changed.update(range(len(self._matrices)))
+        else:
+            self._changed.update(indices)
+
+    def get_cumulative_matrices(self, orbit):
+        """Return transfer matrices from lattice start to element entrances.
+
+        Keyword arguments:
+        orbit -- orbit at entrance of elements (6xN array)
+
+        Last matrix is the one from lattice start to its end.
+        """
+        nr_elements = len(self._matrices)
+        orbit = _np.asarray(orbit)[:, :nr_elements]
+        if self._accelerator.energy != self._energy or \
+                self._accelerator.radiation_on != self._radiation_on:
+            self._energy = self._accelerator.energy
+            self._radiation_on = self._accelerator.radiation_on
+            self.invalidate()
+        drift = orbit[:, self._orbit_dependent] - \
+            self._orbit[:, self._orbit_dependent]
+        if not _np.all(_np.abs(drift) <= ORBIT_TOLERANCE):
+            self.invalidate()
+        if not self._changed:
+            return self._cumulative
+
+        changed = sorted(self._changed)
+        self._changed.clear()
+        for idx in changed:
+            self._orbit_dependent[idx] = _is_orbit_dependent(
+                self._accelerator[idx])
+        if len(changed) > MAX_CHANGED_FRACTION*nr_elements:
+            self._calc_all_matrices(orbit)
+            return self._cumulative
+        self._orbit[:, changed] = orbit[:, changed]
+        for idx in changed:
+            self._matrices[idx] = _pyaccel.tracking.find_m66(
+                self._accelerator[idx:idx+1], indices='m66',
+                fixed_point=orbit[:, idx])
+        for idx in range(changed[0], nr_elements):
+            self._cumulative[idx+1] = \
+                self._matrices[idx] @ self._cumulative[idx]
+        return self._cumulative
+
+    def _calc_all_matrices(self, orbit):
+        cumul, _ = _pyaccel.tracking.find_m66(
+            self._accelerator, indices='closed', fixed_point=orbit[:, 0])
+        self._cumulative[:] = cumul
+        # element maps from consecutive cumulative ones: M_i C_i = C_i+1
+        self._matrices[:] = _np.linalg.solve(
+            self._cumulative[:-1].transpose(0, 2, 1),
+            self._cumulative[1:].transpose(0, 2, 1)).transpose(0, 2, 1)
+        self._orbit[:] = orbit
+
+    def calc_twiss(self, orbit, init_twiss=None):
+        """Calculate twiss parameters at element entrances.
+
+        Keyword arguments:
+        orbit -- orbit at entrance of elements (6xN array)
+        init_twiss -- twiss at lattice start. If None, periodic solution.
+
+        Returns TwissArray and transfer matrix of the whole lattice.
+        """
+        cumul = self.get_cumulative_matrices(orbit)
+        m66 = cumul[-1].copy()
+        if init_twiss is None:
+            init_x = _calc_periodic_twiss(m66[0:2, 0:2])
+            init_y = _calc_periodic_twiss(m66[2:4, 2:4])
+            # dispersion function closed over lattice
+            eta0 = _np.linalg.solve(_np.eye(4) - m66[:4, :4], m66[:4, 4])
+        else:
+            init_x = (init_twiss.betax, init_twiss.alphax, init_twiss.mux)
+            init_y = (init_twiss.betay, init_twiss.alphay, init_twiss.muy)
+            eta0 = _np.array([
+                init_twiss.etax, init_twiss.etapx,
+                init_twiss.etay, init_twiss.etapy])
+
+        cumul = cumul[:-1]
+        betax, alphax, mux = _propagate_twiss(cumul[:, 0:2, 0:2], *init_x)
+        betay, alphay, muy = _propagate_twiss(cumul[:, 2:4, 2:4], *init_y)
+        eta = cumul[:, :4, :4] @ eta0 + cumul[:, :4, 4]
+
+        twiss = _pyaccel.optics.TwissArray(len(cumul))
+        twiss.spos = self._spos
+        twiss.betax, twiss.alphax, twiss.mux = betax, alphax, mux
+        twiss.betay, twiss.alphay, twiss.muy = betay, alphay, muy
+        twiss.etax, twiss.etapx = eta[:, 0], eta[:, 1]
+        twiss.etay, twiss.etapy = eta[:, 2], eta[:, 3]
+        twiss.co = _np.asarray(orbit)[:, :len(cumul)]
+        return twiss, m66
+
+
+def _is_orbit_dependent(element):
+    """Check whether linear map of element depends on orbit.
+
+    Maps of thick elements depend on orbit at least through kinematic
+    terms, while those of thin elements (markers, BPMs, thin kicks) only
+    through nonlinear fields or RF.
+    """
+    if element.length != 0 or element.voltage != 0:
+        return True
+    return bool(_np.any(_np.asarray(element.polynom_b)[2:] != 0) or
+                _np.any(_np.asarray(element.polynom_a)[2:] != 0))
+
+
+def _calc_periodic_twiss(matrix):
+    cos_mu = (matrix[0, 0] + matrix[1, 1])/2
+    if abs(cos_mu) >= 1:
+        raise _pyaccel.optics.OpticsException('unstable one-turn matrix')
+    sin_mu = _np.sign(matrix[0, 1])*_np.sqrt(1 - cos_mu**2)
+    beta = matrix[0, 1]/sin_mu
+    alpha = (matrix[0, 0] - matrix[1, 1])/2/sin_mu
+    return beta, alpha, 0.0
+
+
+def _propagate_twiss(matrices, beta0, alpha0, mu0):
+    m11, m12 = matrices[:, 0, 0], matrices[:, 0, 1]
+    m21, m22 = matrices[:, 1, 0], matrices[:, 1, 1]
+    a = m11*beta0 - m12*alpha0
+    b = m21*beta0 - m22*alpha0
+    beta = (a**2 + m12**2)/beta0
+    alpha = -(a*b + m12*m22)/beta0
+    mu = mu0 + _np.unwrap(_np.arctan2(m12, a))
+    return beta, alpha, mu
@@ -1,12 +1,34 @@
 
+import os
+import json
 import time
+import queue as _queue
 import datetime
+import collections
+import numpy as _np
+from multiprocessing import connection as _connection
 from termcolor import colored
 from va import __version__ as VERSION
 
 
 UNDEF_VALUE = 0.0
 PREFIX_LEN = 2
+CACHE_DIR = os.environ.get(
+    'VACA_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'va'))
+
+# Performance counters published as VA-Control PVs
+STATS_INTERVAL = 1.0  # [s] interval between statistics publications
+STATS_WINDOW = 100  # number of samples kept for time statistics
+STATS_TIMES = ('Cycle', 'Requests', 'State', 'PVs', 'Solve')  # [ms]
+STATS_RATES = ('Msg', 'SetParam')  # [1/s]
+STATS_GAUGES = ('QueueSize', )
+STATS_DRIVER_PREFIX = 'Drv'
+
+# Startup timelines, appended to a file per version in local cache
+STARTUP_DIR = 'startup'
+
+# Stages in which ring model results are published
+PUBLICATION_STAGES = ('Orbit', 'Tunes', 'Lifetime', 'Efficiency')
 
 # Interprocess communication commands - move here
 
@@ -75,6 +97,15 @@ def print_banner(
     print(r"")
 
 
+def get_pv_names_table(database):
+    """Return PV names of a database in a fixed order.
+
+    Area structures and driver index PVs in bulk messages by their position
+    in this table.
+    """
+    return sorted(database.keys())
+
+
 def log(message1='', message2='', c='white', a=None):
     t0 = time.time()
     st = datetime.datetime.fromtimestamp(t0).strftime('%Y-%m-%d %H:%M:%S')
@@ -97,3 +128,184 @@ def _wait_interval(start_time, interval):
     delta_t = time.time() - start_time
     if 0 < delta_t < interval:
         time.sleep(interval - delta_t)
+
+
+def process_and_wait_events(processing_function, interval, waitables,
+                            has_pending_work=None):
+    """Process and wait until there is data to be read or interval expires.
+
+    Keyword arguments:
+    processing_function -- function to be run
+    interval -- maximum waiting time, for periodic processing [s]
+    waitables -- connections or file descriptors that wake up processing
+    has_pending_work -- function checking whether waiting is to be skipped
+    """
+    start_time = time.time()
+    processing_function()
+    if has_pending_work is not None and has_pending_work():
+        return
+    timeout = interval - (time.time() - start_time)
+    if timeout > 0:
+        _connection.wait(waitables, timeout)
+
+
+def get_queue_waitable(queue):
+    """Return object that becomes readable when queue receives data."""
+    # NOTE: multiprocessing.Queue does not expose its pipe publicly.
+    return queue._reader
+
+
+def get_cache_dir(*subdirs):
+    """Return directory in local cache, creating it if needed."""
+    path = os.path.join(CACHE_DIR, *subdirs)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def get_stats_names():
+    """Return names of statistics published by PerformanceCounters."""
+    names = []
+    for name in STATS_TIMES:
+        names += [name+'TimeP50', name+'TimeP95', name+'TimeMax']
+    names += [name+'Rate' for name in STATS_RATES]
+    names += list(STATS_GAUGES)
+    return names
+
+
+def get_stats_pv_name(prefix, name):
+    """Return name of PV publishing statistic of an area structure."""
+    return 'AS-Glob:VA-Control:{}{}-Mon'.format(prefix, name)
+
+
+def get_stage_timestamp_pv_name(prefix, stage):
+    """Return name of PV with time of last publication of a stage."""
+    return '{}-Glob:VA-Control:{}Timestamp-Mon'.format(prefix, stage)
+
+
+class QueueOutbox:
+    """Messages waiting for room in a bounded queue.
+
+    Messages are put in queue in the order they were sent, as soon as there
+    is room for them. A message sent with a key replaces the one waiting
+    with the same key, so that only the latest of superseded messages is
+    put in queue.
+    """
+
+    def __init__(self, queue):
+        self._queue = queue
+        self._messages = collections.OrderedDict()
+        self._count = 0
+
+    def __len__(self):
+        return len(self._messages)
+
+    def put(self, message, key=None):
+        """Send message; return whether all messages are in queue."""
+        if key is None:
+            self._count += 1
+            key = (None, self._count)
+        else:
+            self._messages.pop(key, None)
+        self._messages[key] = message
+        return self.flush()
+
+    def flush(self):
+        """Put waiting messages in queue; return whether all were put."""
+        while self._messages:
+            key, message = next(iter(self._messages.items()))
+            try:
+                self._queue.put_nowait(message)
+            except _queue.Full:
+                return False
+            del self._messages[key]
+        return True
+
+
+class PerformanceCounters:
+    """Rolling statistics of processing times, event rates and gauges."""
+
+    def __init__(self, window=STATS_WINDOW):
+        self._times = collections.defaultdict(
+            lambda: collections.deque(maxlen=window))
+        self._counts = collections.defaultdict(int)
+        self._gauges = dict()
+        self._start_time = time.time()
+
+    def add_time(self, name, value):
+        """Add time sample [s] to statistics."""
+        self._times[name].append(value)
+
+    def add_count(self, name, value=1):
+        """Count events, reported as rates."""
+        self._counts[name] += value
+
+    def set_gauge(self, name, value):
+        """Set instantaneous value."""
+        self._gauges[name] = value
+
+    def is_due(self, interval=STATS_INTERVAL):
+        """Check whether statistics are due to be published."""
+        return time.time() - self._start_time >= interval
+
+    def get_summary(self):
+        """Return statistics by name and restart counting events."""
+        now = time.time()
+        elapsed = now - self._start_time
+        summary = dict()
+        for name, samples in self._times.items():
+            if not samples:
+                continue
+            samples = 1000*_np.array(samples)
+            p50, p95 = _np.percentile(samples, (50, 95))
+            summary[name+'TimeP50'] = p50
+            summary[name+'TimeP95'] = p95
+            summary[name+'TimeMax'] = samples.max()
+        for name, count in self._counts.items():
+            summary[name+'Rate'] = count/elapsed if elapsed > 0 else 0.0
+        summary.update(self._gauges)
+        self._counts.clear()
+        self._start_time = now
+        return summary
+
+
+class StartupTimeline:
+    """Durations of startup phases of a process."""
+
+    def __init__(self, name, start_time=None):
+        """Start timeline.
+
+        Keyword arguments:
+        name -- name of process (area structure prefix or 'server')
+        start_time -- time of timeline start; if None, current time
+        """
+        self._name = name
+        self._start_time = time.time() if start_time is None else start_time
+        self._last_time = self._start_time
+        self._phases = collections.OrderedDict()
+
+    def mark(self, phase):
+        """Add time elapsed since last mark to phase."""
+        now = time.time()
+        self._phases[phase] = \
+            self._phases.get(phase, 0.0) + now - self._last_time
+        self._last_time = now
+
+    def save(self):
+        """Log phase durations and append them to timeline file."""
+        total = self._last_time - self._start_time
+        log('init', '{}: startup {}, total {:.0f} ms'.format(
+            self._name, ', '.join('{} {:.0f} ms'.format(phase, 1e3*value)
+                                  for phase, value in self._phases.items()),
+            1e3*total), 'green')
+        record = {
+            'version': VERSION, 'name': self._name,
+            'start': self._start_time, 'phases': self._phases,
+            'total': total}
+        try:
+            path = os.path.join(get_cache_dir(STARTUP_DIR),
+                                'startup-{}.jsonl'.format(VERSION))
+            with open(path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        except OSError as err:
+            log('init', '{}: unable to save startup timeline ({})'.format(
+                self._name, err), 'yellow')